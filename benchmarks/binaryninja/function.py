@@ -0,0 +1,30 @@
+class IndirectBranchInfo(object):
+    def __init__(self, source_arch, source_addr, dest_arch, dest_addr,
+                 auto_defined=False):
+        self.source_arch = source_arch
+        self.source_addr = source_addr
+        self.dest_arch = dest_arch
+        self.dest_addr = dest_addr
+        self.auto_defined = auto_defined
+
+
+class _FunctionAssociatedDataStore(dict):
+    """Per function session data, falling back to the defaults set with
+    Function.set_default_session_data."""
+
+    def __init__(self, defaults):
+        super(_FunctionAssociatedDataStore, self).__init__()
+        self._defaults = defaults
+
+    def __getattr__(self, name):
+        if name in self:
+            return self[name]
+        if name in self._defaults:
+            return self._defaults[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            dict.__setattr__(self, name, value)
+        else:
+            self[name] = value
@@ -0,0 +1,7 @@
+def _no_input(*args, **kwargs):
+    return None
+
+
+get_text_line_input = get_int_input = get_choice_input = _no_input
+get_open_filename_input = get_save_filename_input = _no_input
+get_directory_name_input = show_message_box = _no_input
@@ -0,0 +1,183 @@
+"""
+Benchmark corpus: the examples, synthetic Solidity-like contracts (also
+grown to the EIP-170 runtime and EIP-3860 initcode size limits) and
+adversarial inputs. Everything is generated deterministically.
+"""
+import os
+import glob
+import random
+
+from pyevmasm import instruction_tables
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'examples')
+
+RUNTIME_SIZE_LIMIT = 0x6000
+INITCODE_SIZE_LIMIT = 0xc000
+
+_TABLE = instruction_tables['istanbul']
+
+
+def _opcode(name):
+    return _TABLE[name].opcode
+
+
+def assemble(items):
+    """
+    Assemble a list of opcode names, ('PUSH', value), ('PUSHL', label) and
+    ('LABEL', label) items. Labels are pushed as PUSH2 and mark a JUMPDEST.
+    """
+    labels = {}
+    pc = 0
+    for item in items:
+        if isinstance(item, str):
+            pc += 1
+        elif item[0] == 'LABEL':
+            labels[item[1]] = pc
+            pc += 1
+        elif item[0] == 'PUSHL':
+            pc += 3
+        else:
+            pc += 1 + max(1, (item[1].bit_length() + 7) // 8)
+
+    code = bytearray()
+    for item in items:
+        if isinstance(item, str):
+            code.append(_opcode(item))
+        elif item[0] == 'LABEL':
+            code.append(_opcode('JUMPDEST'))
+        elif item[0] == 'PUSHL':
+            code.append(_opcode('PUSH2'))
+            code += labels[item[1]].to_bytes(2, 'big')
+        else:
+            size = max(1, (item[1].bit_length() + 7) // 8)
+            code.append(_opcode('PUSH1') + size - 1)
+            code += item[1].to_bytes(size, 'big')
+    return bytes(code)
+
+
+def _function_body(rng, index, helpers):
+    """A public function: decode an argument, touch a mapping and a plain
+    slot, call an internal helper and loop a little."""
+    loop = 'loop{}'.format(index)
+    done = 'done{}'.format(index)
+    ret = 'ret{}'.format(index)
+    slot = rng.randrange(16)
+    items = [
+        ('LABEL', 'f{}'.format(index)),
+        ('PUSH', 4), 'CALLDATALOAD',
+        # mapping[msg.sender] = arg
+        'CALLER', ('PUSH', 0), 'MSTORE', ('PUSH', slot), ('PUSH', 0x20),
+        'MSTORE', 'DUP1', ('PUSH', 0x40), ('PUSH', 0), 'SHA3', 'SSTORE',
+        # internal call with return address on the stack
+        ('PUSHL', ret), 'DUP2', ('PUSHL', rng.choice(helpers)), 'JUMP',
+        ('LABEL', ret),
+        # bounded loop
+        ('PUSH', 0),
+        ('LABEL', loop),
+        'DUP1', ('PUSH', 8), 'GT', 'ISZERO', ('PUSHL', done), 'JUMPI',
+        ('PUSH', 1), 'ADD', ('PUSHL', loop), 'JUMP',
+        ('LABEL', done),
+        'POP', ('PUSH', slot + 16), 'SSTORE', 'STOP',
+    ]
+    return items
+
+
+def _helper(index):
+    # arg, return address -> arg * 2 + 1
+    return [('LABEL', 'h{}'.format(index)), ('PUSH', 2), 'MUL', ('PUSH', 1),
+            'ADD', 'SWAP1', 'JUMP']
+
+
+def synthetic(functions, seed=0, size=None, dead=0):
+    """
+    A dispatcher over `functions` selectors, followed by `dead` functions
+    it doesn't dispatch to. With size, functions are added until the code
+    is as close to size bytes as possible.
+    """
+    count = functions
+    while True:
+        code = _synthetic(random.Random(seed), count, dead)
+        if size is None or len(code) >= size:
+            break
+        # grow proportionally, then settle
+        count = max(count + 1, count * size // max(len(code), 1))
+    if size is not None:
+        while len(code) > size and count > 1:
+            count -= max(1, (len(code) - size) // 120)
+            code = _synthetic(random.Random(seed), count, dead)
+        # fill up with unreachable data after the last STOP
+        code += b'\xfe' * (size - len(code))
+    return code
+
+
+def _synthetic(rng, count, dead=0):
+    selectors = [rng.getrandbits(32) for _ in range(count)]
+    helpers = ['h{}'.format(i) for i in range(max(1, count // 4))]
+    items = [('PUSH', 0x80), ('PUSH', 0x40), 'MSTORE',
+             ('PUSH', 0), 'CALLDATALOAD', ('PUSH', 0xe0), 'SHR']
+    for i, selector in enumerate(selectors):
+        items += ['DUP1', ('PUSH', selector), 'EQ',
+                  ('PUSHL', 'f{}'.format(i)), 'JUMPI']
+    items += [('PUSH', 0), 'DUP1', 'REVERT']
+    for i in range(count + dead):
+        items += _function_body(rng, i, helpers)
+    for i in range(len(helpers)):
+        items += _helper(i)
+    return assemble(items)
+
+
+def deep_calls(depth):
+    """Internal functions calling each other `depth` deep, for VSA."""
+    items = [('PUSHL', 'end'), ('PUSH', 1), ('PUSHL', 'c0'), 'JUMP',
+             ('LABEL', 'end'), 'STOP']
+    for i in range(depth):
+        items += [('LABEL', 'c{}'.format(i)), ('PUSH', 1), 'ADD']
+        if i + 1 < depth:
+            items += [('PUSHL', 'r{}'.format(i)), 'SWAP1',
+                      ('PUSHL', 'c{}'.format(i + 1)), 'JUMP',
+                      ('LABEL', 'r{}'.format(i))]
+        items += ['SWAP1', 'JUMP']
+    return assemble(items)
+
+
+def adversarial():
+    rng = random.Random(0xbad)
+    # CFG construction takes time and memory quadratic in the number of
+    # JUMPDESTs, a 1 KB flood already peaks at about 250 MB
+    yield 'jumpdest-flood', b'\x5b' * 0x400
+    # PUSH32 whose immediates are full of JUMPDEST-looking bytes
+    yield 'push32-immediates', (b'\x7f' + b'\x5b' * 32 + b'\x50') * (
+        RUNTIME_SIZE_LIMIT // 34)
+    yield 'random-bytes', bytes(rng.getrandbits(8)
+                                for _ in range(RUNTIME_SIZE_LIMIT))
+    yield 'truncated-push', synthetic(4) + b'\x7f\x01\x02'
+    yield 'deep-internal-calls', deep_calls(400)
+    yield 'many-selectors', synthetic(200, seed=2)
+
+
+def corpus(names=None):
+    """Yield (name, code) of the benchmark contracts, optionally only the
+    ones whose name is in names."""
+    def wanted(name):
+        return names is None or name in names
+
+    for filename in sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.evm'))):
+        name = 'examples/' + os.path.basename(filename)
+        if wanted(name):
+            with open(filename, 'rb') as f:
+                yield name, f.read()
+    generated = [
+        ('synthetic-10', lambda: synthetic(10)),
+        ('synthetic-100', lambda: synthetic(100, seed=1)),
+        ('padded-24k', lambda: synthetic(20, size=RUNTIME_SIZE_LIMIT)),
+        ('padded-48k', lambda: synthetic(20, size=INITCODE_SIZE_LIMIT)),
+        # dispatcher stubs left behind without callers
+        ('dead-code', lambda: synthetic(20, seed=3, dead=20)),
+    ]
+    for name, make in generated:
+        if wanted(name):
+            yield name, make()
+    for name, code in adversarial():
+        if wanted(name):
+            yield name, code
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Benchmark ethersplay's hot paths against the stand-in binaryninja module in
+this directory:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json
+
+Times are the best of --repeat runs. With --baseline, metrics that got
+slower by more than --tolerance are reported and the exit status is 1.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# the stand-in must win over an installed Binary Ninja
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import binaryninja  # noqa: E402
+from binaryninja import Architecture, BinaryView, LowLevelILFunction  # noqa
+
+from evm_cfg_builder.cfg import CFG  # noqa: E402
+
+from ethersplay import core, snapshot  # noqa: E402
+from ethersplay.annotator import annotate_all  # noqa: E402
+from ethersplay.coverage import GraphColorer  # noqa: E402
+from ethersplay.decode import decode, basic_blocks  # noqa: E402
+from ethersplay.evm import EVMView  # noqa: E402
+
+from contracts import corpus  # noqa: E402
+
+# metrics where bigger is better, the rest are times in seconds
+RATES = ('decode_ips', 'info_ips', 'text_ips', 'lift_ips')
+
+# views are analyzed from scratch, bench_snapshot uses its own directory
+snapshot.SNAPSHOT_PATH = None
+
+
+def best_time(repeat, fn):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def _rate(count, elapsed):
+    return count / elapsed if elapsed else 0.0
+
+
+def bench_arch(code, instructions, repeat):
+    arch = Architecture['EVM']
+    pcs = [ins.pc for ins in instructions]
+    window = arch.max_instr_length
+    callback = binaryninja._callback
+
+    def info():
+        for pc in pcs:
+            callback(arch.get_instruction_info, code[pc:pc + window], pc)
+
+    def text():
+        for pc in pcs:
+            callback(arch.get_instruction_text, code[pc:pc + window], pc)
+
+    def lift():
+        expressions = 0
+        for block in basic_blocks(instructions):
+            il = LowLevelILFunction()
+            for ins in block:
+                callback(arch.get_instruction_low_level_il,
+                         code[ins.pc:ins.pc + window], ins.pc, il)
+            expressions += il.expression_count
+        return expressions
+
+    binaryninja.stats.clear()
+
+    info_time, _ = best_time(repeat, info)
+    text_time, _ = best_time(repeat, text)
+    lift_time, expressions = best_time(repeat, lift)
+    return {
+        'info_ips': _rate(len(pcs), info_time),
+        'text_ips': _rate(len(pcs), text_time),
+        'lift_ips': _rate(len(pcs), lift_time),
+        'lift_expressions': expressions,
+        # instructions the lifter or disassembler raises on
+        'callback_errors': binaryninja.stats['callback_errors'] // (
+            3 * repeat),
+    }
+
+
+def load_view(code):
+    view = EVMView(BinaryView.new(code))
+    view.init()
+    return view
+
+
+def bench_view(code, repeat):
+    rv = {}
+    rv['view_load'], view = best_time(repeat, lambda: load_view(code))
+
+    binaryninja.stats.clear()
+    start = time.perf_counter()
+    view.update_analysis_and_wait()
+    # blocks are discovered lazily, with the final indirect branches
+    blocks = sum(len(f.basic_blocks) for f in view.functions)
+    rv['vsa'] = time.perf_counter() - start
+    rv['functions'] = len(view.functions)
+    rv['blocks'] = blocks
+    # internal functions are analyzed once instead of in every caller
+    internal = view.session_data.get('internal')
+    rv['internal_functions'] = len(internal.functions) if internal else 0
+    rv['max_function_blocks'] = max(
+        [len(f.basic_blocks) for f in view.functions] or [0])
+    # code marked as data before any function was analyzed
+    unreachable = view.session_data['unreachable']
+    rv['unreachable_bytes'] = unreachable.size
+    rv['unreachable_instructions'] = unreachable.instructions
+    rv['indirect_branch_updates'] = binaryninja.stats[
+        'set_user_indirect_branches']
+    rv['function_reanalysis'] = binaryninja.stats['function_analysis']
+
+    binaryninja.stats.clear()
+    rv['annotate'], _ = best_time(repeat, lambda: annotate_all(view))
+    rv['annotate_calls'] = (binaryninja.stats['get_reg_value_at'] +
+                            binaryninja.stats['get_stack_contents_at']) \
+        // repeat
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt',
+                                     delete=False) as f:
+        for ins in decode(code):
+            f.write('bench: {:#x}\n'.format(ins.pc))
+        visited = f.name
+    try:
+        rv['color'], _ = best_time(
+            repeat, lambda: GraphColorer(view).color(visited))
+    finally:
+        os.unlink(visited)
+    return rv
+
+
+def bench_snapshot(code, repeat):
+    """Saving the snapshot of an analyzed view, and reopening the code with
+    it: EVMView.init plus analysis, to compare with view_load + vsa."""
+    path = tempfile.mkdtemp()
+    view = load_view(code)
+    view.update_analysis_and_wait()
+    rv = {}
+    try:
+        rv['snapshot_save'], filename = best_time(
+            repeat, lambda: snapshot.save(view, path))
+        rv['snapshot_size'] = os.path.getsize(filename)
+        snapshot.SNAPSHOT_PATH = path
+
+        def reopen():
+            view = load_view(code)
+            view.update_analysis_and_wait()
+            return view
+
+        binaryninja.stats.clear()
+        rv['snapshot_reopen'], _ = best_time(repeat, reopen)
+        rv['snapshot_branch_updates'] = binaryninja.stats[
+            'set_user_indirect_branches'] // repeat
+    finally:
+        snapshot.SNAPSHOT_PATH = None
+        for name in os.listdir(path):
+            os.unlink(os.path.join(path, name))
+        os.rmdir(path)
+    return rv
+
+
+def peak_memory(code):
+    """Peak traced allocation of loading and analyzing a view."""
+    tracemalloc.start()
+    try:
+        view = load_view(code)
+        view.update_analysis_and_wait()
+        for function in view.functions:
+            function.basic_blocks
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_core(code, repeat):
+    """The headless core's analysis of a contract, the same work as loading
+    and analyzing a view (no 4byte lookups), for comparison with
+    view_load + vsa."""
+    elapsed, info = best_time(
+        repeat, lambda: core.analyze(code, resolve=False))
+    return {'core_analyze': elapsed,
+            'core_branches': sum(len(t) for t in info['branches'].values())}
+
+
+def import_times(repeat):
+    """Seconds for a fresh interpreter to import the core alone, and the
+    stand-in binaryninja with the plugin."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [HERE, os.path.dirname(HERE), env.get('PYTHONPATH', '')])
+
+    def run(statement):
+        subprocess.check_call([sys.executable, '-c', statement], env=env)
+
+    baseline, _ = best_time(repeat, lambda: run('pass'))
+    rv = {}
+    for name, statement in (('core_import', 'import ethersplay.core'),
+                            ('plugin_import',
+                             'import binaryninja, ethersplay')):
+        elapsed, _ = best_time(repeat, lambda: run(statement))
+        rv[name] = max(elapsed - baseline, 0.0)
+    return rv
+
+
+def bench_contract(code, repeat):
+    decode_time, instructions = best_time(repeat, lambda: decode(code))
+    rv = {
+        'size': len(code),
+        'instructions': len(instructions),
+        'decode_ips': _rate(len(instructions), decode_time),
+    }
+    rv['cfg_build'], _ = best_time(repeat, lambda: CFG(code))
+    rv.update(bench_arch(code, instructions, repeat))
+    rv.update(bench_view(code, repeat))
+    rv.update(bench_core(code, repeat))
+    rv.update(bench_snapshot(code, repeat))
+    rv['peak_memory'] = peak_memory(code)
+    return rv
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Return the (contract, metric, old, new) that regressed."""
+    regressions = []
+    for metric, new in results.get('imports', {}).items():
+        old = baseline.get('imports', {}).get(metric)
+        if old and new > old * (1 + tolerance):
+            regressions.append(('imports', metric, old, new))
+    for name, metrics in results['contracts'].items():
+        old_metrics = baseline.get('contracts', {}).get(name)
+        if not old_metrics:
+            continue
+        for metric, new in metrics.items():
+            old = old_metrics.get(metric)
+            if not isinstance(old, (int, float)) or not old:
+                continue
+            if metric in RATES:
+                worse = new < old / (1 + tolerance)
+            elif metric in ('size', 'instructions', 'functions', 'blocks',
+                            'internal_functions', 'max_function_blocks',
+                            'unreachable_bytes', 'unreachable_instructions',
+                            'lift_expressions', 'callback_errors',
+                            'core_branches', 'snapshot_size'):
+                continue
+            else:
+                worse = new > old * (1 + tolerance)
+            if worse:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark ethersplay without Binary Ninja")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown before a metric counts as "
+                             "a regression (default: 0.2)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="runs per measurement, the best one counts")
+    parser.add_argument("--contract", action="append",
+                        help="only run this contract, may be repeated")
+    args = parser.parse_args(argv)
+
+    results = {
+        'meta': {
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': args.repeat,
+        },
+        'imports': import_times(args.repeat),
+        'contracts': {},
+    }
+    print('import: core {:.3f}s, binaryninja stand-in and plugin {:.3f}s'
+          .format(results['imports']['core_import'],
+                  results['imports']['plugin_import']))
+    for name, code in corpus(args.contract):
+        metrics = bench_contract(code, args.repeat)
+        results['contracts'][name] = metrics
+        print('{:24} {:>6} B  decode {:>9.0f}/s  lift {:>8.0f}/s  '
+              'load {:7.3f}s  vsa {:7.3f}s  core {:7.3f}s  reopen {:7.3f}s  '
+              '{:>5} branch updates  {:>6.1f} MiB'.format(
+                  name, metrics['size'], metrics['decode_ips'],
+                  metrics['lift_ips'], metrics['view_load'],
+                  metrics['vsa'], metrics['core_analyze'],
+                  metrics['snapshot_reopen'],
+                  metrics['indirect_branch_updates'],
+                  metrics['peak_memory'] / 2**20))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print('regression: {} {}: {:.4g} -> {:.4g}'.format(
+                name, metric, old, new))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
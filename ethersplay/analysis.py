@@ -4,65 +4,94 @@ import threading
 from pyevmasm import disassemble_all
 
 from binaryninja import (BackgroundTaskThread, BinaryDataNotification,
-                         BranchType, IntegerDisplayType,
+                         BranchType, Function, IntegerDisplayType,
                          MediumLevelILOperation, SegmentFlag, Settings,
                          SettingsScope, SSAVariable, Symbol, SymbolType,
-                         log_debug, log_info)
+                         log_debug, log_error, log_info, log_warn)
 from evm_cfg_builder.cfg import CFG
 
-from .evmvisitor import EVMVisitor
+from . import profiling
+from .budget import Budget, degrade
+from .common import view_cfg
+from .core.cfg import (analyze_function, copy_function_edges,
+                       function_branches, view_address as _view_address)
+from .core.emulate import Emulator, view_emulator
+from .core.payloads import find_payloads
+from .core.reachable import find_unreachable
+from .decode import decode
+from .internal import (define_functions as define_internal_functions,
+                       register as register_internal)
+from .snapshot import snapshot_branches, vsa_finished, vsa_started
 
 
-def run_vsa(thread, view, function):
-    cfg = function.session_data.cfg
-    cfg_function = cfg.get_function_at(
-        function.start - 1 if function.start != 0 else 0
-    )
-    hash_id = cfg_function.hash_id
+def _resolve(thread, view, function, start, stop, internal, budget):
+    """The jump targets VSA and the emulator resolve in function within
+    budget; the function is degraded if that is not all of them."""
+    if budget.exceeded():
+        degrade(view, function, budget.reason('branch resolution'))
+        return {}
+    calls = internal.calls if internal else {}
 
     thread.task.progress = '[VSA] Analyzing...'
+    branches = function_branches(view_cfg(view), start, stop, calls)
+
+    thread.task.progress = '[VSA] Emulating constant paths...'
+    emulator = view_emulator(view)
+    resolved = emulator.explore(
+        start, lambda pc: not stop(pc),
+        max_steps=budget.steps,
+        internal=(internal.functions, calls) if internal else None,
+        deadline=budget.deadline)
+    for source, targets in resolved.items():
+        branches.setdefault(source, set()).update(targets)
+    if start in emulator.truncated:
+        degrade(view, function, budget.reason('emulation')
+                if budget.exceeded() else
+                'emulation stopped after {} blocks'.format(budget.steps))
+    return branches
+
+
+def run_vsa(thread, view, function):
+    """
+    Set the jump targets VSA and the concrete emulator resolve in function,
+    or those of the view's snapshot if it covers function, one update per
+    jump and only when a target is new, so functions that are already
+    resolved are not re-analyzed. Resolution is limited by the function's
+    and the view's time budgets.
+    """
+    start = function.start - 1 if function.start != 0 else 0
+
+    def stop(pc):
+        return view.get_function_at(pc + 1) is not None
 
-    to_process = [
-        cfg.get_basic_block_at
-        (
-            function.start - 1 if function.start != 0 else 0
+    # internal calls and returns are lifted as such, not as jumps
+    internal = view.session_data.get('internal')
+    calls = internal.calls if internal else {}
+    returns = internal.returns if internal else frozenset()
+
+    branches = snapshot_branches(view, function)
+    if branches is None:
+        budget = Budget(view, task=thread.task)
+        try:
+            branches = _resolve(thread, view, function, start, stop,
+                                internal, budget)
+        finally:
+            budget.finish()
+
+    for source, targets in branches.items():
+        if source in calls or source in returns:
+            continue
+        current_branches = {
+            dest.dest_addr for dest in function.get_indirect_branches_at(source)
+        }
+        known = targets <= current_branches
+        profiling.cache('indirect branches', known)
+        if known:
+            continue
+        function.set_user_indirect_branches(
+            source,
+            [(view.arch, dest) for dest in current_branches | targets]
         )
-    ]
-
-    seen = set()
-
-    i = 3
-
-    while to_process:
-        thread.task.progress = '[VSA] Processing Basic Blocks{}'.format('.'*i)
-        i += (i + 1) % 4
-        basic_block = to_process.pop()
-        seen.add(basic_block)
-        end = basic_block.end.pc
-        outgoing_edges = basic_block.outgoing_basic_blocks(hash_id)
-
-        if outgoing_edges is not None:
-            for outgoing_edge in outgoing_edges:
-                if (view.get_function_at(outgoing_edge.start.pc + 1) is None and
-                        outgoing_edge not in seen):
-                    to_process.append(outgoing_edge)
-
-                dest_branches = function.get_indirect_branches_at(end)
-
-                current_branches = {
-                    dest.dest_addr for dest in dest_branches
-                }
-
-                if outgoing_edge.start.pc not in current_branches:
-                    current_branches.add(outgoing_edge.start.pc)
-                    function.set_user_indirect_branches(
-                        end,
-                        [
-                            (view.arch, dest) for dest in current_branches
-                            if (not basic_block.ends_with_jumpi or
-                                outgoing_edge.start.pc != end + 1)
-                        ]
-                    )
 
     if function.start == 0:
         max_function_size, _ = Settings().get_integer_with_scope(
@@ -73,18 +102,225 @@ def run_vsa(thread, view, function):
             view.max_function_size_for_analysis = 65536
 
 
+def analysis_completed(view):
+    """Completion event of the initial analysis: drop the emulator's memo,
+    functions added later and patches are rare and emulate again."""
+    emulator = view.session_data.get('emulator')
+    if emulator is not None:
+        emulator.clear_memo()
+
+
 class VsaTaskThread(BackgroundTaskThread):
     def __init__(self, status, view, function):
-        BackgroundTaskThread.__init__(self, status, False)
+        BackgroundTaskThread.__init__(self, status, True)
         self.view = view
         self.function = function
 
     def run(self):
-        run_vsa(self.thread, self.view, self.function)
+        try:
+            run_vsa(self.thread, self.view, self.function)
+        finally:
+            vsa_finished(self.view)
+
+
+def resync_end(old_code, new_code, start, end):
+    """
+    Return the first offset >= end from which old and new code decode to the
+    same instructions. A patch that changes a PUSH width shifts instruction
+    boundaries past the written range until both sweeps meet again.
+    """
+    if len(old_code) != len(new_code):
+        return max(len(old_code), len(new_code))
+    old_pcs = {i.pc for i in decode(old_code) if i.pc >= end}
+    for i in decode(new_code):
+        if i.pc >= end and i.pc in old_pcs:
+            return i.pc
+    return len(new_code)
+
+
+def merge_ranges(ranges):
+    """Sorted [start, end) ranges with the overlapping and adjacent ones of
+    ranges merged."""
+    rv = []
+    for start, end in sorted(ranges):
+        if rv and start <= rv[-1][1]:
+            rv[-1] = (rv[-1][0], max(rv[-1][1], end))
+        else:
+            rv.append((start, end))
+    return rv
+
+
+def _function_range_overlaps(function, ranges):
+    return any(bb.start.pc < end and bb.end.pc + bb.end.size > start
+               for bb in function.basic_blocks for start, end in ranges)
+
+
+def update_cfg(old_cfg, new_code, ranges):
+    """
+    Build the CFG of new_code, re-running evm_cfg_builder's VSA only for the
+    functions that overlap the patched ranges, [start, end), or whose entry
+    changed; the edges of all other functions are carried over from old_cfg.
+
+    Returns (cfg, ranges, touched, added, removed): the ranges whose
+    decoding changed, and the start addresses of the functions that were
+    re-analyzed, appeared and disappeared.
+    """
+    new_cfg = CFG(new_code, compute_cfgs=False)
+    ranges = merge_ranges(
+        (start, resync_end(old_cfg.bytecode, new_cfg.bytecode, start, end))
+        for start, end in ranges)
+
+    old_functions = {(f.start_addr, f.hash_id): f for f in old_cfg.functions}
+    new_functions = {(f.start_addr, f.hash_id): f for f in new_cfg.functions}
+
+    touched = []
+    for key, function in new_functions.items():
+        old_function = old_functions.get(key)
+        if (old_function is None or
+                _function_range_overlaps(old_function, ranges) or
+                not copy_function_edges(old_function, new_cfg, function)):
+            analyze_function(new_cfg, function)
+            if old_function is not None:
+                touched.append(function.start_addr)
+
+    added = [f.start_addr for k, f in new_functions.items()
+             if k not in old_functions]
+    removed = [f.start_addr for k, f in old_functions.items()
+               if k not in new_functions]
+    return new_cfg, ranges, touched, added, removed
+
+
+def reanalyze_patches(thread, view, ranges, shifted=False):
+    """
+    Update the analysis for the bytes written in ranges, [start, end). If
+    shifted, bytes were inserted or removed and every address after them
+    moved, so the whole view is re-analyzed.
+    """
+    new_code = view.read(0, len(view))
+    if shifted:
+        log_warn('[VSA] bytes inserted or removed at {}, re-analyzing the '
+                 'whole view'.format(', '.join(
+                     '{:#x}'.format(start) for start, _ in ranges)))
+        ranges = [(0, len(new_code))]
+    thread.task.progress = '[VSA] Updating CFG for patch at {:#x}'.format(
+        ranges[0][0])
+    cfg, ranges, touched, added, removed = update_cfg(
+        view_cfg(view), new_code, ranges)
+
+    Function.set_default_session_data('cfg', cfg)
+    view.session_data['cfg'] = cfg
+    view.session_data['payloads'] = find_payloads(new_code)
+    view.session_data['emulator'] = Emulator(new_code)
+    # the snapshot's branches are for the old code
+    view.session_data['snapshot'] = None
+    internal = register_internal(view, new_code)
+
+    # the segments stay as they were, code the patch made reachable is data
+    # until the view is opened again
+    unreachable = find_unreachable(new_code, cfg,
+                                   view.session_data['payloads'],
+                                   internal.returns)
+    previous = view.session_data.get('unreachable')
+    if shifted:
+        # the old ranges are at other addresses now
+        previous = None
+    for r_start, r_end in previous.ranges if previous is not None else ():
+        if not any(s <= r_start and r_end <= e
+                   for s, e in unreachable.ranges):
+            log_warn('[VSA] {:#x}-{:#x} became reachable with the patch, '
+                     'reopen the file to analyze it'.format(r_start, r_end))
+    view.session_data['unreachable'] = unreachable
+
+    for addr in removed:
+        function = view.get_function_at(_view_address(addr))
+        if function is not None:
+            view.remove_function(function)
+
+    for addr in added:
+        # function_added runs VSA for these
+        cfg_function = cfg.get_function_at(addr)
+        view.define_auto_symbol(Symbol(SymbolType.FunctionSymbol,
+                                       _view_address(addr),
+                                       cfg_function.name))
+        view.add_function(_view_address(addr))
+
+    for addr in touched:
+        function = view.get_function_at(_view_address(addr))
+        if function is None:
+            continue
+        # drop the branches resolved for the old bytes of the ranges
+        for branch in function.indirect_branches:
+            if any(start <= branch.source_addr < end
+                   for start, end in ranges):
+                function.set_user_indirect_branches(branch.source_addr, [])
+        run_vsa(thread, view, function)
+        function.reanalyze()
+    define_internal_functions(view, internal)
+
+    log_info('[VSA] patch at {}: {} functions re-analyzed, {} added, '
+             '{} removed'.format(
+                 ', '.join('{:#x}-{:#x}'.format(start, end)
+                           for start, end in ranges),
+                 len(touched), len(added), len(removed)))
+
+
+# patches wait in view.session_data['patches'] for the view's one patch
+# task, which takes all of them at once
+_patch_lock = threading.Lock()
+
+
+def queue_patch(view, offset, length, shifted=False):
+    """Queue the bytes written, or inserted or removed if shifted, at
+    offset for the view's patch task and start it if it isn't running."""
+    with _patch_lock:
+        view.session_data.setdefault('patches', []).append(
+            (offset, offset + length, shifted))
+        if view.session_data.get('patch_task'):
+            return
+        view.session_data['patch_task'] = True
+    PatchTaskThread(view).start()
+
+
+class PatchTaskThread(BackgroundTaskThread):
+    def __init__(self, view):
+        BackgroundTaskThread.__init__(self, 'Updating analysis for patches',
+                                      False)
+        self.view = view
+
+    def run(self):
+        session_data = self.view.session_data
+        while True:
+            with _patch_lock:
+                patches = session_data.get('patches')
+                session_data['patches'] = []
+                if not patches:
+                    session_data['patch_task'] = False
+                    return
+            try:
+                reanalyze_patches(
+                    self.thread, self.view,
+                    merge_ranges((start, end) for start, end, _ in patches),
+                    any(shifted for _, _, shifted in patches))
+            except Exception as e:
+                # the task goes on with the patches queued meanwhile
+                log_error('[VSA] updating the analysis for patches at {} '
+                          'failed: {}'.format(', '.join(
+                              '{:#x}'.format(start)
+                              for start, _, _ in patches), e))
 
 
 class VsaNotification(BinaryDataNotification):
     def function_added(self, view, function):
+        vsa_started(view)
         vsa_task = VsaTaskThread(
             'Running VSA for {}'.format(function.name), view, function)
         vsa_task.start()
+
+    def data_written(self, view, offset, length):
+        queue_patch(view, offset, length)
+
+    def data_inserted(self, view, offset, length):
+        queue_patch(view, offset, length, shifted=True)
+
+    def data_removed(self, view, offset, length):
+        queue_patch(view, offset, length, shifted=True)
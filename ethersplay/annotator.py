@@ -1,16 +1,32 @@
 from binaryninja import log_error
 
 # from constants import ADDR_SZ
+from .budget import Budget, degrade
 from .common import ADDR_SIZE as ADDR_SZ
+from .core.annotations import (ANNOTATIONS as _ANNOTATIONS,
+                               format_value as _format_value)
 
 
-def get_annotation_for_stack_offset(function, address, offset=0):
-    """offset is in terms of EVM stack slots"""
+def get_annotation_for_stack_offset(function, address, offset=0,
+                                    emulated=None, dataflow=True):
+    """offset is in terms of EVM stack slots. emulated are the constant
+    arguments the emulator found, used where Binary Ninja has no value, or
+    instead of its dataflow without dataflow."""
+
+    if emulated and offset < len(emulated) and emulated[offset]:
+        fallback = " | ".join(_format_value(v)
+                              for v in sorted(emulated[offset]))
+    else:
+        fallback = None
+    if not dataflow:
+        return fallback or "<???>"
 
     sp = function.get_reg_value_at(address, 'sp')
     # sp should be a offset
     if hasattr(sp, 'offset'):
         spoff = sp.offset
+    elif fallback:
+        return fallback
     else:
         # binary ninja couldn't track the sp offset. bail out early
         return "<??? sp = " + str(sp) + ">"
@@ -18,40 +34,9 @@ def get_annotation_for_stack_offset(function, address, offset=0):
     val = function.get_stack_contents_at(address, spoff + ADDR_SZ * offset,
                                          ADDR_SZ)
     if hasattr(val, 'value'):
-        if val.value > 2**10:
-            return hex(val.value)
-        else:
-            return str(val.value)
+        return _format_value(val.value)
     else:
-        return "<???>"
-
-
-_ANNOTATIONS = {
-    "CALLDATALOAD": ('input_offset', ),
-    "CALLDATACOPY": ('mem_offset', 'input_offset', 'len'),
-    'CODECOPY': ('mem_offset', 'code_offset', 'len'),
-    'EXTCODECOPY': ('addr', 'mem_offset', 'code_offset', 'len'),
-    "MSTORE": ('address', 'value'),
-    "SSTORE": ('address', 'value'),
-    "SLOAD": ('address', ),
-    "MLOAD": ('address', ),
-    "CREATE": ('value', 'mem_offset', 'mem_size'),
-    "CALL": ('gas', 'address', 'value', 'inp_offset', 'inp_size', 'ret_offset',
-             'ret_size'),
-    "CALLCODE": ('gas', 'address', 'value', 'inp_offset', 'inp_size',
-                 'ret_offset', 'ret_size'),
-    "DELEGATECALL": ('gas', 'address', 'inp_offset', 'inp_size', 'ret_offset',
-                     'ret_size'),
-    "STATICCALL": ('gas', 'address', 'inp_offset', 'inp_size', 'ret_offset',
-                   'ret_size'),
-    "RETURN": ('mem_offset', 'mem_size'),
-    "REVERT": ('mem_offset', 'mem_size'),
-    "SUICIDE": ('address', ),
-    "SHA3": ('offset', 'size'),
-    "ADD": ('op1', 'op2'),
-    "AND": ('op1', 'op2'),
-    "SIGNEXTEND": ('v',),
-}
+        return fallback or "<???>"
 
 
 def is_dup(x):
@@ -80,22 +65,41 @@ def annotate(view, function):
                   view.arch.name + ")")
         return -1
 
+    emulator = view.session_data.get('emulator')
+    # Binary Ninja's dataflow queries are what is slow, once the function is
+    # out of budget only the emulator's values are used
+    budget = Budget(view)
+    try:
+        _annotate(view, function, emulator, budget)
+    finally:
+        budget.finish()
+
+
+def _annotate(view, function, emulator, budget):
+    dataflow = True
     for inst, address in function.instructions:
+        if dataflow and budget.exceeded():
+            dataflow = False
+            degrade(view, function, budget.reason('annotation') +
+                    ', emulated values only')
         inststr = str(inst[0]).strip()
         comment = ""
         if inststr in _ANNOTATIONS:
+            emulated = (emulator.constant_args(address) if emulator
+                        else None)
             for stack_offset, annotation in enumerate(_ANNOTATIONS[inststr]):
                 if annotation:
                     comment += (", {} = {}"
                                 .format(annotation,
                                         get_annotation_for_stack_offset(
-                                            function, address, stack_offset)))
-        if is_dup(inststr):
+                                            function, address, stack_offset,
+                                            emulated, dataflow)))
+        if dataflow and is_dup(inststr):
             stack_offset = dup2off(inststr)
             comment = (", push {}".format(
                 get_annotation_for_stack_offset(function, address,
                                                 stack_offset)))
-        if is_swap(inststr):
+        if dataflow and is_swap(inststr):
             stack_offset = swap2off(inststr)
             comment = (", swap(s[0] = {}, s[{}] = {})".format(
                 get_annotation_for_stack_offset(function, address, 0),
@@ -0,0 +1,137 @@
+"""
+Budgets of the analysis of a view, so one pathological function (a huge
+dispatcher, a jump maze) can't stall the rest.
+
+Resolving the indirect branches of a function and annotating it each get
+FUNCTION_SECONDS; all of them together get VIEW_SECONDS per view. The
+emulator runs at most FUNCTION_STEPS blocks per function. A function that
+runs out keeps what was found so far and is not resolved or annotated any
+further, once the view ran out functions are not resolved at all. Either
+way the function is flagged in view.session_data['degraded'] and with a
+line added to the comment at its start, and a summary is logged when the
+initial analysis is done. Cancelling a VSA task counts as running out.
+"""
+import time
+import threading
+
+from .core.emulate import MAX_STEPS
+from .core.log import log_info, log_warn
+
+# None disables a time budget
+FUNCTION_SECONDS = 10.0
+VIEW_SECONDS = 600.0
+# blocks emulated per function; always set, it bounds constant loops
+FUNCTION_STEPS = MAX_STEPS
+
+DEGRADED_COMMENT = 'ethersplay: analysis degraded, {}'
+
+_lock = threading.Lock()
+
+
+class Budget(object):
+    """The time a function may still take, cut short by the view's budget
+    and by cancelling task, a BackgroundTask, and the blocks it may
+    emulate."""
+
+    def __init__(self, view, seconds=None, task=None, steps=None):
+        self.view = view
+        self.task = task
+        self.steps = FUNCTION_STEPS if steps is None else steps
+        self.start = time.perf_counter()
+        seconds = FUNCTION_SECONDS if seconds is None else seconds
+        left = view_seconds_left(view)
+        # the deadline is the view's
+        self.capped = left is not None and (seconds is None or
+                                            left < seconds)
+        if self.capped:
+            seconds = left
+        self.deadline = (self.start + seconds if seconds is not None
+                         else None)
+
+    def cancelled(self):
+        return self.task is not None and self.task.cancelled
+
+    def exceeded(self):
+        if self.cancelled():
+            return True
+        return (self.deadline is not None and
+                time.perf_counter() > self.deadline)
+
+    def reason(self, what):
+        """Why what stopped, for degrade()."""
+        if self.cancelled():
+            return '{} cancelled'.format(what)
+        if self.capped:
+            return '{} cut short, view budget of {}s spent'.format(
+                what, VIEW_SECONDS)
+        return '{} stopped after {:.1f}s, function budget of {}s'.format(
+            what, time.perf_counter() - self.start, FUNCTION_SECONDS)
+
+    def finish(self):
+        """Charge the time taken to the view."""
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            self.view.session_data['analysis_seconds'] = \
+                self.view.session_data.get('analysis_seconds', 0.0) + elapsed
+
+
+def view_seconds_left(view):
+    """Seconds of VIEW_SECONDS view has left, None if unlimited."""
+    if VIEW_SECONDS is None:
+        return None
+    with _lock:
+        spent = view.session_data.get('analysis_seconds', 0.0)
+    return max(VIEW_SECONDS - spent, 0)
+
+
+def _add_comment(view, function, line):
+    """Append line to the comment at the start of function. What is there,
+    or the view's comment it shadows (the proxy description), is kept."""
+    start = function.start
+    current = (function.comments.get(start) or
+               view.address_comments.get(start) or '')
+    lines = current.split('\n') if current else []
+    if line not in lines:
+        function.set_comment_at(start, '\n'.join(lines + [line]))
+
+
+def degrade(view, function, reason):
+    """Flag function as not fully analyzed because of reason."""
+    with _lock:
+        degraded = view.session_data.get('degraded')
+        if degraded is None:
+            degraded = view.session_data['degraded'] = {}
+        degraded.setdefault(function.start, []).append(reason)
+        _add_comment(view, function, DEGRADED_COMMENT.format(reason))
+    log_warn('{} at {:#x}: {}'.format(function.name, function.start, reason))
+
+
+def degraded_functions(view):
+    """{function start: [reasons]} of the functions of view that ran out of
+    budget."""
+    with _lock:
+        return dict((start, list(reasons)) for start, reasons in
+                    view.session_data.get('degraded', {}).items())
+
+
+def summary(view):
+    degraded = degraded_functions(view)
+    lines = ['{} of {} functions degraded, {:.1f}s of analysis'.format(
+        len(degraded), len(view.functions),
+        view.session_data.get('analysis_seconds', 0.0))]
+    for start, reasons in sorted(degraded.items()):
+        function = view.get_function_at(start)
+        name = function.name if function is not None else '?'
+        lines.append('  {:#x} {}: {}'.format(start, name, '; '.join(reasons)))
+    return '\n'.join(lines)
+
+
+def analysis_completed(view):
+    """Completion event of the initial analysis: log which functions ran
+    out of budget."""
+    if degraded_functions(view):
+        log_warn(summary(view))
+
+
+def show_summary_bn(view):
+    log_info(summary(view))
@@ -0,0 +1,387 @@
+"""
+Cross-contract call graph.
+
+Every CALL, CALLCODE, DELEGATECALL and STATICCALL whose target is a
+constant (a PUSH20, or a PUSH32 immutable filled in at deployment) is
+recorded with the selector last written to memory before it. Extraction is
+one linear sweep with constant propagation along fall through and direct
+jump edges, so the target survives the extcodesize check solc puts between
+it and the call, and no CFG, so it is cheap enough for whole corpora. The
+call sites of all contracts are kept in an indexed SQLite database, next to
+the corpus as calls.sqlite, and looked up by target (callers) or by
+contract (callees).
+"""
+import os
+import sys
+import sqlite3
+import argparse
+import multiprocessing
+from collections import namedtuple
+
+from .common import code_hash
+from .constprop import propagate
+from .corpus import Corpus
+from .decode import decode
+from .core.log import log_info, log_error
+from .core.selectors import resolve_hashes
+
+# the command is only defined inside Binary Ninja, the CLI does not load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import BackgroundTaskThread
+
+CALLS_PATH = os.path.expanduser("~/.ethersplay")
+CALLS_DB = os.path.join(CALLS_PATH, "calls.sqlite")
+CORPUS_CALLS_NAME = "calls.sqlite"
+
+# instruction -> (target argument, input offset argument)
+CALL_ARGS = {'CALL': (1, 3), 'CALLCODE': (1, 3), 'DELEGATECALL': (1, 2),
+             'STATICCALL': (1, 2)}
+# constants below this are precompiles, not contracts
+MIN_CONTRACT_ADDRESS = 0x10000
+# instructions between the selector MSTORE and the call it belongs to; the
+# code in between usually checks extcodesize and copies the arguments
+SELECTOR_WINDOW = 64
+INDEX_CHUNK_SIZE = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contracts (
+    id INTEGER PRIMARY KEY,
+    hash TEXT UNIQUE NOT NULL,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS names (
+    name TEXT PRIMARY KEY,
+    contract_id INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS calls (
+    contract_id INTEGER NOT NULL,
+    address INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    target TEXT,
+    selector TEXT
+);
+CREATE INDEX IF NOT EXISTS calls_contract ON calls (contract_id);
+CREATE INDEX IF NOT EXISTS calls_target ON calls (target, selector);
+CREATE INDEX IF NOT EXISTS calls_selector ON calls (selector);
+CREATE INDEX IF NOT EXISTS names_contract ON names (contract_id);
+"""
+
+CallSite = namedtuple('CallSite', ['address', 'kind', 'target', 'selector'])
+Caller = namedtuple('Caller', ['contract', 'name', 'address', 'kind',
+                               'selector'])
+Callee = namedtuple('Callee', ['address', 'kind', 'target', 'selector',
+                               'names'])
+
+
+def _address(value):
+    if isinstance(value, int) and MIN_CONTRACT_ADDRESS <= value < 2**160:
+        return "0x{:040x}".format(value)
+    return None
+
+
+def _selector(value):
+    """The selector of a left aligned 4 byte memory word, or None."""
+    if (isinstance(value, int) and value >> 224 and
+            not value & ((1 << 224) - 1)):
+        return "0x{:08x}".format(value >> 224)
+    return None
+
+
+def call_sites(instructions):
+    """
+    Return a CallSite for every call in decoded instructions whose target
+    or selector is known.
+    """
+    rv = []
+    store = None
+    for n, (ins, args) in enumerate(propagate(instructions, edges=True)):
+        if ins.name == 'MSTORE':
+            selector = _selector(args[1])
+            if selector is not None:
+                store = (n, args[0], selector)
+        elif ins.name in CALL_ARGS:
+            target_arg, input_arg = CALL_ARGS[ins.name]
+            target = _address(args[target_arg])
+            selector = None
+            if (store is not None and n - store[0] <= SELECTOR_WINDOW and
+                    (store[1] is None or args[input_arg] is None or
+                     store[1] == args[input_arg])):
+                selector = store[2]
+            # a selector is written for one call
+            store = None
+            if target is not None or selector is not None:
+                rv.append(CallSite(ins.pc, ins.name, target, selector))
+    return rv
+
+
+def extract_calls(code):
+    return {'hash': code_hash(bytes(code)),
+            'calls': call_sites(decode(code))}
+
+
+class CallGraph(object):
+    def __init__(self, filename=CALLS_DB):
+        dir_name = os.path.dirname(filename)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM contracts").fetchone()[0]
+
+    def hashes(self):
+        return {row[0] for row in
+                self.db.execute("SELECT hash FROM contracts")}
+
+    def write(self, record, names=()):
+        """Store a record of extract_calls under its code hash and names
+        (e.g. every address the code is deployed at), replacing the call
+        sites of an earlier write."""
+        names = [name.lower() for name in names]
+        with self.db:
+            row = self.db.execute("SELECT id FROM contracts WHERE hash = ?",
+                                  (record['hash'],)).fetchone()
+            if row is None:
+                contract_id = self.db.execute(
+                    "INSERT INTO contracts (hash, name) VALUES (?, ?)",
+                    (record['hash'], names[0] if names else None)).lastrowid
+            else:
+                contract_id = row[0]
+                self.db.execute("DELETE FROM calls WHERE contract_id = ?",
+                                row)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO names VALUES (?, ?)",
+                [(name, contract_id) for name in names])
+            self.db.executemany(
+                "INSERT INTO calls VALUES (?, ?, ?, ?, ?)",
+                [(contract_id,) + tuple(site) for site in record['calls']])
+        return contract_id
+
+    def _contract_id(self, contract):
+        """Id of a contract given as code hash or name."""
+        row = self.db.execute(
+            "SELECT id FROM contracts WHERE hash = ? UNION "
+            "SELECT contract_id FROM names WHERE name = ?",
+            (contract, contract.lower())).fetchone()
+        return row[0] if row else None
+
+    def _names(self, contract_id):
+        return [row[0] for row in self.db.execute(
+            "SELECT name FROM names WHERE contract_id = ? ORDER BY name",
+            (contract_id,))]
+
+    def callers(self, target, selector=None):
+        """Return a Caller for every call site with constant target,
+        optionally only those calling selector."""
+        query = ("SELECT c.hash, c.name, s.address, s.kind, s.selector "
+                 "FROM calls s JOIN contracts c ON c.id = s.contract_id "
+                 "WHERE s.target = ?")
+        params = [target.lower()]
+        if selector is not None:
+            query += " AND s.selector = ?"
+            params.append(selector.lower())
+        return [Caller(*row) for row in self.db.execute(query, params)]
+
+    def selector_callers(self, selector):
+        """Return a Caller for every call site passing selector."""
+        return [Caller(*row) for row in self.db.execute(
+            "SELECT c.hash, c.name, s.address, s.kind, s.selector "
+            "FROM calls s JOIN contracts c ON c.id = s.contract_id "
+            "WHERE s.selector = ?", (selector.lower(),))]
+
+    def callees(self, contract):
+        """Return a Callee for every call site of contract (code hash or
+        name), with the names the target's code is known under."""
+        contract_id = self._contract_id(contract)
+        if contract_id is None:
+            return []
+        rv = []
+        for address, kind, target, selector in self.db.execute(
+                "SELECT address, kind, target, selector FROM calls "
+                "WHERE contract_id = ? ORDER BY address", (contract_id,)):
+            names = []
+            if target is not None:
+                target_id = self._contract_id(target)
+                if target_id is not None:
+                    names = self._names(target_id)
+            rv.append(Callee(address, kind, target, selector, names))
+        return rv
+
+
+def corpus_calls_path(path):
+    return os.path.join(path, CORPUS_CALLS_NAME)
+
+
+_corpora = {}
+
+
+def _index_task(task):
+    """Worker side of index_corpus: (corpus path, code hash) -> (code hash,
+    record or error). The corpus is opened once per worker."""
+    path, entry = task
+    try:
+        corpus = _corpora.get(path)
+        if corpus is None:
+            corpus = _corpora[path] = Corpus(path)
+        return entry, extract_calls(corpus.get(entry))
+    except Exception as e:
+        return entry, "{}: {}".format(type(e).__name__, e)
+
+
+def index_corpus(path, filename=None, jobs=None):
+    """
+    Extract the call sites of the corpus entries that are not in its call
+    graph yet, on a pool of jobs worker processes. Returns (added, failed).
+    """
+    filename = filename or corpus_calls_path(path)
+    added = failed = 0
+    with CallGraph(filename) as graph:
+        with Corpus(path) as corpus:
+            names = {}
+            for name, entry in sorted(corpus.names.items()):
+                names.setdefault(entry, []).append(name)
+            known = graph.hashes()
+            tasks = [(path, entry) for entry in corpus if entry not in known]
+        if not tasks:
+            return 0, 0
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for entry, record in pool.imap_unordered(
+                    _index_task, tasks, INDEX_CHUNK_SIZE):
+                if isinstance(record, dict):
+                    graph.write(record, names.get(entry, ()))
+                    added += 1
+                else:
+                    log_error("call extraction of {} failed: {}".format(
+                        entry, record))
+                    failed += 1
+        finally:
+            pool.close()
+            pool.join()
+    log_info("call graph {}: {} contracts added, {} failed".format(
+        filename, added, failed))
+    return added, failed
+
+
+def call_comment(site, sigs=None):
+    parts = [site.target or 'unknown target']
+    if site.selector is not None:
+        parts.append(sigs[0] if sigs else site.selector)
+    return "{}: {}".format(site.kind.lower(), ' '.join(parts))
+
+
+if 'binaryninja' in sys.modules:
+    class CallGraphThread(BackgroundTaskThread):
+        def __init__(self, view):
+            BackgroundTaskThread.__init__(self, "Indexing external calls...",
+                                          False)
+            self.view = view
+
+        def run(self):
+            view = self.view
+            record = extract_calls(view.read(0, len(view)))
+            name = os.path.splitext(os.path.basename(view.file.filename))[0]
+            with CallGraph() as graph:
+                graph.write(record, [name])
+                callers = graph.callers(name)
+            resolved = resolve_hashes(
+                [site.selector for site in record['calls'] if site.selector],
+                online=False)
+            for site in record['calls']:
+                comment = call_comment(site, resolved.get(site.selector))
+                for function in view.get_functions_containing(site.address):
+                    function.set_comment_at(site.address, comment)
+            view.session_data['calls'] = record['calls']
+            log_info("call graph: {} call sites, {} known callers".format(
+                len(record['calls']), len(callers)))
+            for caller in callers:
+                log_info("call graph: called by {} at {:#x} ({})".format(
+                    caller.name or caller.contract, caller.address,
+                    caller.selector or 'no selector'))
+
+    def call_graph_bn(view):
+        CallGraphThread(view).start()
+
+
+def _graph_filename(target):
+    if os.path.isdir(target):
+        return corpus_calls_path(target)
+    return target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build and query a cross-contract call graph")
+    commands = parser.add_subparsers(dest="command")
+    add = commands.add_parser(
+        "index", help="index a corpus directory (next to it) or add .evm "
+                      "files to a call graph database")
+    add.add_argument("target", help="corpus directory or .sqlite file")
+    add.add_argument("files", nargs="*",
+                     help=".evm files, named after the file without .evm "
+                          "(e.g. the address)")
+    add.add_argument("--jobs", type=int, default=None,
+                     help="worker processes (default: CPU count)")
+    callers = commands.add_parser("callers",
+                                  help="contracts calling an address")
+    callers.add_argument("target", help="corpus directory or .sqlite file")
+    callers.add_argument("address", nargs="?",
+                         help="target address, or all targets with "
+                              "--selector")
+    callers.add_argument("--selector")
+    callees = commands.add_parser("callees",
+                                  help="calls made by a contract")
+    callees.add_argument("target", help="corpus directory or .sqlite file")
+    callees.add_argument("contract", help="code hash or name (address)")
+    args = parser.parse_args(argv)
+
+    if args.command == "index":
+        failed = 0
+        if os.path.isdir(args.target):
+            _, failed = index_corpus(args.target, None, args.jobs)
+        with CallGraph(_graph_filename(args.target)) as graph:
+            for filename in args.files:
+                with open(filename, "rb") as f:
+                    graph.write(extract_calls(f.read()), [
+                        os.path.splitext(os.path.basename(filename))[0]])
+            print("{} contracts in call graph".format(len(graph)))
+        return 1 if failed else 0
+
+    if args.command == "callers":
+        if args.address is None and args.selector is None:
+            parser.error("callers needs an address or --selector")
+        with CallGraph(_graph_filename(args.target)) as graph:
+            if args.address is None:
+                found = graph.selector_callers(args.selector)
+            else:
+                found = graph.callers(args.address, args.selector)
+            for caller in found:
+                print("{} {:#x} {} {}".format(
+                    caller.name or caller.contract, caller.address,
+                    caller.kind, caller.selector or ''))
+        return 0
+
+    if args.command == "callees":
+        with CallGraph(_graph_filename(args.target)) as graph:
+            for callee in graph.callees(args.contract):
+                print("{:#x} {} {} {} {}".format(
+                    callee.address, callee.kind, callee.target or '?',
+                    callee.selector or '', ','.join(callee.names)))
+        return 0
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
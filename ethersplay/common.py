@@ -1 +1,20 @@
+import hashlib
+
 ADDR_SIZE = 32
+
+
+def code_hash(code):
+    return hashlib.sha256(code).hexdigest()
+
+
+def view_cfg(view):
+    """The evm_cfg_builder CFG of a view, built from its data if the view
+    does not have one yet."""
+    cfg = view.session_data.get('cfg')
+    if cfg is None:
+        # evm_cfg_builder is slow to import, workers that only decode or
+        # hash code shouldn't pay for it
+        from evm_cfg_builder.cfg import CFG
+        cfg = CFG(view.read(0, len(view)))
+        view.session_data['cfg'] = cfg
+    return cfg
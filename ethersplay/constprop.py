@@ -0,0 +1,199 @@
+from collections import namedtuple
+
+from .decode import BASIC_BLOCK_END, TERMINATORS
+
+WORD = 2**256
+MASK = WORD - 1
+
+# storage location derived with SHA3: keccak(key . base) for mapping
+# entries, keccak(base) for dynamic array data, plus a constant offset
+KeccakSlot = namedtuple('KeccakSlot', ['kind', 'base', 'offset'])
+
+_FOLD = {
+    'ADD': lambda a, b: (a + b) & MASK,
+    'SUB': lambda a, b: (a - b) & MASK,
+    'MUL': lambda a, b: (a * b) & MASK,
+    'DIV': lambda a, b: a // b if b else 0,
+    'MOD': lambda a, b: a % b if b else 0,
+    'AND': lambda a, b: a & b,
+    'OR': lambda a, b: a | b,
+    'XOR': lambda a, b: a ^ b,
+    'EQ': lambda a, b: int(a == b),
+    'LT': lambda a, b: int(a < b),
+    'GT': lambda a, b: int(a > b),
+    'SHL': lambda shift, value: (value << shift) & MASK if shift < 256 else 0,
+    'SHR': lambda shift, value: value >> shift if shift < 256 else 0,
+    'EXP': lambda a, b: pow(a, b, WORD),
+}
+
+# instructions that write memory at places we don't track
+_MEMORY_CLOBBER = frozenset(['MSTORE8', 'CALLDATACOPY', 'CODECOPY',
+                             'EXTCODECOPY', 'RETURNDATACOPY', 'CALL',
+                             'CALLCODE', 'DELEGATECALL', 'STATICCALL'])
+
+
+def _peek(stack, i):
+    return stack[-1 - i] if len(stack) > i else None
+
+
+def _sha3(memory, offset, size):
+    if offset is None or size not in (0x20, 0x40):
+        return None
+    if size == 0x20:
+        base = memory.get(offset)
+        if isinstance(base, int):
+            return KeccakSlot('array', base, 0)
+    else:
+        base = memory.get(offset + 0x20)
+        if isinstance(base, int):
+            return KeccakSlot('mapping', base, 0)
+        if isinstance(base, KeccakSlot):
+            # nested mapping, keep the outermost declared slot
+            return KeccakSlot('mapping', base.base, 0)
+    return None
+
+
+def _entries(instructions):
+    """
+    {JUMPDEST pc: number of edges entering it} for the JUMPDESTs only
+    entered by falling through and by jumps to the constant pushed right
+    before them. A JUMPDEST pushed anywhere else, e.g. as a return address,
+    may be entered from any jump and is left out.
+    """
+    entries = {}
+    escaped = set()
+    previous = None
+    for i, ins in enumerate(instructions):
+        if ins.name == 'JUMPDEST':
+            entries.setdefault(ins.pc, 0)
+            if (previous is not None and previous.name != 'JUMP' and
+                    previous.name not in TERMINATORS):
+                entries[ins.pc] += 1
+        elif ins.operand is not None:
+            following = (instructions[i + 1] if i + 1 < len(instructions)
+                         else None)
+            if following is not None and following.name in ('JUMP',
+                                                             'JUMPI'):
+                entries[ins.operand] = entries.get(ins.operand, 0) + 1
+            else:
+                escaped.add(ins.operand)
+        previous = ins
+    return dict((pc, count) for pc, count in entries.items()
+                if pc not in escaped)
+
+
+def _merge(states):
+    """The (stack, memory) values all of states agree on."""
+    stacks = [stack for stack, _ in states]
+    depth = min(len(stack) for stack in stacks)
+    stack = []
+    for i in range(depth, 0, -1):
+        value = stacks[0][-i]
+        stack.append(value if all(s[-i] == value for s in stacks)
+                     else None)
+    memory = dict(states[0][1])
+    for _, other in states[1:]:
+        for offset in list(memory):
+            if offset not in other or other[offset] != memory[offset]:
+                del memory[offset]
+    return stack, memory
+
+
+def propagate(instructions, edges=False):
+    """
+    Yield (instruction, args) for every instruction, where args are the
+    values it pops, top of the stack first. A value is an int if it is a
+    constant computed inside the current basic block, a KeccakSlot if it is
+    a recognized storage location hash, and None otherwise. Constant stores
+    to constant memory offsets are tracked for SHA3.
+
+    With edges, values also flow along fall through, JUMPI and direct jump
+    edges into the blocks whose entries are all known (see _entries) and
+    come from lower addresses; the values entering a block are the ones all
+    its entries agree on. Still one pass in address order, so loops are
+    not followed.
+    """
+    instructions = list(instructions) if edges else instructions
+    entries = _entries(instructions) if edges else {}
+    # JUMPDEST pc -> [(stack, memory)] of the edges seen entering it
+    incoming = {}
+    stack = []
+    memory = {}
+    for ins in instructions:
+        name = ins.name
+        if name == 'JUMPDEST':
+            if stack is not None:
+                incoming.setdefault(ins.pc, []).append((stack, memory))
+            states = incoming.pop(ins.pc, [])
+            if states and len(states) == entries.get(ins.pc):
+                stack, memory = _merge(states)
+            else:
+                stack = []
+                memory = {}
+        elif stack is None:
+            stack = []
+            memory = {}
+
+        args = [_peek(stack, i) for i in range(ins.pops)]
+        yield ins, args
+
+        if name.startswith('PUSH'):
+            stack.append(ins.operand or 0)
+            continue
+        if name.startswith('DUP'):
+            stack.append(_peek(stack, int(name[3:]) - 1))
+            continue
+        if name.startswith('SWAP'):
+            n = int(name[4:])
+            if len(stack) > n:
+                stack[-1], stack[-1 - n] = stack[-1 - n], stack[-1]
+            else:
+                stack = []
+            continue
+
+        if len(stack) < ins.pops:
+            stack = []
+        elif ins.pops:
+            del stack[-ins.pops:]
+
+        result = None
+        if name in _FOLD:
+            a, b = args
+            if isinstance(a, int) and isinstance(b, int):
+                result = _FOLD[name](a, b)
+            elif (name == 'ADD' and isinstance(a, KeccakSlot) and
+                    isinstance(b, int)):
+                result = a._replace(offset=(a.offset + b) & MASK)
+            elif (name == 'ADD' and isinstance(b, KeccakSlot) and
+                    isinstance(a, int)):
+                result = b._replace(offset=(b.offset + a) & MASK)
+        elif name == 'NOT' and isinstance(args[0], int):
+            result = MASK ^ args[0]
+        elif name == 'ISZERO' and isinstance(args[0], int):
+            result = int(args[0] == 0)
+        elif name == 'PC':
+            result = ins.pc
+        elif name == 'SHA3':
+            result = _sha3(memory, args[0], args[1])
+        elif name == 'MSTORE':
+            if isinstance(args[0], int):
+                memory[args[0]] = args[1]
+            else:
+                memory = {}
+        elif name in _MEMORY_CLOBBER:
+            memory = {}
+
+        if ins.pushes:
+            stack.extend([result] + [None] * (ins.pushes - 1))
+
+        if not edges:
+            if name in BASIC_BLOCK_END:
+                stack = []
+                memory = {}
+            continue
+        if name in ('JUMP', 'JUMPI') and isinstance(args[0], int):
+            incoming.setdefault(args[0], []).append((list(stack),
+                                                     dict(memory)))
+        if name == 'JUMP' or name in TERMINATORS:
+            # nothing falls through, None until the next block
+            stack = None
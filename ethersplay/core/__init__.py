@@ -0,0 +1,37 @@
+"""
+The Binary Ninja independent core of ethersplay: decoding, segment and
+payload extraction, unreachable code, CFG functions and resolved jumps,
+internal functions, selector resolution and instruction annotations as
+plain data. Nothing in here imports
+binaryninja, so batch workers can use it without a license:
+
+    from ethersplay.core import analyze
+    info = analyze(open('contract.evm', 'rb').read())
+
+The plugin modules are adapters that apply these results to a BinaryView.
+The core also uses the plugin package's decode, constprop, common, proxy and
+profiling modules, which import binaryninja only inside the functions that
+need it, like the command line tools of the package.
+"""
+from ..decode import Instruction, basic_blocks, decode
+from ..constprop import propagate
+from .annotations import ANNOTATIONS, instruction_comments
+from .payloads import Payload, find_payloads, payload_ranges
+from .segments import Segment, find_segments, find_swarm_hashes
+from .reachable import Unreachable, find_unreachable
+from .selectors import push_candidates, resolve_hashes
+from .cfg import FunctionInfo, cfg_functions, function_branches, view_address
+from .internal import CallSite, InternalFunction, find_internal_functions
+from .emulate import Emulator
+from .contract import analyze
+from .graphs import FunctionGraph, code_graphs, write_graphs
+
+__all__ = [
+    'Instruction', 'basic_blocks', 'decode', 'propagate', 'ANNOTATIONS',
+    'instruction_comments', 'Payload', 'find_payloads', 'payload_ranges',
+    'Segment', 'find_segments', 'find_swarm_hashes', 'Unreachable',
+    'find_unreachable', 'push_candidates', 'resolve_hashes', 'FunctionInfo',
+    'cfg_functions', 'function_branches', 'view_address', 'CallSite',
+    'InternalFunction', 'find_internal_functions', 'Emulator', 'analyze',
+    'FunctionGraph', 'code_graphs', 'write_graphs',
+]
@@ -0,0 +1,66 @@
+"""Stack arguments of annotated instructions, named like in the yellow
+paper, and their comments from constant propagation."""
+from ..constprop import propagate
+
+# instruction -> names of the arguments it pops, top of the stack first
+ANNOTATIONS = {
+    "CALLDATALOAD": ('input_offset', ),
+    "CALLDATACOPY": ('mem_offset', 'input_offset', 'len'),
+    'CODECOPY': ('mem_offset', 'code_offset', 'len'),
+    'EXTCODECOPY': ('addr', 'mem_offset', 'code_offset', 'len'),
+    "MSTORE": ('address', 'value'),
+    "SSTORE": ('address', 'value'),
+    "SLOAD": ('address', ),
+    "MLOAD": ('address', ),
+    "CREATE": ('value', 'mem_offset', 'mem_size'),
+    "CALL": ('gas', 'address', 'value', 'inp_offset', 'inp_size', 'ret_offset',
+             'ret_size'),
+    "CALLCODE": ('gas', 'address', 'value', 'inp_offset', 'inp_size',
+                 'ret_offset', 'ret_size'),
+    "DELEGATECALL": ('gas', 'address', 'inp_offset', 'inp_size', 'ret_offset',
+                     'ret_size'),
+    "STATICCALL": ('gas', 'address', 'inp_offset', 'inp_size', 'ret_offset',
+                   'ret_size'),
+    "RETURN": ('mem_offset', 'mem_size'),
+    "REVERT": ('mem_offset', 'mem_size'),
+    "SUICIDE": ('address', ),
+    "SHA3": ('offset', 'size'),
+    "ADD": ('op1', 'op2'),
+    "AND": ('op1', 'op2'),
+    "SIGNEXTEND": ('v',),
+}
+
+
+def format_value(value):
+    if value > 2**10:
+        return hex(value)
+    else:
+        return str(value)
+
+
+def instruction_comments(instructions, emulator=None):
+    """
+    {pc: comment} for the annotated instructions with at least one known
+    argument, e.g. 'address = 0x40, value = 128'. Arguments are the
+    constants of the instruction's basic block, or of every path an
+    Emulator (see emulate.py) ran through it.
+    """
+    rv = {}
+    for ins, args in propagate(instructions):
+        names = ANNOTATIONS.get(ins.name)
+        if not names:
+            continue
+        emulated = emulator.constant_args(ins.pc) if emulator else []
+        parts = []
+        for i, name in enumerate(names):
+            if isinstance(args[i], int):
+                value = format_value(args[i])
+            elif i < len(emulated) and emulated[i]:
+                value = ' | '.join(format_value(v)
+                                   for v in sorted(emulated[i]))
+            else:
+                continue
+            parts.append('{} = {}'.format(name, value))
+        if parts:
+            rv[ins.pc] = ', '.join(parts)
+    return rv
@@ -0,0 +1,157 @@
+"""
+Functions of evm_cfg_builder's CFG and the jump targets its value set
+analysis resolved, as plain data.
+"""
+from collections import namedtuple
+
+from ..decode import BASIC_BLOCK_END
+
+FunctionInfo = namedtuple(
+    'FunctionInfo', ['address', 'start', 'name', 'hash_id', 'attributes',
+                     'blocks'])
+
+
+def view_address(cfg_addr):
+    """Address of the EVMView function for the one evm_cfg_builder starts at
+    cfg_addr, its entry JUMPDEST."""
+    return cfg_addr + 1 if cfg_addr != 0 else 0
+
+
+def cfg_functions(cfg):
+    """FunctionInfo of every function in cfg, blocks as (start, end) pcs of
+    their first and last instruction."""
+    return [FunctionInfo(view_address(f.start_addr), f.start_addr, f.name,
+                         f.hash_id, sorted(f.attributes),
+                         sorted((bb.start.pc, bb.end.pc)
+                                for bb in f.basic_blocks))
+            for f in cfg.functions]
+
+
+def function_branches(cfg, start, stop=None, calls=None):
+    """
+    {jump pc: set of targets} of the jumps VSA resolved in the function
+    whose entry block is at start, without the fall through of JUMPIs.
+    Blocks stop(pc) is true for, e.g. the entries of other functions, are
+    not walked into; the walk goes on at the return address of the jumps in
+    calls, {jump pc: CallSite} of internal calls. Empty if evm_cfg_builder
+    has no function at start.
+    """
+    function = cfg.get_function_at(start)
+    if function is None:
+        return {}
+    hash_id = function.hash_id
+    calls = calls or {}
+    to_process = [cfg.get_basic_block_at(start)]
+    seen = set()
+    rv = {}
+
+    while to_process:
+        basic_block = to_process.pop()
+        seen.add(basic_block)
+        end = basic_block.end.pc
+        if end in calls:
+            # the callee's blocks are not walked, its return is
+            ret = cfg.get_basic_block_at(calls[end].ret)
+            if ret is not None and ret not in seen:
+                to_process.append(ret)
+        outgoing_edges = basic_block.outgoing_basic_blocks(hash_id)
+        if outgoing_edges is None:
+            continue
+
+        for outgoing_edge in outgoing_edges:
+            if ((stop is None or not stop(outgoing_edge.start.pc)) and
+                    outgoing_edge not in seen):
+                to_process.append(outgoing_edge)
+
+            if not basic_block.ends_with_jump_or_jumpi:
+                continue
+            targets = rv.setdefault(end, set())
+            if (not basic_block.ends_with_jumpi or
+                    outgoing_edge.start.pc != end + 1):
+                targets.add(outgoing_edge.start.pc)
+    return rv
+
+
+def function_blocks(cfg, start, stop=None, calls=None, returns=()):
+    """
+    The evm_cfg_builder blocks of the function whose entry block is at
+    start the way the EVMView has it, sorted by start: followed through
+    fall through, the jump targets VSA resolved in any function and the
+    targets pushed right before a jump, not into the blocks stop(pc) is
+    true for nor past the jumps in returns; the walk goes on at the return
+    address of the jumps in calls, {jump pc: CallSite}.
+    """
+    calls = calls or {}
+    to_process = [start]
+    blocks = {}
+
+    while to_process:
+        pc = to_process.pop()
+        if pc in blocks:
+            continue
+        basic_block = cfg.get_basic_block_at(pc)
+        if basic_block is None:
+            continue
+        blocks[pc] = basic_block
+        last = basic_block.end
+        successors = []
+        if last.pc in calls:
+            successors.append(calls[last.pc].ret)
+        elif last.pc not in returns and last.name in ('JUMP', 'JUMPI'):
+            successors.extend(out.start.pc for out in
+                              basic_block.all_outgoing_basic_blocks)
+            instructions = basic_block.instructions
+            if (len(instructions) > 1 and
+                    instructions[-2].name.startswith('PUSH')):
+                successors.append(instructions[-2].operand)
+        if last.name == 'JUMPI' or last.name not in BASIC_BLOCK_END:
+            successors.append(last.pc + last.size)
+        to_process.extend(successor for successor in successors
+                          if successor != start and
+                          (stop is None or not stop(successor)))
+    return [blocks[pc] for pc in sorted(blocks)]
+
+
+# evm_cfg_builder (0.3.1, pinned in requirements.txt) can neither run VSA
+# for one function nor take a function's edges from another CFG. These two
+# are the only code reaching into its internals for that: the
+# CFG._basic_blocks and CFG._optimization_enabled attributes and the
+# BasicBlock.reacheable list of the functions that reach a block.
+
+
+def analyze_function(cfg, function):
+    """Run VSA for one function of a CFG built with compute_cfgs=False, the
+    way CFG.create_cfgs does for all of them."""
+    from evm_cfg_builder.cfg.function import Function
+    from evm_cfg_builder.value_analysis.value_set_analysis import \
+        StackValueAnalysis
+    vsa = StackValueAnalysis(cfg, function.entry, function.hash_id,
+                             cfg._optimization_enabled)
+    function.basic_blocks = [cfg._basic_blocks[bb] for bb in vsa.analyze()]
+    if function.hash_id != Function.DISPATCHER_ID:
+        function.check_payable()
+        function.check_view()
+        function.check_pure()
+
+
+def copy_function_edges(old_function, new_cfg, new_function):
+    """Carry the VSA result of a function over to the same function of
+    new_cfg. Returns False if its blocks don't exist there any more."""
+    key = old_function.key
+    pairs = []
+    for old_bb in old_function.basic_blocks:
+        new_bb = new_cfg.get_basic_block_at(old_bb.start.pc)
+        if new_bb is None or new_bb.end.pc != old_bb.end.pc:
+            return False
+        pairs.append((old_bb, new_bb))
+
+    for old_bb, new_bb in pairs:
+        new_bb.reacheable.append(key)
+        for son in old_bb.outgoing_basic_blocks(key):
+            new_son = new_cfg.get_basic_block_at(son.start.pc)
+            new_bb.add_outgoing_basic_block(new_son, key)
+            new_son.add_incoming_basic_block(new_bb, key)
+    new_function.basic_blocks = [new_bb for _, new_bb in pairs]
+    for attribute in old_function.attributes:
+        new_function.add_attributes(attribute)
+    return True
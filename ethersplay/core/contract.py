@@ -0,0 +1,150 @@
+"""
+Headless analysis of one contract: what the plugin derives when a view is
+opened, as JSON-serializable data, without Binary Ninja.
+"""
+import sys
+import json
+import argparse
+import multiprocessing
+
+from ..common import code_hash
+from ..decode import basic_blocks, decode
+from ..proxy import classify
+from .annotations import instruction_comments
+from .cfg import cfg_functions, function_branches, view_address
+from .emulate import Emulator
+from .internal import find_internal_functions
+from .payloads import find_payloads
+from .reachable import find_unreachable
+from .segments import CODE, find_segments
+from .selectors import push_candidates, resolve_hashes
+
+
+def analyze(code, resolve=True, online=False, emulate=True):
+    """
+    Segments, payloads, proxy pattern, unreachable code, functions,
+    internal functions, resolved jumps, selectors and topics, and
+    instruction comments of code. Selectors, topics and comments are only
+    taken from reachable code.
+    Hashes are only looked up with resolve, and only online
+    (4byte.directory) with online. emulate adds the jumps and constant
+    arguments found by the emulator.
+    """
+    code = bytes(code)
+    payloads = find_payloads(code)
+    proxy = classify(code)
+    cfg = None
+    internal, calls = {}, {}
+    if not (proxy and proxy.skip_analysis):
+        # imported here, evm_cfg_builder takes most of the core's import
+        # time and proxies don't need it
+        from evm_cfg_builder.cfg import CFG
+        cfg = CFG(code)
+        internal, calls = find_internal_functions(code)
+    unreachable = find_unreachable(
+        code, cfg, payloads,
+        set(pc for function in internal.values() for pc in function.returns))
+    segments = find_segments(code, payloads, unreachable.ranges)
+    rv = {
+        'hash': code_hash(code),
+        'size': len(code),
+        'segments': [list(segment) for segment in segments],
+        'payloads': [{'hash': payload.hash, 'ranges': payload.ranges,
+                      'sites': payload.sites} for payload in payloads],
+        'proxy': dict(proxy._asdict()) if proxy else None,
+        'unreachable': dict(unreachable._asdict()),
+        'functions': [],
+        'internal': [],
+        'branches': {},
+        'selectors': {},
+        'topics': {},
+        'signatures': {},
+        'comments': {},
+    }
+
+    instructions = [ins for start, end, kind in segments if kind == CODE
+                    for ins in decode(code[start:end], start)]
+    selectors = []
+    topics = []
+    push_candidates(basic_blocks(instructions), selectors, topics)
+    rv['selectors'] = dict(selectors)
+    rv['topics'] = dict(topics)
+    if resolve:
+        rv['signatures'] = resolve_hashes(
+            [sig for _, sig in selectors], [sig for _, sig in topics],
+            online=online)
+
+    emulator = None
+    if cfg is not None:
+        functions = cfg_functions(cfg)
+        starts = set(f.start for f in functions)
+        emulator = Emulator(code) if emulate else None
+        branches = {}
+        for function in functions:
+            def stop(pc, entry=function.start):
+                return pc != entry and pc in starts
+            found = [function_branches(cfg, function.start, stop)]
+            if emulator is not None:
+                found.append(emulator.explore(
+                    function.start, lambda pc: not stop(pc)))
+            for resolved in found:
+                for source, targets in resolved.items():
+                    branches.setdefault(source, set()).update(targets)
+        if emulator is not None:
+            # only the values are needed from here on
+            emulator.clear_memo()
+        rv['functions'] = [dict(f._asdict()) for f in functions]
+        rv['internal'] = [
+            {'address': view_address(entry), 'start': entry,
+             'returns': sorted(function.returns),
+             'calls': sorted(site.pc for site in calls.values()
+                             if site.entry == entry)}
+            for entry, function in sorted(internal.items())]
+        rv['branches'] = dict((source, sorted(targets))
+                              for source, targets in branches.items()
+                              if targets)
+
+    rv['comments'] = instruction_comments(instructions, emulator)
+    return rv
+
+
+def _analyze_file(task):
+    filename, resolve = task
+    try:
+        with open(filename, 'rb') as f:
+            return filename, analyze(f.read(), resolve=resolve)
+    except Exception as e:
+        return filename, 'Err: {}'.format(e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze contracts without Binary Ninja, one JSON "
+                    "object per line")
+    parser.add_argument("files", nargs="+", help=".evm files")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--no-resolve", action="store_true",
+                        help="don't look up selectors and topics in the "
+                             "local caches")
+    args = parser.parse_args(argv)
+
+    tasks = [(filename, not args.no_resolve) for filename in args.files]
+    errors = 0
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        for filename, result in pool.imap_unordered(_analyze_file, tasks):
+            if isinstance(result, str):
+                sys.stderr.write('{}: {}\n'.format(filename, result))
+                errors += 1
+                continue
+            result['file'] = filename
+            sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+    finally:
+        pool.close()
+        pool.join()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
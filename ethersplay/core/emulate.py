@@ -0,0 +1,374 @@
+"""
+Concrete emulation of basic blocks with full 256-bit words and memory.
+
+Binary Ninja's dataflow runs over a lifter that truncates values to
+ADDR_SIZE and leaves most opcodes unimplemented, so jump tables, computed
+selectors and shifted masks stay unresolved. The emulator runs block
+sequences from a function entry with the values it knows: a stack entry or
+memory byte is an int when it only depends on constants, None otherwise.
+Results are memoized by (block, entry stack, entry memory), so blocks shared
+between functions, and functions analyzed again, are emulated once. The
+memo keeps the MEMO_SIZE most recently used blocks and is dropped with
+clear_memo() once the initial analysis is done.
+"""
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+from .. import profiling
+from ..constprop import _FOLD, MASK, WORD
+from ..decode import TERMINATORS, basic_blocks, decode
+from .annotations import ANNOTATIONS
+from .internal import call_return_stack
+
+# blocks emulated per explore(), bounds loops with a constant counter
+MAX_STEPS = 20000
+# memory writes above this offset make the whole memory unknown
+MAX_MEMORY = 0x10000
+# distinct argument tuples kept per instruction
+MAX_VALUES = 4
+# emulated blocks memoized, None for no limit
+MEMO_SIZE = 8192
+
+_Block = namedtuple('_Block', ['stack', 'memory', 'successors', 'jump',
+                               'values', 'steps'])
+
+
+def _signed(value):
+    return value - WORD if value >> 255 else value
+
+
+def _sdiv(a, b):
+    if not b:
+        return 0
+    a, b = _signed(a), _signed(b)
+    q = abs(a) // abs(b)
+    return (-q if (a < 0) != (b < 0) else q) & MASK
+
+
+def _smod(a, b):
+    if not b:
+        return 0
+    a, b = _signed(a), _signed(b)
+    r = abs(a) % abs(b)
+    return (-r if a < 0 else r) & MASK
+
+
+def _sar(shift, value):
+    if shift >= 256:
+        return MASK if value >> 255 else 0
+    return (_signed(value) >> shift) & MASK
+
+
+def _signextend(b, x):
+    if b >= 31:
+        return x
+    bit = 8 * b + 7
+    mask = (1 << (bit + 1)) - 1
+    return x | (MASK ^ mask) if (x >> bit) & 1 else x & mask
+
+
+_BINARY = dict(_FOLD)
+_BINARY.update({
+    'SDIV': _sdiv,
+    'SMOD': _smod,
+    'SLT': lambda a, b: int(_signed(a) < _signed(b)),
+    'SGT': lambda a, b: int(_signed(a) > _signed(b)),
+    'SAR': _sar,
+    'BYTE': lambda i, x: (x >> (248 - 8 * i)) & 0xff if i < 32 else 0,
+    'SIGNEXTEND': _signextend,
+})
+
+_TERNARY = {
+    'ADDMOD': lambda a, b, n: (a + b) % n if n else 0,
+    'MULMOD': lambda a, b, n: (a * b) % n if n else 0,
+}
+
+# (memory offset, size) argument positions of instructions writing memory
+# with data we don't know
+_MEMORY_WRITES = {
+    'CALLDATACOPY': (0, 2),
+    'RETURNDATACOPY': (0, 2),
+    'EXTCODECOPY': (1, 3),
+    'CALL': (5, 6),
+    'CALLCODE': (5, 6),
+    'DELEGATECALL': (4, 5),
+    'STATICCALL': (4, 5),
+}
+
+
+def _known(*values):
+    return all(isinstance(v, int) for v in values)
+
+
+def _forget(memory, offset, size):
+    if _known(offset, size) and offset + size <= MAX_MEMORY:
+        for i in range(offset, offset + size):
+            memory.pop(i, None)
+    else:
+        memory.clear()
+
+
+def _store(memory, offset, data):
+    """Write data, a list of byte values or None, at offset."""
+    if not isinstance(offset, int) or offset + len(data) > MAX_MEMORY:
+        memory.clear()
+        return
+    for i, byte in enumerate(data):
+        if byte is None:
+            memory.pop(offset + i, None)
+        else:
+            memory[offset + i] = byte
+
+
+def _trim(stack):
+    # unknown entries at the bottom are the same as no entries
+    i = 0
+    while i < len(stack) and stack[i] is None:
+        i += 1
+    return tuple(stack[i:])
+
+
+class Emulator(object):
+    """Memoized concrete emulation of the basic blocks of code."""
+
+    def __init__(self, code):
+        self.code = bytes(code)
+        self.blocks = dict((block[0].pc, block)
+                           for block in basic_blocks(decode(self.code)))
+        self.jumpdests = set(pc for pc, block in self.blocks.items()
+                             if block[0].name == 'JUMPDEST')
+        # jump pc -> set of resolved targets
+        self.targets = {}
+        # pc -> [tuple of arguments, top of stack first] of annotated
+        # instructions, None for the arguments that are not constant
+        self.values = {}
+        # pcs that had more than MAX_VALUES distinct arguments
+        self.varied = set()
+        # starts whose last explore() ran out of steps or time
+        self.truncated = set()
+        # (start, entry stack, entry memory) -> _Block, least recently
+        # used first
+        self._memo = OrderedDict()
+        # guards the memo and the results, not the emulation
+        self._lock = threading.Lock()
+
+    def _execute(self, ins, args, memory):
+        """Apply ins to memory and return the value it pushes."""
+        name = ins.name
+        if name in _BINARY:
+            if _known(*args):
+                return _BINARY[name](*args)
+        elif name in _TERNARY:
+            if _known(*args):
+                return _TERNARY[name](*args)
+        elif name == 'NOT':
+            if _known(*args):
+                return MASK ^ args[0]
+        elif name == 'ISZERO':
+            if _known(*args):
+                return int(args[0] == 0)
+        elif name == 'PC':
+            return ins.pc
+        elif name == 'CODESIZE':
+            return len(self.code)
+        elif name == 'MLOAD':
+            offset = args[0]
+            if isinstance(offset, int):
+                data = [memory.get(i) for i in range(offset, offset + 32)]
+                if None not in data:
+                    return int.from_bytes(bytes(data), 'big')
+        elif name == 'MSTORE':
+            offset, value = args
+            if isinstance(value, int):
+                _store(memory, offset, list(value.to_bytes(32, 'big')))
+            else:
+                _store(memory, offset, [None] * 32)
+        elif name == 'MSTORE8':
+            offset, value = args
+            _store(memory, offset,
+                   [value & 0xff if isinstance(value, int) else None])
+        elif name == 'CODECOPY':
+            offset, code_offset, size = args
+            if _known(code_offset, size) and size <= MAX_MEMORY:
+                data = self.code[code_offset:code_offset + size]
+                _store(memory, offset,
+                       list(data) + [0] * (size - len(data)))
+            else:
+                _forget(memory, offset, size)
+        elif name == 'MCOPY':
+            offset, source, size = args
+            if _known(source, size) and size <= MAX_MEMORY:
+                _store(memory, offset, [memory.get(i) for i in
+                                        range(source, source + size)])
+            else:
+                _forget(memory, offset, size)
+        elif name in _MEMORY_WRITES:
+            offset, size = _MEMORY_WRITES[name]
+            _forget(memory, args[offset], args[size])
+        return None
+
+    def _run_block(self, start, stack, memory):
+        stack = list(stack)
+        memory = dict(memory)
+        values = []
+        args = []
+        block = self.blocks[start]
+        for ins in block:
+            name = ins.name
+            if name.startswith('PUSH'):
+                stack.append(ins.operand or 0)
+                continue
+            if name.startswith('DUP'):
+                n = int(name[3:])
+                stack.append(stack[-n] if len(stack) >= n else None)
+                continue
+            if name.startswith('SWAP'):
+                n = int(name[4:])
+                if len(stack) <= n:
+                    stack[:0] = [None] * (n + 1 - len(stack))
+                stack[-1], stack[-1 - n] = stack[-1 - n], stack[-1]
+                continue
+
+            n = ins.pops
+            if len(stack) < n:
+                stack[:0] = [None] * (n - len(stack))
+            args = stack[len(stack) - n:][::-1] if n else []
+            if n:
+                del stack[-n:]
+            if name in ANNOTATIONS:
+                values.append((ins.pc, tuple(args)))
+            result = self._execute(ins, args, memory)
+            if ins.pushes:
+                stack.append(result)
+
+        last = block[-1]
+        successors = []
+        jump = None
+        if last.name in ('JUMP', 'JUMPI'):
+            target = args[0]
+            if isinstance(target, int) and target in self.jumpdests:
+                jump = (last.pc, target)
+            taken = last.name == 'JUMP' or args[1] is None or args[1] != 0
+            if jump and taken:
+                successors.append(target)
+            if last.name == 'JUMPI' and (args[1] is None or args[1] == 0):
+                successors.append(last.pc + 1)
+        elif last.name not in TERMINATORS:
+            successors.append(last.pc + last.size)
+        return _Block(_trim(stack), tuple(sorted(memory.items())),
+                      tuple(s for s in successors if s in self.blocks),
+                      jump, values, len(block))
+
+    def run_block(self, start, stack=(), memory=()):
+        """
+        Emulate the block at start from an entry stack (bottom first) and
+        memory, a sorted tuple of (offset, byte). Returns a _Block with the
+        exit state, the successors that can be taken and the jump resolved
+        at its end, if any.
+        """
+        key = (start, _trim(stack), memory)
+        with self._lock:
+            result = self._memo.get(key)
+            if result is not None:
+                self._memo.move_to_end(key)
+        profiling.cache('emulated blocks', result is not None)
+        if result is None:
+            # another thread may emulate the same block meanwhile, the
+            # result is the same
+            result = self._run_block(*key)
+            with self._lock:
+                self._memo[key] = result
+                if MEMO_SIZE is not None and len(self._memo) > MEMO_SIZE:
+                    self._memo.popitem(last=False)
+        return result
+
+    def clear_memo(self):
+        """Drop the memoized blocks, targets and values are kept."""
+        with self._lock:
+            self._memo.clear()
+
+    def explore(self, start, follow=None, max_steps=MAX_STEPS,
+                internal=None, deadline=None):
+        """
+        Emulate the paths from the block at start, with unknown stack and
+        memory, entering only the blocks follow(pc) accepts. With internal,
+        the (functions, calls) of core.internal.find_internal_functions,
+        paths go on at the return address of a call whose callee follow
+        rejects, with the stack the callee leaves and unknown memory.
+        Emulation stops after max_steps blocks or at deadline, a
+        time.perf_counter() value, and start is then added to truncated.
+        Returns {jump pc: set of targets} of the jumps resolved on the way;
+        they and the constant arguments of annotated instructions are also
+        added to targets and values.
+        """
+        functions, calls = internal or ({}, {})
+        resolved = {}
+        if start not in self.blocks:
+            return resolved
+        state = (start, (), ())
+        work = [state]
+        seen = set(work)
+        steps = 0
+        while work and steps < max_steps:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            result = self.run_block(*work.pop())
+            steps += result.steps
+            with self._lock:
+                for pc, args in result.values:
+                    known = self.values.setdefault(pc, [])
+                    if args not in known:
+                        if len(known) < MAX_VALUES:
+                            known.append(args)
+                        else:
+                            self.varied.add(pc)
+                if result.jump:
+                    source, target = result.jump
+                    self.targets.setdefault(source, set()).add(target)
+            if result.jump:
+                resolved.setdefault(source, set()).add(target)
+                site = calls.get(source)
+                if (site is not None and site.ret in self.blocks and
+                        follow is not None and not follow(target)):
+                    state = (site.ret, _trim(call_return_stack(
+                        functions[site.entry], result.stack)), ())
+                    if state not in seen:
+                        seen.add(state)
+                        work.append(state)
+            for successor in result.successors:
+                if follow is not None and not follow(successor):
+                    continue
+                state = (successor, result.stack, result.memory)
+                if state not in seen:
+                    seen.add(state)
+                    work.append(state)
+        with self._lock:
+            if work:
+                self.truncated.add(start)
+            else:
+                self.truncated.discard(start)
+        return resolved
+
+    def constant_args(self, pc):
+        """The arguments of the instruction at pc, top of the stack first,
+        as the set of values each took if it was constant on every emulated
+        path, None otherwise. Empty if the instruction was not reached or
+        saw too many distinct arguments."""
+        values = self.values.get(pc)
+        if not values or pc in self.varied:
+            return []
+        rv = []
+        for i in range(len(values[0])):
+            seen = set(args[i] for args in values)
+            rv.append(None if None in seen else seen)
+        return rv
+
+
+def view_emulator(view):
+    """The Emulator of a view, created from its data on first use."""
+    emulator = view.session_data.get('emulator')
+    if emulator is None:
+        emulator = Emulator(view.read(0, len(view)))
+        view.session_data['emulator'] = emulator
+    return emulator
@@ -0,0 +1,340 @@
+"""
+Control flow graphs of contracts as DOT, GraphML or JSON, written one
+function at a time so only the CFG of the contract being exported is held in
+memory. Instruction text comes from the decoded instructions, formatted like
+the EVM architecture's disassembly but without the stack variable
+annotations Render Flowgraphs strips; the true branch of a JUMPI is the one
+that is not its fall through, as in Render Flowgraphs.
+"""
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+from bisect import bisect_left
+from collections import namedtuple
+from xml.sax.saxutils import escape, quoteattr
+
+from ..decode import TERMINATORS, basic_blocks, decode
+from ..proxy import classify
+from .cfg import view_address
+
+# edge types, named like Binary Ninja's BranchType
+UNCONDITIONAL = 'UnconditionalBranch'
+TRUE = 'TrueBranch'
+FALSE = 'FalseBranch'
+
+EXPORT_CHUNK_SIZE = 8
+
+# blocks are (start, end) byte ranges, edges (source block, target block,
+# type)
+FunctionGraph = namedtuple('FunctionGraph',
+                           ['address', 'name', 'blocks', 'edges'])
+
+
+def instruction_text(ins):
+    """'PUSH2 #80', the text of ins in the disassembly."""
+    if ins.name.startswith('PUSH'):
+        return '{} #{:0{}x}'.format(ins.name, ins.operand or 0, ins.size - 1)
+    return ins.name
+
+
+def _edge_type(end_name, target, fall_through):
+    if end_name == 'JUMPI':
+        return FALSE if target == fall_through else TRUE
+    return UNCONDITIONAL
+
+
+def cfg_graphs(cfg):
+    """Yield the FunctionGraph of every function of an evm_cfg_builder
+    CFG."""
+    for function in cfg.functions:
+        blocks = []
+        edges = []
+        for bb in sorted(function.basic_blocks, key=lambda bb: bb.start.pc):
+            start = bb.start.pc
+            end = bb.end.pc + bb.end.size
+            blocks.append((start, end))
+            for out in bb.outgoing_basic_blocks(function.key) or ():
+                edges.append((start, out.start.pc,
+                              _edge_type(bb.end.name, out.start.pc, end)))
+        yield FunctionGraph(view_address(function.start_addr), function.name,
+                            blocks, edges)
+
+
+def linear_graph(instructions, name):
+    """One FunctionGraph of the basic blocks of instructions with their fall
+    through edges, for code evm_cfg_builder is not run on."""
+    blocks = []
+    edges = []
+    bbs = basic_blocks(instructions)
+    starts = set(block[0].pc for block in bbs)
+    for block in bbs:
+        last = block[-1]
+        start, end = block[0].pc, last.pc + last.size
+        blocks.append((start, end))
+        if end in starts and last.name not in TERMINATORS and \
+                last.name != 'JUMP':
+            edges.append((start, end, _edge_type(last.name, end, end)))
+    return FunctionGraph(0, name, blocks, edges)
+
+
+def code_graphs(code):
+    """Yield the FunctionGraphs of code; proxies that are not analyzed when
+    opened are one linear graph."""
+    proxy = classify(code)
+    if proxy is not None and proxy.skip_analysis:
+        yield linear_graph(decode(code), '_proxy')
+        return
+    # evm_cfg_builder is slow to import, see contract.analyze
+    from evm_cfg_builder.cfg import CFG
+    for graph in cfg_graphs(CFG(bytes(code))):
+        yield graph
+
+
+class GraphWriter(object):
+    """Streams FunctionGraphs of one contract to the file object f."""
+
+    extension = None
+
+    def __init__(self, f, name, instructions):
+        self.f = f
+        self.name = name
+        self.instructions = instructions
+        self.pcs = [ins.pc for ins in instructions]
+
+    def lines(self, start, end):
+        """(pc, text) of the instructions of a block."""
+        return [(ins.pc, instruction_text(ins)) for ins in
+                self.instructions[bisect_left(self.pcs, start):
+                                  bisect_left(self.pcs, end)]]
+
+    def begin(self):
+        pass
+
+    def write(self, graph):
+        raise NotImplementedError
+
+    def end(self):
+        pass
+
+
+def _dot_id(function, block):
+    return '"{:x}_{:x}"'.format(function, block)
+
+
+def _dot_string(text):
+    return '"{}"'.format(text.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+class DotWriter(GraphWriter):
+    """A digraph with a cluster per function and the disassembly of a block
+    as its label."""
+
+    extension = 'dot'
+
+    _EDGE_COLORS = {TRUE: 'green', FALSE: 'red', UNCONDITIONAL: 'blue'}
+
+    def begin(self):
+        self.f.write('digraph {} {{\n'.format(_dot_string(self.name)))
+        self.f.write('  node [shape=box fontname="monospace"];\n')
+
+    def write(self, graph):
+        f = self.f
+        f.write('  subgraph {} {{\n    label={};\n'.format(
+            _dot_string('cluster_{:x}'.format(graph.address)),
+            _dot_string(graph.name)))
+        for start, end in graph.blocks:
+            label = ''.join('{:#x}: {}\\l'.format(pc, text)
+                            for pc, text in self.lines(start, end))
+            f.write('    {} [label="{}"];\n'.format(
+                _dot_id(graph.address, start), label))
+        for source, target, kind in graph.edges:
+            f.write('    {} -> {} [color={}];\n'.format(
+                _dot_id(graph.address, source),
+                _dot_id(graph.address, target),
+                self._EDGE_COLORS.get(kind, 'black')))
+        f.write('  }\n')
+
+    def end(self):
+        self.f.write('}\n')
+
+
+class GraphMLWriter(GraphWriter):
+    """One GraphML graph for the contract, blocks carry their address,
+    function and disassembly, edges their type."""
+
+    extension = 'graphml'
+
+    def begin(self):
+        self.f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+            '  <key id="address" for="node" attr.name="address" '
+            'attr.type="long"/>\n'
+            '  <key id="function" for="node" attr.name="function" '
+            'attr.type="string"/>\n'
+            '  <key id="label" for="node" attr.name="label" '
+            'attr.type="string"/>\n'
+            '  <key id="type" for="edge" attr.name="type" '
+            'attr.type="string"/>\n'
+            '  <key id="name" for="graph" attr.name="name" '
+            'attr.type="string"/>\n'
+            '  <graph id={} edgedefault="directed">\n'
+            '    <data key="name">{}</data>\n'.format(
+                quoteattr(self.name), escape(self.name)))
+
+    def write(self, graph):
+        f = self.f
+        for start, end in graph.blocks:
+            label = '\n'.join('{:#x}: {}'.format(pc, text)
+                              for pc, text in self.lines(start, end))
+            f.write('    <node id="{:x}_{:x}"><data key="address">{}</data>'
+                    '<data key="function">{}</data>'
+                    '<data key="label">{}</data></node>\n'.format(
+                        graph.address, start, start, escape(graph.name),
+                        escape(label)))
+        for source, target, kind in graph.edges:
+            f.write('    <edge source="{0:x}_{1:x}" target="{0:x}_{2:x}">'
+                    '<data key="type">{3}</data></edge>\n'.format(
+                        graph.address, source, target, kind))
+
+    def end(self):
+        self.f.write('  </graph>\n</graphml>\n')
+
+
+class JsonWriter(GraphWriter):
+    """{"name": ..., "functions": [{"address", "name", "blocks": [{"start",
+    "end", "instructions": [[pc, text]]}], "edges": [[source, target,
+    type]]}]}"""
+
+    extension = 'json'
+
+    def begin(self):
+        self.f.write('{{"name": {}, "functions": ['.format(
+            json.dumps(self.name)))
+        self.first = True
+
+    def write(self, graph):
+        if not self.first:
+            self.f.write(',')
+        self.first = False
+        self.f.write('\n' + json.dumps({
+            'address': graph.address,
+            'name': graph.name,
+            'blocks': [{'start': start, 'end': end,
+                        'instructions': self.lines(start, end)}
+                       for start, end in graph.blocks],
+            'edges': graph.edges,
+        }))
+
+    def end(self):
+        self.f.write('\n]}\n')
+
+
+FORMATS = {writer.extension: writer
+           for writer in (DotWriter, GraphMLWriter, JsonWriter)}
+
+
+def write_graphs(f, graphs, instructions, fmt='dot', name=''):
+    """Stream graphs, with the text of the decoded instructions, to f in
+    fmt. Returns the number of functions written."""
+    writer = FORMATS[fmt](f, name, instructions)
+    writer.begin()
+    count = 0
+    for graph in graphs:
+        writer.write(graph)
+        count += 1
+    writer.end()
+    return count
+
+
+def export_code(code, filename, fmt='dot', name=None):
+    """Write the CFG of code to filename, atomically. Returns the number of
+    functions written."""
+    code = bytes(code)
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            count = write_graphs(f, code_graphs(code), decode(code), fmt,
+                                 name or os.path.basename(filename))
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return count
+
+
+def output_filename(filename, output_dir, fmt):
+    base = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(output_dir, '{}.{}'.format(base, fmt))
+
+
+def _export_file(task):
+    filename, output, fmt = task
+    try:
+        with open(filename, 'rb') as f:
+            code = f.read()
+        return filename, export_code(code, output, fmt,
+                                     os.path.basename(filename))
+    except Exception as e:
+        return filename, '{}: {}'.format(type(e).__name__, e)
+
+
+def export_files(filenames, output_dir, fmt='dot', jobs=None, force=False):
+    """
+    Export the CFG of every file into output_dir on a pool of jobs worker
+    processes, each writing its own files; files that already have an
+    export are skipped unless force. Returns (written, skipped, failed).
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    tasks = []
+    skipped = 0
+    for filename in filenames:
+        output = output_filename(filename, output_dir, fmt)
+        if not force and os.path.exists(output):
+            skipped += 1
+            continue
+        tasks.append((filename, output, fmt))
+
+    written = failed = 0
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for filename, result in pool.imap_unordered(
+                _export_file, tasks, EXPORT_CHUNK_SIZE):
+            if isinstance(result, str):
+                sys.stderr.write('{}: {}\n'.format(filename, result))
+                failed += 1
+            else:
+                written += 1
+    finally:
+        pool.close()
+        pool.join()
+    return written, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export the control flow graphs of contracts without "
+                    "Binary Ninja")
+    parser.add_argument("files", nargs="+", help=".evm files")
+    parser.add_argument("--format", choices=sorted(FORMATS), default='dot')
+    parser.add_argument("--output-dir", default='.',
+                        help="directory for <file>.<format> "
+                             "(default: %(default)s)")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true",
+                        help="export files that were exported before again")
+    args = parser.parse_args(argv)
+
+    written, skipped, failed = export_files(
+        args.files, args.output_dir, args.format, args.jobs, args.force)
+    print('exported {} contracts, {} skipped, {} failed'.format(
+        written, skipped, failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
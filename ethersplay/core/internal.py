@@ -0,0 +1,284 @@
+"""
+Recovery of internal functions, the ones solc calls with
+
+    PUSH return  <arguments>  PUSH entry  JUMP
+
+and that return with a JUMP to the address their caller left below the
+arguments. evm_cfg_builder only reports the functions the dispatcher jumps
+to, so without this the internal functions are inlined into every caller.
+
+Paths are followed from the start of the code with a symbolic stack: a
+value is an int if it is a constant, Arg(i) if it is the i-th entry of the
+stack (from the top) when the function being explored was entered, and None
+otherwise. A JUMP to Arg(i) is a return. A JUMP to a constant while a
+constant JUMPDEST is on the stack is a call if exploring its target finds
+returns through the stack entry holding that JUMPDEST; the path then goes on
+at the return address with the stack the callee leaves. Callees are
+explored once and summarized by what they consume and leave on the stack.
+"""
+from collections import namedtuple
+
+from ..constprop import _FOLD
+from ..decode import TERMINATORS, basic_blocks, decode
+
+# blocks explored per function, bounds loops with a growing stack
+MAX_BLOCKS = 50000
+# paths with a deeper stack are dropped
+MAX_STACK = 1024
+# states a block is explored in before the constants on its stack that are
+# not JUMPDESTs are forgotten, bounds loops with a constant counter
+MAX_STATES = 4
+# callees explored while exploring a caller, deeper ones are explored later
+MAX_DEPTH = 64
+
+# summary of a function too deep to be explored now, paths calling it are
+# dropped until it is
+_DEFERRED = object()
+
+# the index-th stack entry, from the top, at function entry
+Arg = namedtuple('Arg', ['index'])
+
+# entry: the JUMPDEST callers jump to. returns: pcs of the JUMPs returning.
+# ret: stack index of the return address at entry. consumed: entries of the
+# caller's stack it pops, return address included. produced: what it leaves
+# in their place, bottom first, Arg for entries passed through.
+InternalFunction = namedtuple('InternalFunction',
+                              ['entry', 'returns', 'ret', 'consumed',
+                               'produced'])
+
+# pc: the JUMP calling entry, execution continues at ret when it returns
+CallSite = namedtuple('CallSite', ['pc', 'entry', 'ret'])
+
+
+class _Stack(object):
+    """A symbolic stack: items, bottom first, above the first `below`
+    entries of the entry stack, which were not touched yet."""
+
+    __slots__ = ('items', 'below')
+
+    def __init__(self, items=(), below=0):
+        self.items = list(items)
+        self.below = below
+
+    def need(self, n):
+        """Bring the top n entries into items."""
+        missing = n - len(self.items)
+        if missing > 0:
+            self.items[:0] = [Arg(self.below + i)
+                              for i in reversed(range(missing))]
+            self.below += missing
+
+    def peek(self, i):
+        self.need(i + 1)
+        return self.items[-1 - i]
+
+    def pop(self, n):
+        self.need(n)
+        rv = self.items[len(self.items) - n:][::-1]
+        del self.items[len(self.items) - n:]
+        return rv
+
+    def key(self):
+        return tuple(self.items), self.below
+
+    def summary(self):
+        """(consumed, produced) of a function returning with this stack:
+        entries left where they were at entry are not part of either."""
+        items = list(self.items)
+        below = self.below
+        while items and items[0] == Arg(below - 1):
+            items.pop(0)
+            below -= 1
+        return below, tuple(items)
+
+
+def call_return_stack(function, items):
+    """The stack, bottom first, a caller with items on its stack (bottom
+    first, target popped) has when function returns to it."""
+    consumed = min(function.consumed, len(items))
+    rest = list(items[:len(items) - consumed])
+    for value in function.produced:
+        if isinstance(value, Arg):
+            value = (items[-1 - value.index]
+                     if value.index < len(items) else None)
+        rest.append(value)
+    return rest
+
+
+class _Finder(object):
+    def __init__(self, code):
+        self.blocks = dict((block[0].pc, block)
+                           for block in basic_blocks(decode(code)))
+        self.jumpdests = set(pc for pc, block in self.blocks.items()
+                             if block[0].name == 'JUMPDEST')
+        # entry -> InternalFunction, None if it is not one or being explored
+        self.functions = {}
+        # call jump pc -> (entry, set of return addresses)
+        self.calls = {}
+        # entries being explored, outermost first
+        self.path = []
+        # entries to explore again, the last first: callees past MAX_DEPTH
+        # after the callers they were taken for a jump in
+        self.deferred = []
+
+    def _run_block(self, start, stack):
+        """Execute the block at start on stack. Returns (last instruction,
+        its args)."""
+        args = []
+        for ins in self.blocks[start]:
+            name = ins.name
+            if name.startswith('PUSH'):
+                stack.items.append(ins.operand or 0)
+                continue
+            if name.startswith('DUP'):
+                stack.items.append(stack.peek(int(name[3:]) - 1))
+                continue
+            if name.startswith('SWAP'):
+                n = int(name[4:])
+                stack.need(n + 1)
+                items = stack.items
+                items[-1], items[-1 - n] = items[-1 - n], items[-1]
+                continue
+            args = stack.pop(ins.pops)
+            result = None
+            if name in _FOLD:
+                if all(isinstance(a, int) for a in args):
+                    result = _FOLD[name](*args)
+            elif name == 'PC':
+                result = ins.pc
+            if ins.pushes:
+                stack.items.append(result)
+                stack.items.extend([None] * (ins.pushes - 1))
+        return ins, args
+
+    def _call(self, pc, target, stack):
+        """The function target is if the jump at pc is a call of it with
+        stack, else None; _DEFERRED if that is not known yet."""
+        if not any(isinstance(v, int) and v in self.jumpdests and
+                   v != target for v in stack.items):
+            return None
+        function = self.summarize(target)
+        if function is None or function is _DEFERRED:
+            return function
+        ret = stack.peek(function.ret)
+        if not isinstance(ret, int) or ret not in self.jumpdests:
+            # e.g. a jump from the argument evaluation of another call
+            return None
+        entry, returns = self.calls.setdefault(pc, (target, set()))
+        returns.add(ret)
+        return function
+
+    def explore(self, start):
+        """Follow the paths from start, whose stack is the entry stack.
+        Returns the (pc, Arg, stack) of the returns found."""
+        work = [(start, _Stack())]
+        seen = set()
+        visits = {}
+        returns = []
+        steps = 0
+        while work and steps < MAX_BLOCKS:
+            pc, stack = work.pop()
+            visits[pc] = visits.get(pc, 0) + 1
+            if visits[pc] > MAX_STATES:
+                stack.items = [None if isinstance(v, int) and
+                               v not in self.jumpdests else v
+                               for v in stack.items]
+            key = (pc,) + stack.key()
+            if key in seen or len(stack.items) > MAX_STACK:
+                continue
+            seen.add(key)
+            steps += 1
+            last, args = self._run_block(pc, stack)
+            successors = []
+            if last.name in ('JUMP', 'JUMPI'):
+                target = args[0]
+                if isinstance(target, Arg):
+                    if last.name == 'JUMP':
+                        returns.append((last.pc, target, stack))
+                elif isinstance(target, int) and target in self.jumpdests:
+                    function = None
+                    if last.name == 'JUMP':
+                        function = self._call(last.pc, target, stack)
+                    if function is _DEFERRED:
+                        continue
+                    if function is not None:
+                        ret = stack.peek(function.ret)
+                        successors.append((ret, _Stack(
+                            call_return_stack(function, stack.items),
+                            stack.below)))
+                    else:
+                        successors.append((target, stack))
+                if last.name == 'JUMPI':
+                    successors.append((last.pc + 1, _Stack(stack.items,
+                                                           stack.below)))
+            elif last.name not in TERMINATORS:
+                successors.append((last.pc + last.size, stack))
+            for successor, successor_stack in successors:
+                if successor in self.blocks:
+                    work.append((successor, successor_stack))
+        return returns
+
+    def summarize(self, entry):
+        """The InternalFunction at entry, None if it does not return
+        consistently through its stack or is being explored, _DEFERRED if
+        it, or a function it calls, is too deep to be explored now."""
+        if entry in self.functions:
+            return self.functions[entry]
+        if len(self.path) >= MAX_DEPTH:
+            self.deferred.extend(self.path)
+            self.deferred.append(entry)
+            return _DEFERRED
+        deferred = len(self.deferred)
+        self.functions[entry] = None
+        self.path.append(entry)
+        try:
+            returns = self.explore(entry)
+        finally:
+            self.path.pop()
+        if len(self.deferred) > deferred:
+            # explored again once the deferred callees are summarized
+            del self.functions[entry]
+            return _DEFERRED
+        function = None
+        for pc, target, stack in returns:
+            consumed, produced = stack.summary()
+            if function is None:
+                function = InternalFunction(entry, {pc}, target.index,
+                                            consumed, produced)
+            elif (function.ret, function.consumed, len(function.produced)) \
+                    != (target.index, consumed, len(produced)):
+                function = None
+                break
+            else:
+                function.returns.add(pc)
+                function = function._replace(produced=tuple(
+                    a if a == b else None
+                    for a, b in zip(function.produced, produced)))
+        self.functions[entry] = function
+        return function
+
+
+def find_internal_functions(code, roots=(0,)):
+    """
+    Internal functions called on the paths from roots. Returns
+    ({entry: InternalFunction}, {call pc: CallSite}); a call whose return
+    address differs between paths is left out.
+    """
+    finder = _Finder(code)
+    while True:
+        for root in roots:
+            if root in finder.blocks:
+                finder.explore(root)
+        if not finder.deferred:
+            break
+        while finder.deferred:
+            finder.summarize(finder.deferred.pop())
+    functions = dict((entry, function._replace(
+        returns=frozenset(function.returns)))
+        for entry, function in finder.functions.items()
+        if function is not None)
+    calls = {}
+    for pc, (entry, returns) in finder.calls.items():
+        if entry in functions and len(returns) == 1:
+            calls[pc] = CallSite(pc, entry, next(iter(returns)))
+    return functions, calls
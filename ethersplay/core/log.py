@@ -0,0 +1,15 @@
+"""
+Log functions for the core: Binary Ninja's log inside Binary Ninja, the
+logging module (logger "ethersplay") in headless workers.
+"""
+import sys
+import logging
+
+if 'binaryninja' in sys.modules:
+    from binaryninja import log_debug, log_info, log_warn, log_error
+else:
+    _logger = logging.getLogger('ethersplay')
+    log_debug = _logger.debug
+    log_info = _logger.info
+    log_warn = _logger.warning
+    log_error = _logger.error
@@ -0,0 +1,124 @@
+"""Ranges of code copied out with CODECOPY, e.g. runtime code embedded in
+constructor bytecode."""
+import os
+
+from ..common import code_hash
+from ..constprop import propagate
+from ..decode import decode
+
+
+class Payload(object):
+    """
+    A range of the parent code that is copied to memory with CODECOPY using
+    constant arguments, e.g. the runtime code in constructor bytecode or the
+    creation code of a contract deployed by a factory. `data` is a zero-copy
+    slice of the parent; payloads of it and its child view are only built
+    when asked for.
+    """
+
+    def __init__(self, parent, offset, size):
+        self.data = parent[offset:offset + size]
+        self.ranges = [(offset, size)]
+        self.sites = []
+        self._hash = None
+        self._children = None
+        self._view = None
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = code_hash(self.data)
+        return self._hash
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = find_payloads(self.data)
+        return self._children
+
+    @property
+    def view(self):
+        if self._view is None:
+            # only payloads opened in Binary Ninja need it
+            from ..misc import open_bytes_view
+            self._view = open_bytes_view(self.data)
+        return self._view
+
+    def __repr__(self):
+        return '<Payload {} {}>'.format(
+            self.hash[:16],
+            ', '.join('{:#x}+{:#x}'.format(o, s) for o, s in self.ranges))
+
+
+def constant_codecopies(instructions):
+    """
+    Yield (pc, code_offset, size) for every CODECOPY whose offset and size
+    are constants computed in the same basic block.
+    """
+    for ins, args in propagate(instructions):
+        if ins.name == 'CODECOPY':
+            _, offset, size = args
+            if isinstance(offset, int) and isinstance(size, int):
+                yield ins.pc, offset, size
+
+
+def find_payloads(code, instructions=None):
+    """
+    Return the list of distinct Payloads copied out of code, deduplicated by
+    content hash.
+    """
+    code = memoryview(code)
+    if instructions is None:
+        instructions = decode(code)
+
+    by_hash = {}
+    for pc, offset, size in constant_codecopies(instructions):
+        # copies of the code itself (or of code around the copy) aren't
+        # payloads
+        if (not size or offset + size > len(code) or
+                offset <= pc < offset + size):
+            continue
+        payload = Payload(code, offset, size)
+        known = by_hash.get(payload.hash)
+        if known is None:
+            by_hash[payload.hash] = known = payload
+        elif (offset, size) not in known.ranges:
+            known.ranges.append((offset, size))
+        known.sites.append(pc)
+
+    return list(by_hash.values())
+
+
+def payload_ranges(payloads):
+    """Sorted, merged (start, end) ranges covered by payloads."""
+    ranges = sorted((offset, offset + size) for payload in payloads
+                    for offset, size in payload.ranges)
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def write_payloads(payloads, output_dir, recursive=True):
+    """Write every payload (and nested payload) once as <sha256>.evm."""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    written = []
+    seen = set()
+    pending = list(payloads)
+    while pending:
+        payload = pending.pop()
+        if payload.hash in seen:
+            continue
+        seen.add(payload.hash)
+        full_path = os.path.join(output_dir, payload.hash + '.evm')
+        if not os.path.exists(full_path):
+            with open(full_path, 'wb') as f:
+                f.write(payload.data)
+        written.append(full_path)
+        if recursive:
+            pending.extend(payload.children)
+    return written
@@ -0,0 +1,115 @@
+"""
+Code that can't be reached from the start of the code: bytes after a
+terminator no jump leads to, dispatcher stubs solc left without callers and
+padding. With linear sweep off, Binary Ninja treats every byte of a code
+segment as executable, so a stray function or branch into them is analyzed
+like any other; marked as data, it isn't.
+
+Blocks are followed from pc 0 through fall through and jump targets: the
+evm_cfg_builder edges of the jump, and every JUMPDEST a reached block
+pushes, since solc only jumps to pushed tags (return addresses included).
+A reached jump that evm_cfg_builder has no edges for, that doesn't jump to
+the constant pushed right before it and isn't the return of an internal
+function (see internal) may go anywhere, so then, as without a CFG, every
+JUMPDEST is a root too.
+"""
+from collections import namedtuple
+
+from ..decode import BASIC_BLOCK_END, basic_blocks, decode
+from .segments import CODE, find_segments
+
+# ranges: sorted [start, end) of the unreachable code. size: bytes in them.
+# instructions: instructions in them.
+Unreachable = namedtuple('Unreachable', ['ranges', 'size', 'instructions'])
+
+
+def cfg_targets(cfg):
+    """{jump pc: set of target pcs} of the jumps evm_cfg_builder resolved."""
+    rv = {}
+    for bb in cfg.basic_blocks:
+        if not bb.ends_with_jump_or_jumpi():
+            continue
+        targets = set(out.start.pc for out in bb.all_outgoing_basic_blocks)
+        if targets:
+            rv.setdefault(bb.end.pc, set()).update(targets)
+    return rv
+
+
+def reachable_blocks(blocks, targets=None, returns=()):
+    """
+    Starts of the blocks, {start: [Instruction]}, reachable from pc 0.
+    targets is cfg_targets(), None if there is no CFG. returns are the pcs
+    of the jumps returning from internal functions.
+    """
+    jumpdests = [pc for pc, block in blocks.items()
+                 if block[0].name == 'JUMPDEST']
+    jumpdest_set = set(jumpdests)
+    # every JUMPDEST is a root once a jump may go anywhere
+    anywhere = targets is None
+    work = list(jumpdests) if anywhere else []
+    if 0 in blocks:
+        work.append(0)
+    reached = set()
+    while work:
+        start = work.pop()
+        if start in reached:
+            continue
+        reached.add(start)
+        block = blocks[start]
+        for ins in block:
+            # only PUSHes have an operand
+            if ins.operand in jumpdest_set:
+                work.append(ins.operand)
+        last = block[-1]
+        if last.name in ('JUMP', 'JUMPI'):
+            found = targets.get(last.pc) if targets is not None else None
+            if found:
+                work.extend(pc for pc in found if pc in blocks)
+            elif last.pc in returns or (len(block) > 1 and
+                                        block[-2].name.startswith('PUSH')):
+                # to a return address or the target pushed just before,
+                # which were pushed by a reached block
+                pass
+            elif not anywhere:
+                anywhere = True
+                work.extend(jumpdests)
+        if last.name == 'JUMPI' or last.name not in BASIC_BLOCK_END:
+            successor = last.pc + last.size
+            if successor in blocks:
+                work.append(successor)
+    return reached
+
+
+def find_unreachable(code, cfg=None, payloads=None, returns=()):
+    """
+    The Unreachable code of code, within its code segments (see
+    find_segments). Without cfg, an evm_cfg_builder CFG of code, only code
+    no JUMPDEST leads to is unreachable. returns are the pcs of the jumps
+    returning from the internal functions of code.
+    """
+    code = bytes(code)
+    blocks = {}
+    ends = {}
+    for start, end, kind in find_segments(code, payloads):
+        if kind != CODE:
+            continue
+        # a block doesn't run on past its segment
+        for block in basic_blocks(decode(code[start:end], start)):
+            blocks[block[0].pc] = block
+            ends[block[0].pc] = end
+    reached = reachable_blocks(
+        blocks, cfg_targets(cfg) if cfg is not None else None, returns)
+
+    ranges = []
+    instructions = 0
+    for start in sorted(set(blocks) - reached):
+        block = blocks[start]
+        instructions += len(block)
+        last = block[-1]
+        end = min(last.pc + last.size, ends[start])
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return Unreachable(ranges, sum(end - start for start, end in ranges),
+                       instructions)
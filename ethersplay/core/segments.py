@@ -0,0 +1,58 @@
+"""
+Segments of EVM bytecode: executable code, data copied out with CODECOPY,
+the solc metadata (swarm hash) appended to runtime code and code that can't
+be reached (see reachable).
+"""
+from collections import namedtuple
+
+from .payloads import find_payloads, payload_ranges
+
+CODE = 'code'
+PAYLOAD = 'payload'
+METADATA = 'metadata'
+UNREACHABLE = 'unreachable'
+
+SWARM_MARKER = b'\xa1ebzzr0'
+SWARM_SIZE = 43
+
+# [start, end) of code of one kind
+Segment = namedtuple('Segment', ['start', 'end', 'kind'])
+
+
+def find_swarm_hashes(code):
+    """(offset, size) of every bzzr0 swarm hash in code."""
+    rv = []
+    offset = code.find(SWARM_MARKER)
+    while offset != -1:
+        rv.append((offset, SWARM_SIZE))
+        offset = code.find(SWARM_MARKER, offset + 1)
+    return rv
+
+
+def find_segments(code, payloads=None, unreachable=()):
+    """
+    Sorted Segments covering code: everything that isn't a payload (see
+    find_payloads), a swarm hash outside of one or in one of the unreachable
+    [start, end) ranges of code is code.
+    """
+    code = bytes(code)
+    if payloads is None:
+        payloads = find_payloads(code)
+    data_ranges = payload_ranges(payloads)
+
+    data = [Segment(start, end, PAYLOAD) for start, end in data_ranges]
+    data += [Segment(start, min(start + size, len(code)), METADATA)
+             for start, size in find_swarm_hashes(code)
+             if not any(s <= start < e for s, e in data_ranges)]
+    data += [Segment(start, end, UNREACHABLE) for start, end in unreachable]
+
+    rv = []
+    offset = 0
+    for segment in sorted(data):
+        if segment.start > offset:
+            rv.append(Segment(offset, segment.start, CODE))
+        rv.append(segment)
+        offset = max(offset, segment.end)
+    if offset < len(code):
+        rv.append(Segment(offset, len(code), CODE))
+    return rv
@@ -0,0 +1,297 @@
+"""
+Function selector and event topic resolution: the local signature file,
+the 4byte.directory caches and concurrent lookups of the misses.
+"""
+import os
+import json
+import atexit
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .. import profiling
+from ..decode import BASIC_BLOCK_END
+from .log import log_error, log_warn, log_info
+
+log_debug = log_info
+
+# requests is slow to import and only needed for online lookups
+_requests_available = importlib.util.find_spec('requests') is not None
+
+try:
+    from Crypto.Hash import keccak
+    _keccak_available = True
+except ImportError:
+    _keccak_available = False
+
+LOOKUP_4BYTE_URL = "https://www.4byte.directory/api/v1/signatures/"
+LOOKUP_4BYTE_EVENT_URL = "https://www.4byte.directory/api/v1/event-signatures/"
+CACHE_4BYTE_PATH = os.path.expanduser("~/.4byte_cache")
+CACHE_4BYTE_FILE = os.path.join(CACHE_4BYTE_PATH, "cache.json")
+CACHE_EVENT_FILE = os.path.join(CACHE_4BYTE_PATH, "event_cache.json")
+# one text signature per line, e.g. "Transfer(address,address,uint256)" or
+# "InsufficientBalance(uint256,uint256)", hashed locally before going online
+LOCAL_SIGNATURES_FILE = os.path.join(CACHE_4BYTE_PATH, "signatures.txt")
+
+LOOKUP_WORKERS = 8
+
+# blocks searched from a PUSH32 for the LOG1-LOG4 it is the topic of
+TOPIC_SEARCH_BLOCKS = 16
+
+# PUSH4 0xffffffff masks selectors, it isn't one
+SELECTOR_MASK = 0xffffffff
+
+_LOGS = frozenset(["LOG1", "LOG2", "LOG3", "LOG4"])
+
+_4byte_cache = None
+_event_cache = None
+_local_signatures = None
+_session = None
+
+
+def _load_json(filename):
+    if os.path.exists(filename):
+        with open(filename, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def load_4byte_cache():
+    global _4byte_cache, _event_cache
+    log_debug("Loading 4byte lookup cache from: " + str(CACHE_4BYTE_PATH))
+    _4byte_cache = _load_json(CACHE_4BYTE_FILE)
+    _event_cache = _load_json(CACHE_EVENT_FILE)
+    log_debug("Cache contains {} entries, {} events".format(
+        len(_4byte_cache), len(_event_cache)))
+
+
+def save_4byte_cache():
+    for cache, filename in ((_4byte_cache, CACHE_4BYTE_FILE),
+                            (_event_cache, CACHE_EVENT_FILE)):
+        if cache:
+            if not os.path.exists(CACHE_4BYTE_PATH):
+                os.makedirs(CACHE_4BYTE_PATH)
+            with open(filename, "w") as f:
+                json.dump(cache, f)
+
+
+def init_cache():
+    if _4byte_cache is None:
+        load_4byte_cache()
+        log_debug("atexit handler: Saving 4byte lookup cache in " +
+                  str(CACHE_4BYTE_PATH))
+        atexit.register(save_4byte_cache)
+
+
+def _keccak(text):
+    k = keccak.new(digest_bits=256)
+    k.update(text.encode("utf-8"))
+    return k.hexdigest()
+
+
+def local_signatures():
+    """
+    Index of LOCAL_SIGNATURES_FILE: 4 byte selector and 32 byte topic (both
+    as 0x-prefixed hex) -> text signatures.
+    """
+    global _local_signatures
+    if _local_signatures is None:
+        _local_signatures = {}
+        if os.path.exists(LOCAL_SIGNATURES_FILE):
+            if not _keccak_available:
+                log_warn("couldn't import Crypto.Hash.keccak, ignoring " +
+                         LOCAL_SIGNATURES_FILE)
+                return _local_signatures
+            with open(LOCAL_SIGNATURES_FILE, "r") as f:
+                for line in f:
+                    text = line.strip().replace(" ", "")
+                    if not text or text.startswith("#"):
+                        continue
+                    digest = _keccak(text)
+                    for key in ("0x" + digest[:8], "0x" + digest):
+                        _local_signatures.setdefault(key, []).append(text)
+    return _local_signatures
+
+
+def _get(url, params):
+    global _session
+    if _session is None:
+        import requests
+        # keep-alive connections shared by the lookup workers
+        _session = requests.Session()
+    return _session.get(url, params=params)
+
+
+def lookup_hash(sig, use_cache=True, event=False):
+    cache = _event_cache if event else _4byte_cache
+    url = LOOKUP_4BYTE_EVENT_URL if event else LOOKUP_4BYTE_URL
+
+    if use_cache:
+        init_cache()
+        cache = _event_cache if event else _4byte_cache
+
+        # if sig in _4byte_cache and _4byte_cache[sig]:
+        #     return _4byte_cache[sig]
+        tsig = cache.get(sig, [])
+        profiling.cache('4byte event' if event else '4byte', bool(tsig))
+        if tsig:
+            return tsig
+
+    if not _requests_available:
+        log_error("couldn't import requests for fetching from 4byte.directory")
+        return []
+    try:
+        res = _get(url, {"hex_signature": sig})
+        rj = res.json()
+        results = rj['results']
+
+        if len(results) >= 1:
+            sig_collisions = [r['text_signature'] for r in results]
+            cache[sig] = sig_collisions
+            return sig_collisions
+        else:
+            log_warn("4.byte directory didn't yield any results for '{}'"
+                     .format(sig))
+            return []
+    except AssertionError:
+        raise
+    except Exception as e:
+        log_error("4byte lookup failed, reason ({}): {}".format(type(e), e))
+        return []
+
+    return []
+
+
+def format_comment(sigs):
+    assert len(sigs) >= 1
+    text_sig = sigs[0]
+    comment = ""
+    if len(sigs) > 1:
+        comment = ("signatures with colliding hash:\n" + "\n".join(sigs))
+    return text_sig, comment
+
+
+def push_selector(ins):
+    """
+    The 4 byte selector pushed by ins: the immediate of a PUSH4, or the top
+    bytes of a left aligned PUSH32 as used for custom errors.
+    """
+    if ins.name == "PUSH4" and ins.operand != SELECTOR_MASK:
+        return "0x{:0=8x}".format(ins.operand)
+    if (ins.name == "PUSH32" and ins.operand and
+            not ins.operand & ((1 << 224) - 1)):
+        return "0x{:0=8x}".format(ins.operand >> 224)
+    return None
+
+
+def _reaches_log(blocks, start):
+    """
+    Whether a LOG1-LOG4 is within TOPIC_SEARCH_BLOCKS of the block at start,
+    following fall through and the JUMPDESTs pushed on the way. solc >= 0.8
+    pushes the topic, calls an abi_encode helper and logs in the block the
+    helper returns to, whose address is pushed with the call.
+    """
+    work = deque([start])
+    seen = set(work)
+    searched = 0
+    while work and searched < TOPIC_SEARCH_BLOCKS:
+        block = blocks[work.popleft()]
+        searched += 1
+        successors = []
+        for ins in block:
+            if ins.name in _LOGS:
+                return True
+            if ins.operand in blocks:
+                successors.append(ins.operand)
+        last = block[-1]
+        if last.name == "JUMPI" or last.name not in BASIC_BLOCK_END:
+            successors.append(last.pc + last.size)
+        for pc in successors:
+            if pc in blocks and pc not in seen:
+                seen.add(pc)
+                work.append(pc)
+    return False
+
+
+def push_candidates(blocks, selectors, topics):
+    """
+    Append the (address, selector) and (address, topic) pairs pushed by
+    blocks, the decoded basic blocks of a function or of a whole contract.
+    PUSH32s are only topic candidates when they lead to a LOG1-LOG4 (see
+    _reaches_log).
+    """
+    blocks = dict((block[0].pc, block) for block in blocks if block)
+    for start, block in sorted(blocks.items()):
+        logs = None
+        for ins in block:
+            selector = push_selector(ins)
+            if selector is not None:
+                selectors.append((ins.pc, selector))
+            elif ins.name == "PUSH32":
+                if logs is None:
+                    logs = _reaches_log(blocks, start)
+                if logs:
+                    topics.append((ins.pc, "0x{:0=64x}".format(ins.operand)))
+
+
+_unresolved = set()
+
+
+def resolve_hashes(selectors=(), topics=(), online=True):
+    """
+    Resolve all distinct selectors and topics in one go: from the local
+    signature index and the caches first, the rest (if online) with
+    LOOKUP_WORKERS concurrent requests to 4byte.directory. Returns
+    {hash: [signatures]}.
+    """
+    init_cache()
+    local = local_signatures()
+    rv = {}
+    misses = []
+    wanted = ([(sig, False) for sig in set(selectors)] +
+              [(sig, True) for sig in set(topics)])
+    for sig, event in wanted:
+        cache = _event_cache if event else _4byte_cache
+        sigs = cache.get(sig) or local.get(sig)
+        profiling.cache('4byte event' if event else '4byte', bool(sigs))
+        if sigs:
+            rv[sig] = sigs
+        elif (sig, event) not in _unresolved:
+            misses.append((sig, event))
+
+    if misses and online and _requests_available:
+        log_info("4byte lookup of {} hashes".format(len(misses)))
+        with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+            results = executor.map(
+                lambda miss: lookup_hash(miss[0], event=miss[1]), misses)
+            for miss, sigs in zip(misses, results):
+                if sigs:
+                    rv[miss[0]] = sigs
+                else:
+                    # don't ask again for constants that aren't hashes
+                    _unresolved.add(miss)
+    return rv
+
+
+def remember(resolved):
+    """Add {hash: [signatures]} resolved before, e.g. kept in a snapshot, to
+    the caches of this session."""
+    init_cache()
+    for sig, sigs in resolved.items():
+        # topics are 32 bytes, selectors 4
+        cache = _event_cache if len(sig) == 66 else _4byte_cache
+        cache.setdefault(sig, sigs)
+
+
+def update_cache():
+    """
+    Perform lookup of all cached items, s.t., new signature collisions are
+    added to the cache. This should happen rather rarely so, it makes sense to
+    run this only manually sometimes.
+    """
+    init_cache()
+    for sig in list(_4byte_cache.keys()):
+        lookup_hash(sig, use_cache=False)
+    for sig in list(_event_cache.keys()):
+        lookup_hash(sig, use_cache=False, event=True)
+    save_4byte_cache()
@@ -0,0 +1,248 @@
+"""
+Packed bytecode corpus.
+
+A corpus is a directory holding
+
+  corpus.dat    every distinct bytecode, appended back to back
+  corpus.idx    header + fixed size (sha256, offset, length) records,
+                sorted by sha256
+  names.json    optional name (e.g. address) -> sha256 mapping
+
+The data file is only ever appended to and the index and name files are
+replaced atomically after the data they reference has been written, so
+readers can keep using an opened corpus while a writer appends to it; they
+see the new entries after refresh().
+"""
+import os
+import json
+import mmap
+import struct
+import fcntl
+from bisect import bisect_left
+
+from .common import code_hash as _code_hash
+from .core.log import log_info
+
+DATA_NAME = "corpus.dat"
+INDEX_NAME = "corpus.idx"
+NAMES_NAME = "names.json"
+LOCK_NAME = "corpus.lock"
+
+INDEX_MAGIC = b"EVMCIDX1"
+INDEX_HEADER = struct.Struct(">8sQ")
+INDEX_ENTRY = struct.Struct(">32sQI")
+
+
+def _to_digest(code_hash):
+    if isinstance(code_hash, str):
+        if code_hash.startswith("0x"):
+            code_hash = code_hash[2:]
+        return bytes.fromhex(code_hash)
+    return bytes(code_hash)
+
+
+def _map_file(filename):
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _IndexKeys(object):
+    """Sequence view over the sorted hashes of a mapped index, for bisect."""
+
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = INDEX_HEADER.size + i * INDEX_ENTRY.size
+        return self.index[start:start + 32]
+
+
+class Corpus(object):
+    """Read-only, memory mapped access to a packed corpus."""
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._index = None
+        self._count = 0
+        self.names = {}
+        self.refresh()
+
+    def refresh(self):
+        """Re-map the corpus to pick up entries appended since opening."""
+        self.close()
+        index_file = os.path.join(self.path, INDEX_NAME)
+        if not os.path.exists(index_file):
+            return
+        # the index is mapped before the data, so every entry it lists is
+        # already present in the (larger or equal) data file we map next
+        self._index = _map_file(index_file)
+        magic, self._count = INDEX_HEADER.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError("{} is not a corpus index".format(index_file))
+        self._data = _map_file(os.path.join(self.path, DATA_NAME))
+
+        names_file = os.path.join(self.path, NAMES_NAME)
+        if os.path.exists(names_file):
+            with open(names_file, "r") as f:
+                self.names = json.load(f)
+
+    def close(self):
+        for m in (self._index, self._data):
+            if m is not None:
+                try:
+                    m.close()
+                except BufferError:
+                    # a memoryview handed out by get() is still alive, the
+                    # mapping goes away once it is released
+                    pass
+        self._index = self._data = None
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        return INDEX_ENTRY.unpack_from(
+            self._index, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+
+    def _find(self, digest):
+        i = bisect_left(_IndexKeys(self._index, self._count), digest)
+        if i < self._count:
+            entry = self._entry(i)
+            if entry[0] == digest:
+                return entry
+        return None
+
+    def __contains__(self, code_hash):
+        return bool(self._count) and self._find(
+            _to_digest(code_hash)) is not None
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._entry(i)[0].hex()
+
+    def get(self, code_hash):
+        """Return the bytecode as a zero-copy memoryview, or None."""
+        if not self._count:
+            return None
+        entry = self._find(_to_digest(code_hash))
+        if entry is None:
+            return None
+        _, offset, length = entry
+        return memoryview(self._data)[offset:offset + length]
+
+    def get_by_name(self, name):
+        code_hash = self.names.get(name)
+        return self.get(code_hash) if code_hash else None
+
+    def items(self):
+        for code_hash in self:
+            yield code_hash, self.get(code_hash)
+
+
+class CorpusWriter(object):
+    """
+    Appends bytecodes to a corpus. Only one writer is allowed at a time; the
+    index is rewritten on flush(), so add many entries per flush.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._lock = open(os.path.join(path, LOCK_NAME), "a")
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        self._reader = Corpus(path)
+        self._data = open(os.path.join(path, DATA_NAME), "ab")
+        self._pending = {}
+        self._names = dict(self._reader.names)
+
+    def add(self, code, name=None):
+        """Append code unless an identical bytecode is already stored and
+        return its hex sha256."""
+        # the same key as everywhere else in the plugin
+        code_hash = _code_hash(code)
+        digest = bytes.fromhex(code_hash)
+        if digest not in self._pending and self._reader.get(digest) is None:
+            offset = self._data.tell()
+            self._data.write(code)
+            self._pending[digest] = (offset, len(code))
+        if name is not None:
+            self._names[name] = code_hash
+        return code_hash
+
+    def flush(self):
+        if not self._pending and self._names == self._reader.names:
+            return
+        self._data.flush()
+        os.fsync(self._data.fileno())
+
+        entries = [self._reader._entry(i) for i in range(len(self._reader))]
+        entries.extend((digest, offset, length)
+                       for digest, (offset, length) in self._pending.items())
+        entries.sort()
+
+        tmp = os.path.join(self.path, INDEX_NAME + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(entries)))
+            for entry in entries:
+                f.write(INDEX_ENTRY.pack(*entry))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, INDEX_NAME))
+
+        tmp = os.path.join(self.path, NAMES_NAME + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._names, f, sort_keys=True)
+        os.replace(tmp, os.path.join(self.path, NAMES_NAME))
+
+        log_info("corpus {}: {} entries ({} new)".format(
+            self.path, len(entries), len(self._pending)))
+        self._pending = {}
+        self._reader.refresh()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._reader.close()
+            self._data.close()
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+            self._lock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pack_evm_files(filenames, path):
+    """Pack existing .evm files into the corpus at path, named by file."""
+    with CorpusWriter(path) as writer:
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                writer.add(f.read(), os.path.basename(filename))
+
+
+def open_view(corpus, code_hash):
+    """Open a corpus entry as an EVMView, or return None if it is missing."""
+    code = corpus.get(code_hash)
+    if code is None:
+        return None
+    # only entries opened in Binary Ninja need it
+    from .misc import open_bytes_view
+    return open_bytes_view(code)
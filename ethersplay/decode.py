@@ -0,0 +1,88 @@
+from collections import namedtuple
+
+from pyevmasm import DEFAULT_FORK, instruction_tables
+
+Instruction = namedtuple(
+    'Instruction', ['pc', 'opcode', 'name', 'operand', 'size', 'pops',
+                    'pushes'])
+
+TERMINATORS = frozenset(['STOP', 'RETURN', 'REVERT', 'INVALID', 'SUICIDE',
+                         'SELFDESTRUCT'])
+BASIC_BLOCK_END = TERMINATORS | frozenset(['JUMP', 'JUMPI'])
+
+# opcodes of forks after the latest one pyevmasm knows
+_LATER_OPCODES = {
+    0x48: ('BASEFEE', 0, 0, 1),
+    0x49: ('BLOBHASH', 0, 1, 1),
+    0x4a: ('BLOBBASEFEE', 0, 0, 1),
+    0x5c: ('TLOAD', 0, 1, 1),
+    0x5d: ('TSTORE', 0, 2, 0),
+    0x5e: ('MCOPY', 0, 3, 0),
+    0x5f: ('PUSH0', 0, 0, 1),
+}
+
+_tables = {}
+
+
+def _opcode_table(fork):
+    """(name, operand_size, pops, pushes) for all 256 opcodes."""
+    table = _tables.get(fork)
+    if table is None:
+        instructions = instruction_tables[fork]
+        table = []
+        for opcode in range(256):
+            if opcode in instructions:
+                i = instructions[opcode]
+                table.append((i.name, i.operand_size, i.pops, i.pushes))
+            elif opcode in _LATER_OPCODES:
+                table.append(_LATER_OPCODES[opcode])
+            else:
+                table.append(('INVALID', 0, 0, 0))
+        _tables[fork] = table
+    return table
+
+
+def decode(code, pc=0, fork=DEFAULT_FORK):
+    """
+    Linear sweep over code, returning a list of Instruction. This is a plain
+    table lookup per opcode, much cheaper than pyevmasm's disassemble_all
+    when only names, immediates and stack effects are needed.
+    """
+    table = _opcode_table(fork)
+    code = bytes(code)
+    end = len(code)
+    rv = []
+    append = rv.append
+    offset = 0
+    while offset < end:
+        opcode = code[offset]
+        name, operand_size, pops, pushes = table[opcode]
+        if operand_size:
+            operand = int.from_bytes(
+                code[offset + 1:offset + 1 + operand_size], 'big')
+            # immediates running past the end are zero padded
+            operand <<= 8 * max(offset + 1 + operand_size - end, 0)
+        else:
+            operand = None
+        append(Instruction(pc + offset, opcode, name, operand,
+                           1 + operand_size, pops, pushes))
+        offset += 1 + operand_size
+    return rv
+
+
+def basic_blocks(instructions):
+    """Split decoded instructions into basic blocks the way evm_cfg_builder
+    does: a JUMPDEST starts a block, a jump or terminator ends one."""
+    rv = []
+    block = []
+    for ins in instructions:
+        if ins.name == 'JUMPDEST' and block:
+            rv.append(block)
+            block = []
+        block.append(ins)
+        if ins.name in BASIC_BLOCK_END:
+            rv.append(block)
+            block = []
+    if block:
+        rv.append(block)
+    return rv
@@ -0,0 +1,283 @@
+import sys
+import json
+import hashlib
+import argparse
+from collections import defaultdict
+
+from evm_cfg_builder.cfg import CFG
+
+from .common import view_cfg
+from .core.log import log_info, log_error
+from .fingerprint import (fingerprint_blocks, cfg_function_blocks,
+                          lsh_buckets, similarity, normalize)
+
+DEFAULT_THRESHOLD = 0.6
+
+# the command is only defined inside Binary Ninja, the CLI does not load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import HighlightStandardColor, BackgroundTaskThread
+    from binaryninja.interaction import get_save_filename_input
+
+    ADDED_COLOR = HighlightStandardColor.GreenHighlightColor
+    REMOVED_COLOR = HighlightStandardColor.RedHighlightColor
+    CHANGED_COLOR = HighlightStandardColor.YellowHighlightColor
+
+
+def _block_keys(bb):
+    """
+    Return (structural, exact) keys of an evm_cfg_builder basic block. The
+    structural key only looks at normalized opcodes, the exact key also at
+    immediates, except for pushed jump targets which move whenever code is
+    inserted before them.
+    """
+    instructions = bb.instructions
+    structural = []
+    exact = []
+    for i, ins in enumerate(instructions):
+        name = normalize(ins.name)
+        structural.append(name)
+        is_target = (i + 1 < len(instructions) and
+                     instructions[i + 1].name in ("JUMP", "JUMPI"))
+        if ins.name.startswith("PUSH") and not is_target:
+            exact.append("{}:{:x}".format(ins.name, ins.operand))
+        else:
+            exact.append(ins.name)
+    return (hashlib.sha1(" ".join(structural).encode()).digest(),
+            hashlib.sha1(" ".join(exact).encode()).digest())
+
+
+class _FunctionInfo(object):
+    def __init__(self, function):
+        self.function = function
+        self.blocks = sorted(function.basic_blocks, key=lambda bb: bb.start.pc)
+        self.keys = {bb.start.pc: _block_keys(bb) for bb in self.blocks}
+        self.edges = sum(len(bb.outgoing_basic_blocks(function.key))
+                         for bb in self.blocks)
+        self.structure = hashlib.sha1(b"".join(sorted(
+            key[0] for key in self.keys.values())) +
+            str(self.edges).encode()).digest()
+        self._signature = False
+
+    @property
+    def signature(self):
+        if self._signature is False:
+            self._signature = fingerprint_blocks(
+                cfg_function_blocks(self.function))
+        return self._signature
+
+    def describe(self):
+        return {"name": self.function.name,
+                "address": self.function.start_addr}
+
+
+def _match_functions(old, new, threshold):
+    """Return [(old_info, new_info, how)] plus the unmatched leftovers."""
+    matches = []
+
+    # 1. selectors, dispatcher and fallback have fixed ids
+    new_by_id = {info.function.hash_id: info for info in new}
+    rest_old = []
+    for info in old:
+        other = new_by_id.pop(info.function.hash_id, None)
+        if other is not None:
+            matches.append((info, other, "selector"))
+        else:
+            rest_old.append(info)
+    rest_new = list(new_by_id.values())
+
+    # 2. identical structure
+    new_by_structure = defaultdict(list)
+    for info in rest_new:
+        new_by_structure[info.structure].append(info)
+    still_old = []
+    for info in rest_old:
+        candidates = new_by_structure.get(info.structure)
+        if candidates:
+            matches.append((info, candidates.pop(), "structure"))
+        else:
+            still_old.append(info)
+    still_new = [info for infos in new_by_structure.values()
+                 for info in infos]
+
+    # 3. similar structure, candidates through LSH buckets
+    buckets = defaultdict(list)
+    for info in still_new:
+        if info.signature is not None:
+            for bucket in lsh_buckets(info.signature):
+                buckets[bucket].append(info)
+    taken = set()
+    removed = []
+    for info in still_old:
+        best = None
+        if info.signature is not None:
+            candidates = {id(c): c for bucket in lsh_buckets(info.signature)
+                          for c in buckets.get(bucket, ())}
+            for candidate in candidates.values():
+                if id(candidate) in taken:
+                    continue
+                score = similarity(info.signature, candidate.signature)
+                if score >= threshold and (best is None or score > best[0]):
+                    best = (score, candidate)
+        if best is None:
+            removed.append(info)
+        else:
+            taken.add(id(best[1]))
+            matches.append((info, best[1], "similarity"))
+    added = [info for info in still_new if id(info) not in taken]
+
+    return matches, removed, added
+
+
+def _diff_blocks(old, new):
+    new_exact = defaultdict(list)
+    new_structural = defaultdict(list)
+    for pc, (structural, exact) in sorted(new.keys.items()):
+        new_exact[exact].append(pc)
+    unmatched_old = []
+    for pc, (structural, exact) in sorted(old.keys.items()):
+        if new_exact.get(exact):
+            new_exact[exact].pop(0)
+        else:
+            unmatched_old.append(pc)
+
+    remaining_new = set(pc for pcs in new_exact.values() for pc in pcs)
+    for pc in sorted(remaining_new):
+        new_structural[new.keys[pc][0]].append(pc)
+
+    changed = []
+    removed = []
+    for pc in unmatched_old:
+        candidates = new_structural.get(old.keys[pc][0])
+        if candidates:
+            new_pc = candidates.pop(0)
+            remaining_new.discard(new_pc)
+            changed.append([pc, new_pc])
+        else:
+            removed.append(pc)
+
+    return {"added": sorted(remaining_new), "removed": removed,
+            "changed": changed}
+
+
+def diff_cfgs(old_cfg, new_cfg, threshold=DEFAULT_THRESHOLD):
+    old = [_FunctionInfo(f) for f in old_cfg.functions]
+    new = [_FunctionInfo(f) for f in new_cfg.functions]
+    matches, removed, added = _match_functions(old, new, threshold)
+
+    result = {
+        "added": [info.describe() for info in added],
+        "removed": [info.describe() for info in removed],
+        "changed": [],
+        "unchanged": [],
+    }
+    for old_info, new_info, how in matches:
+        blocks = _diff_blocks(old_info, new_info)
+        entry = {"old": old_info.describe(), "new": new_info.describe(),
+                 "match": how}
+        if (any(blocks.values()) or old_info.edges != new_info.edges):
+            entry["blocks"] = blocks
+            result["changed"].append(entry)
+        else:
+            result["unchanged"].append(entry)
+    return result
+
+
+def diff_bytecode(old_code, new_code, threshold=DEFAULT_THRESHOLD):
+    return diff_cfgs(CFG(old_code), CFG(new_code), threshold)
+
+
+def diff_views(old_view, new_view, threshold=DEFAULT_THRESHOLD):
+    return diff_cfgs(view_cfg(old_view), view_cfg(new_view), threshold)
+
+
+def _highlight_block(view, pc, color):
+    # functions start after their JUMPDEST, so that one is in no block
+    for addr in (pc, pc + 1):
+        bbs = view.get_basic_blocks_at(addr)
+        for bb in bbs:
+            bb.set_user_highlight(color)
+        if bbs:
+            return
+
+
+def highlight_diff(old_view, new_view, result):
+    old_cfg = view_cfg(old_view)
+    new_cfg = view_cfg(new_view)
+
+    for entry in result["removed"]:
+        for bb in old_cfg.get_function_at(entry["address"]).basic_blocks:
+            _highlight_block(old_view, bb.start.pc, REMOVED_COLOR)
+    for entry in result["added"]:
+        for bb in new_cfg.get_function_at(entry["address"]).basic_blocks:
+            _highlight_block(new_view, bb.start.pc, ADDED_COLOR)
+    for entry in result["changed"]:
+        blocks = entry["blocks"]
+        for pc in blocks["removed"]:
+            _highlight_block(old_view, pc, REMOVED_COLOR)
+        for pc in blocks["added"]:
+            _highlight_block(new_view, pc, ADDED_COLOR)
+        for old_pc, new_pc in blocks["changed"]:
+            _highlight_block(old_view, old_pc, CHANGED_COLOR)
+            _highlight_block(new_view, new_pc, CHANGED_COLOR)
+
+
+def summarize(result):
+    return "{} added, {} removed, {} changed, {} unchanged functions".format(
+        len(result["added"]), len(result["removed"]),
+        len(result["changed"]), len(result["unchanged"]))
+
+
+_marked_view = None
+
+
+def mark_old_view(view):
+    global _marked_view
+    _marked_view = view
+    log_info("diff: {} marked as old version".format(view.file.filename))
+
+
+if 'binaryninja' in sys.modules:
+    class DiffThread(BackgroundTaskThread):
+        def __init__(self, old_view, new_view, output):
+            BackgroundTaskThread.__init__(self, "Diffing bytecode...", False)
+            self.old_view = old_view
+            self.new_view = new_view
+            self.output = output
+
+        def run(self):
+            result = diff_views(self.old_view, self.new_view)
+            highlight_diff(self.old_view, self.new_view, result)
+            if self.output:
+                with open(self.output, "w") as f:
+                    json.dump(result, f, indent=1)
+            log_info("diff: " + summarize(result))
+
+    def diff_against_marked(view):
+        if _marked_view is None:
+            log_error("mark the old version first")
+            return
+        output = get_save_filename_input("Save diff as JSON?", "json")
+        if isinstance(output, bytes):
+            output = output.decode("utf-8")
+        DiffThread(_marked_view, view, output).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Diff the functions and basic blocks of two contracts")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    with open(args.old, "rb") as f:
+        old_code = f.read()
+    with open(args.new, "rb") as f:
+        new_code = f.read()
+    json.dump(diff_bytecode(old_code, new_code, args.threshold), sys.stdout,
+              indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
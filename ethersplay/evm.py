@@ -6,8 +6,6 @@ try:
 except ImportError:
     pass
 
-from interval3 import Interval, IntervalSet
-
 from binaryninja import (LLIL_TEMP, Architecture, BinaryDataNotification,
                          BinaryView, BranchType, Endianness, InstructionInfo,
                          InstructionTextToken, InstructionTextTokenType, Function,
@@ -16,8 +14,22 @@ from binaryninja import (LLIL_TEMP, Architecture, BinaryDataNotification,
 from binaryninja.function import _FunctionAssociatedDataStore
 from pyevmasm import assemble, disassemble_one
 
-from .analysis import VsaNotification
+from .analysis import (VsaNotification,
+                       analysis_completed as emulator_analysis_completed)
+from .budget import analysis_completed as budget_analysis_completed
 from .common import ADDR_SIZE
+from .fingerprint import lookup_cfg_names
+from .internal import (call_at, define_functions as define_internal_functions,
+                       is_return, register as register_internal)
+from .proxy import classify, describe
+from .snapshot import (analysis_completed as snapshot_analysis_completed,
+                       apply as apply_snapshot, load as load_snapshot,
+                       snapshot_functions,
+                       unreachable as snapshot_unreachable)
+from .core.payloads import find_payloads
+from .core.cfg import cfg_functions, view_address
+from .core.reachable import Unreachable, find_unreachable
+from .core.segments import CODE, find_segments
 from evm_cfg_builder.cfg import CFG
 
 
@@ -144,6 +156,13 @@ def jump(il, addr, imm):
     return []
 
 
+def call(il, addr, site):
+    # the pushed entry, the return address stays for the callee to jump to
+    il.append(il.set_reg(ADDR_SIZE, LLIL_TEMP(0), il.pop(ADDR_SIZE)))
+    il.append(il.call(il.const(ADDR_SIZE, view_address(site.entry))))
+    return []
+
+
 def push(il, addr, imm):
     return il.push(ADDR_SIZE, il.const(ADDR_SIZE, imm))
 
@@ -168,7 +187,9 @@ def exp_inst(il, addr, imm):
     il.append(il.set_reg(ADDR_SIZE, LLIL_TEMP(1), exponent))
     if ('value' in dir(base) and 'value' in dir(exponent)
             and base.value.is_constant and exponent.value.is_constant):
-        result = base.value.value ** exponent.value.value
+        # modulo 2**256 like the EVM, a huge exponent can't stall lifting
+        result = pow(base.value.value, exponent.value.value,
+                     1 << (8 * ADDR_SIZE))
         il.append(il.push(ADDR_SIZE, il.const(ADDR_SIZE, result)))
     else:
         il.append(il.push(ADDR_SIZE, il.unimplemented()))
@@ -368,7 +389,14 @@ class EVM(Architecture):
         result = InstructionInfo()
         result.length = instruction.size
         if instruction.name == "JUMP":
-            result.add_branch(BranchType.UnresolvedBranch)
+            site = call_at(data, addr)
+            if site is not None:
+                result.add_branch(BranchType.CallDestination,
+                                  view_address(site.entry))
+            elif is_return(data, addr):
+                result.add_branch(BranchType.FunctionReturn)
+            else:
+                result.add_branch(BranchType.UnresolvedBranch)
         elif instruction.name == "JUMPI":
             result.add_branch(BranchType.UnresolvedBranch)
             result.add_branch(BranchType.FalseBranch, addr + 1)
@@ -407,6 +435,17 @@ class EVM(Architecture):
     def get_instruction_low_level_il(self, data, addr, il):
         instruction = disassemble_one(data, addr)
 
+        if instruction.name == 'JUMP':
+            function = getattr(il, 'source_function', None)
+            view = function.view if function is not None else None
+            site = call_at(data, addr, view)
+            if site is not None:
+                call(il, addr, site)
+                return instruction.size
+            if is_return(data, addr, view):
+                il.append(il.ret(il.pop(ADDR_SIZE)))
+                return instruction.size
+
         ill = insn_il.get(instruction.name, None)
         if ill is None:
 
@@ -446,17 +485,6 @@ class EVMView(BinaryView):
         BinaryView.__init__(self, parent_view=data, file_metadata=data.file)
         self.raw = data
 
-    def find_swarm_hashes(self, data):
-        rv = []
-        offset = data.find(b'\xa1ebzzr0')
-        while offset != -1:
-            log_debug("Adding r-- segment at: {:#x}".format(offset))
-            rv.append((offset, 43))
-            offset = data[offset+1:].find(b'\xa1ebzzr0')
-
-        return rv
-
-
     def init(self):
         self.arch = Architecture['EVM']
         self.platform = Architecture['EVM'].standalone_platform
@@ -467,64 +495,125 @@ class EVMView(BinaryView):
         # Find swarm hashes and make them data
         evm_bytes = self.raw.read(0, file_size)
 
-        # code is everything that isn't a swarm hash
-        code = IntervalSet([Interval(0, file_size)])
-
-        swarm_hashes = self.find_swarm_hashes(evm_bytes)
-        for start, sz in swarm_hashes:
-            self.add_auto_segment(
-                start, sz,
-                start, sz,
-                (
+        # code is everything that isn't a swarm hash or copied out with
+        # CODECOPY (e.g. the runtime code embedded in constructor code)
+        payloads = find_payloads(evm_bytes)
+        self.session_data['payloads'] = payloads
+
+        # proxies and clones are recognized from their bytes, for the known
+        # stubs there is nothing worth building a CFG or running VSA for
+        proxy = classify(evm_bytes)
+        self.session_data['proxy'] = proxy
+        skip_analysis = proxy is not None and proxy.skip_analysis
+
+        # the snapshot of an earlier session has the functions, names,
+        # comments and branches: nothing it covers needs the CFG, VSA or
+        # lookups, run_vsa builds the CFG if a function is not covered
+        snapshot = None if skip_analysis else load_snapshot(evm_bytes)
+
+        # before any function is analyzed, the lifter looks call sites up
+        internal = None if skip_analysis else register_internal(self,
+                                                                evm_bytes)
+
+        # unreachable code becomes data before any function is added, so
+        # nothing is analyzed in it
+        cfg = None
+        if snapshot is not None:
+            unreachable = snapshot_unreachable(snapshot)
+        elif not skip_analysis:
+            cfg = CFG(evm_bytes)
+            unreachable = find_unreachable(evm_bytes, cfg, payloads,
+                                           internal.returns)
+        else:
+            unreachable = Unreachable([], 0, 0)
+        self.session_data['unreachable'] = unreachable
+        if unreachable.size:
+            log_info('EVM: {} bytes, {} instructions unreachable, marked as '
+                     'data'.format(unreachable.size, unreachable.instructions))
+
+        for start, end, kind in find_segments(evm_bytes, payloads,
+                                              unreachable.ranges):
+            log_debug("Adding {} segment at: {:#x}".format(kind, start))
+            if kind == CODE:
+                flags = (SegmentFlag.SegmentReadable |
+                         SegmentFlag.SegmentExecutable)
+            else:
+                flags = (
                     SegmentFlag.SegmentContainsData |
                     SegmentFlag.SegmentDenyExecute |
                     SegmentFlag.SegmentReadable |
                     SegmentFlag.SegmentDenyWrite
                 )
-            )
+            self.add_auto_segment(start, end - start, start, end - start,
+                                  flags)
 
-            code -= IntervalSet([Interval(start, start + sz)])
+        # disable linear sweep
+        Settings().set_bool(
+            'analysis.linearSweep.autorun',
+            False,
+            view=self,
+            scope=SettingsScope.SettingsContextScope
+        )
 
-        for interval in code:
-            if isinstance(interval, int):
-                continue
-            self.add_auto_segment(
-                interval.lower_bound, interval.upper_bound,
-                interval.lower_bound, interval.upper_bound,
-                (
-                    SegmentFlag.SegmentReadable |
-                    SegmentFlag.SegmentExecutable
-                )
-            )
+        if proxy is not None:
+            log_info('EVM: {}'.format(describe(proxy).replace('\n', ', ')))
+            self.set_comment_at(0, describe(proxy))
 
-        cfg = CFG(evm_bytes)
-        Function.set_default_session_data('cfg', cfg)
+            if skip_analysis:
+                self.define_auto_symbol(
+                    Symbol(SymbolType.FunctionSymbol, 0, '_proxy'))
+                self.add_entry_point(0)
+                return True
 
         self.register_notification(VsaNotification())
+        self.add_analysis_completion_event(
+            lambda: snapshot_analysis_completed(self))
+        self.add_analysis_completion_event(
+            lambda: budget_analysis_completed(self))
+        self.add_analysis_completion_event(
+            lambda: emulator_analysis_completed(self))
+
+        if snapshot is not None:
+            self.session_data['snapshot'] = snapshot_functions(snapshot)
+            self.add_entry_point(0)
+            apply_snapshot(self, snapshot)
+            define_internal_functions(self, internal)
+            log_info('EVM: {} functions restored from snapshot'.format(
+                len(snapshot['functions'])))
+            return True
+
+        Function.set_default_session_data('cfg', cfg)
+        self.session_data['cfg'] = cfg
 
         self.add_entry_point(0)
 
-        for function in cfg.functions:
-            function_start = (function._start_addr + 1
-                              if function._start_addr != 0 else 0)
+        # names and comments of similar functions from previously analyzed
+        # contracts
+        known_names = lookup_cfg_names(cfg, internal=internal)
+
+        for function in cfg_functions(cfg):
+            function_start = function.address
+            name, comment = known_names.get(
+                function.start, (function.name, None))
 
             self.define_auto_symbol(
                 Symbol(
                     SymbolType.FunctionSymbol,
                     function_start,
-                    function.name
+                    name
                 )
             )
 
             self.add_function(function_start)
 
-        # disable linear sweep
-        Settings().set_bool(
-            'analysis.linearSweep.autorun',
-            False,
-            view=self,
-            scope=SettingsScope.SettingsContextScope
-        )
+            if comment:
+                bn_function = self.get_function_at(function_start)
+                if bn_function is not None:
+                    bn_function.comment = comment
+
+        if internal.functions:
+            log_info('EVM: {} internal functions'.format(
+                define_internal_functions(self, internal)))
 
         return True
 
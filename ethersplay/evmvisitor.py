@@ -1,16 +1,77 @@
 from bisect import bisect_left
-from binaryninja import log_debug
+from binaryninja import (LowLevelILOperation, MediumLevelILOperation,
+                         log_debug)
+
+
+class TailCall(object):
+    """Returned by a visit_* method instead of calling self.visit(expression)
+    so the visitor can follow the chain in a loop instead of recursing."""
+    __slots__ = ('expression',)
+
+    def __init__(self, expression):
+        self.expression = expression
+
 
 class BNILVisitor(object):
+    _operation_enums = (LowLevelILOperation, MediumLevelILOperation)
+
     def __init__(self, **kw):
         super(BNILVisitor, self).__init__()
+        self._results = {}
+
+    @classmethod
+    def _dispatch_table(cls):
+        # resolved once per class, keyed by the operation enum member
+        table = cls.__dict__.get('_dispatch')
+        if table is None:
+            table = {}
+            for operations in cls._operation_enums:
+                for operation in operations:
+                    method = getattr(cls, 'visit_{}'.format(operation.name),
+                                     None)
+                    if method is not None:
+                        table[operation] = method
+            cls._dispatch = table
+        return table
+
+    def memo_key(self, expression):
+        """Key under which the result of visiting expression is memoized, or
+        None if it must not be memoized."""
+        return None
 
     def visit(self, expression):
-        method_name = 'visit_{}'.format(expression.operation.name)
-        if hasattr(self, method_name):
-            value = getattr(self, method_name)(expression)
-        else:
-            value = None
+        dispatch = self._dispatch_table()
+        results = self._results
+        pending = set()
+        value = None
+
+        while expression is not None:
+            key = self.memo_key(expression)
+            if key is not None:
+                if key in results:
+                    value = results[key]
+                    break
+                if key in pending:
+                    # definition cycle, give up on this chain
+                    value = None
+                    break
+                pending.add(key)
+
+            method = dispatch.get(expression.operation)
+            if method is None:
+                value = None
+                break
+
+            value = method(self, expression)
+            if isinstance(value, TailCall):
+                expression = value.expression
+                value = None
+            else:
+                break
+
+        for key in pending:
+            results[key] = value
+
         return value
 
 
@@ -21,18 +82,53 @@ class EVMVisitor(BNILVisitor):
         self.il_function = None
         self.bb = None
         self.il_bb_lookup = kw['lookup']
+        self._ssa_var_definitions = {}
+        self._var_definitions = {}
+
+    def _reset_caches(self):
+        log_debug('EVMVisitor: switching to {}'.format(self.function))
+        self._results = {}
+        self._ssa_var_definitions = {}
+        self._var_definitions = {}
+
+    def memo_key(self, expression):
+        # MLIL_IF selects the IL function and basic block the rest of the
+        # chain is evaluated in, so it is never served from the cache
+        if (self.bb is None or
+                expression.operation == MediumLevelILOperation.MLIL_IF):
+            return None
+        return self.bb.start, expression.expr_index
+
+    def get_ssa_var_definition(self, ssa_var):
+        try:
+            return self._ssa_var_definitions[ssa_var]
+        except KeyError:
+            expr_def = self.il_function.get_ssa_var_definition(ssa_var)
+            self._ssa_var_definitions[ssa_var] = expr_def
+            return expr_def
+
+    def get_var_definitions(self, var):
+        try:
+            return self._var_definitions[var]
+        except KeyError:
+            expr_defs = sorted(self.il_function.get_var_definitions(var))
+            self._var_definitions[var] = expr_defs
+            return expr_defs
 
     def visit_MLIL_IF(self, expression):
-        self.il_function = expression.function
-        self.function = self.il_function.source_function
+        il_function = expression.function
+        if self.il_function is None or self.il_function != il_function:
+            self.il_function = il_function
+            self.function = il_function.source_function
+            self._reset_caches()
         self.bb = self.il_bb_lookup[expression.instr_index]
 
         condition = expression.condition.ssa_form
 
-        return self.visit(condition)
+        return TailCall(condition)
 
     def visit_MLIL_VAR_SSA(self, expression):
-        expr_def = self.il_function.get_ssa_var_definition(expression.src)
+        expr_def = self.get_ssa_var_definition(expression.src)
 
         if expr_def is None:
             return
@@ -40,21 +136,21 @@ class EVMVisitor(BNILVisitor):
         if self.il_bb_lookup[expr_def] != self.bb:
             return
 
-        return self.visit(self.il_function[expr_def].ssa_form)
+        return TailCall(self.il_function[expr_def].ssa_form)
 
     def visit_MLIL_SET_VAR_ALIASED(self, expression):
-        return self.visit(expression.src)
+        return TailCall(expression.src)
 
     def visit_MLIL_SET_VAR_SSA(self, expression):
-        return self.visit(expression.src)
+        return TailCall(expression.src)
 
     def visit_MLIL_VAR_ALIASED(self, expression):
-        expr_def = self.il_function.get_ssa_var_definition(expression.src)
+        expr_def = self.get_ssa_var_definition(expression.src)
 
         if expr_def is not None:
-            return self.visit(self.il_function[expr_def].ssa_form)
+            return TailCall(self.il_function[expr_def].ssa_form)
 
-        expr_defs = self.il_function.get_var_definitions(expression.src.var)
+        expr_defs = self.get_var_definitions(expression.src.var)
 
         expr_defs = expr_defs[
             bisect_left(
@@ -68,7 +164,7 @@ class EVMVisitor(BNILVisitor):
             current_bb = self.il_bb_lookup[idx]
 
             if current_bb == self.bb:
-                return self.visit(self.il_function[idx].ssa_form)
+                return TailCall(self.il_function[idx].ssa_form)
 
     def visit_MLIL_CONST(self, expression):
         return expression.constant, expression
@@ -83,6 +179,6 @@ class EVMVisitor(BNILVisitor):
         value = self.visit(left)
 
         if value is None:
-            value = self.visit(right)
+            return TailCall(right)
 
         return value
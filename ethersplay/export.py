@@ -0,0 +1,404 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import multiprocessing
+from bisect import bisect_left
+
+from evm_cfg_builder.cfg import CFG
+
+from .common import code_hash, view_cfg
+from .corpus import Corpus
+from .decode import decode
+from .core.cfg import view_address
+from .core.log import log_info, log_error
+from .core.selectors import push_candidates, resolve_hashes
+from .core.payloads import find_payloads
+from .proxy import classify
+from .storage import block_accesses
+
+# the command is only defined inside Binary Ninja, the CLI does not load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import BackgroundTaskThread
+    from binaryninja.interaction import get_save_filename_input
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contracts (
+    id INTEGER PRIMARY KEY,
+    hash TEXT UNIQUE NOT NULL,
+    name TEXT,
+    size INTEGER,
+    proxy TEXT,
+    implementation TEXT,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS functions (
+    id INTEGER PRIMARY KEY,
+    contract_id INTEGER NOT NULL REFERENCES contracts(id) ON DELETE CASCADE,
+    address INTEGER NOT NULL,
+    name TEXT,
+    selector TEXT,
+    attributes TEXT,
+    UNIQUE (contract_id, address)
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    contract_id INTEGER NOT NULL REFERENCES contracts(id) ON DELETE CASCADE,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    PRIMARY KEY (contract_id, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS function_blocks (
+    function_id INTEGER NOT NULL REFERENCES functions(id) ON DELETE CASCADE,
+    start INTEGER NOT NULL,
+    PRIMARY KEY (function_id, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS edges (
+    function_id INTEGER NOT NULL REFERENCES functions(id) ON DELETE CASCADE,
+    source INTEGER NOT NULL,
+    target INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS indirect_branches (
+    contract_id INTEGER NOT NULL REFERENCES contracts(id) ON DELETE CASCADE,
+    source INTEGER NOT NULL,
+    target INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS comments (
+    contract_id INTEGER NOT NULL REFERENCES contracts(id) ON DELETE CASCADE,
+    address INTEGER NOT NULL,
+    comment TEXT
+);
+CREATE TABLE IF NOT EXISTS selectors (
+    contract_id INTEGER NOT NULL REFERENCES contracts(id) ON DELETE CASCADE,
+    address INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    signature TEXT
+);
+CREATE TABLE IF NOT EXISTS storage (
+    function_id INTEGER NOT NULL REFERENCES functions(id) ON DELETE CASCADE,
+    address INTEGER NOT NULL,
+    access TEXT NOT NULL,
+    slot TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS functions_selector ON functions (selector);
+CREATE INDEX IF NOT EXISTS functions_name ON functions (name);
+CREATE INDEX IF NOT EXISTS edges_function ON edges (function_id);
+CREATE INDEX IF NOT EXISTS indirect_branches_contract
+    ON indirect_branches (contract_id);
+CREATE INDEX IF NOT EXISTS comments_contract ON comments (contract_id);
+CREATE INDEX IF NOT EXISTS selectors_hash ON selectors (hash);
+CREATE INDEX IF NOT EXISTS selectors_contract ON selectors (contract_id);
+CREATE INDEX IF NOT EXISTS storage_slot ON storage (slot, access);
+CREATE INDEX IF NOT EXISTS storage_function ON storage (function_id);
+"""
+
+EXPORT_CHUNK_SIZE = 4
+
+
+def _selector(cfg_function):
+    if cfg_function.hash_id in (cfg_function.DISPATCHER_ID,
+                                cfg_function.FALLBACK_ID):
+        return None
+    return "0x{:0=8x}".format(cfg_function.hash_id)
+
+
+def extract_cfg(code, cfg, name=None, names=None, comments=None,
+                indirect_branches=None, online=False):
+    """
+    Flatten what we know about a contract into a record of plain tuples that
+    ExportDatabase.write stores. names, comments and indirect_branches
+    override what is derived from the CFG (e.g. the names and comments of a
+    Binary Ninja view).
+    """
+    code = bytes(code)
+    names = names or {}
+    proxy = classify(code)
+    instructions = decode(code)
+    pcs = [ins.pc for ins in instructions]
+
+    def block_instructions(start, end):
+        return instructions[bisect_left(pcs, start):bisect_left(pcs, end)]
+
+    blocks = {}
+    functions = []
+    derived_branches = set()
+    selectors = []
+    topics = []
+    # each block once, selectors and topics are collected over all of them
+    code_blocks = {}
+    for cfg_function in (cfg.functions if cfg is not None else ()):
+        function_blocks = []
+        edges = []
+        accesses = []
+        for bb in cfg_function.basic_blocks:
+            start = bb.start.pc
+            end = bb.end.pc + bb.end.size
+            blocks[start] = end
+            function_blocks.append(start)
+            block = block_instructions(start, end)
+            accesses.extend(block_accesses(block))
+            code_blocks.setdefault(start, block)
+            for out in bb.outgoing_basic_blocks(cfg_function.key) or ():
+                edges.append((start, out.start.pc))
+                if bb.end.name == "JUMP" or (bb.end.name == "JUMPI" and
+                                             out.start.pc != end):
+                    derived_branches.add((bb.end.pc, out.start.pc))
+        address = view_address(cfg_function.start_addr)
+        functions.append((
+            address, names.get(address, cfg_function.name),
+            _selector(cfg_function), ",".join(cfg_function.attributes),
+            function_blocks, edges, accesses))
+
+    push_candidates(code_blocks.values(), selectors, topics)
+    resolved = resolve_hashes([sig for _, sig in selectors],
+                              [sig for _, sig in topics], online=online)
+    push_rows = []
+    for kind, sites in (("selector", selectors), ("topic", topics)):
+        for address, sig in sites:
+            sigs = resolved.get(sig)
+            push_rows.append((address, kind, sig,
+                              "\n".join(sigs) if sigs else None))
+
+    # function selectors named by signature if nothing better is known
+    for i, function in enumerate(functions):
+        address, function_name, selector = function[:3]
+        if selector and function_name.startswith("0x"):
+            sigs = resolved.get(selector) or resolve_hashes(
+                [selector], online=online).get(selector)
+            if sigs:
+                functions[i] = (address, sigs[0]) + function[2:]
+
+    if indirect_branches is None:
+        indirect_branches = sorted(derived_branches)
+
+    payloads = find_payloads(code, instructions)
+    metadata = {"payloads": [p.hash for p in payloads]}
+    if proxy is not None and proxy.slot:
+        metadata["implementation_slot"] = proxy.slot
+
+    return {
+        "hash": code_hash(code),
+        "name": name,
+        "size": len(code),
+        "proxy": proxy.kind if proxy else None,
+        "implementation": proxy.implementation if proxy else None,
+        "metadata": json.dumps(metadata, sort_keys=True),
+        "blocks": sorted(blocks.items()),
+        "functions": functions,
+        "indirect_branches": list(indirect_branches),
+        "comments": sorted((comments or {}).items()),
+        "selectors": push_rows,
+    }
+
+
+def extract_code(code, name=None, online=False):
+    """extract_cfg for bytecode without a view; the CFG is not built for
+    proxies whose analysis would be skipped when opening them."""
+    proxy = classify(code)
+    cfg = None
+    if proxy is None or not proxy.skip_analysis:
+        cfg = CFG(bytes(code))
+    return extract_cfg(code, cfg, name, online=online)
+
+
+def extract_view(view):
+    names = {}
+    comments = dict(view.address_comments)
+    indirect_branches = set()
+    for function in view.functions:
+        names[function.start] = function.name
+        comments.update(function.comments)
+        for branch in function.indirect_branches:
+            indirect_branches.add((branch.source_addr, branch.dest_addr))
+    cfg = view_cfg(view) if view.session_data.get("proxy") is None or \
+        not view.session_data["proxy"].skip_analysis else None
+    return extract_cfg(view.read(0, len(view)), cfg,
+                       os.path.basename(view.file.filename), names, comments,
+                       sorted(indirect_branches), online=True)
+
+
+class ExportDatabase(object):
+    """
+    The export schema. Each contract is written in one transaction with
+    batched inserts; re-exporting a contract replaces its rows.
+    """
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, code_hash):
+        return self.db.execute("SELECT 1 FROM contracts WHERE hash = ?",
+                               (code_hash,)).fetchone() is not None
+
+    def write(self, record):
+        with self.db:
+            db = self.db
+            db.execute("DELETE FROM contracts WHERE hash = ?",
+                       (record["hash"],))
+            contract_id = db.execute(
+                "INSERT INTO contracts (hash, name, size, proxy, "
+                "implementation, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                (record["hash"], record["name"], record["size"],
+                 record["proxy"], record["implementation"],
+                 record["metadata"])).lastrowid
+
+            db.executemany(
+                "INSERT INTO blocks VALUES (?, ?, ?)",
+                [(contract_id, start, end)
+                 for start, end in record["blocks"]])
+
+            function_blocks = []
+            edges = []
+            accesses = []
+            for (address, name, selector, attributes, blocks, function_edges,
+                 function_accesses) in record["functions"]:
+                function_id = db.execute(
+                    "INSERT INTO functions (contract_id, address, name, "
+                    "selector, attributes) VALUES (?, ?, ?, ?, ?)",
+                    (contract_id, address, name, selector,
+                     attributes)).lastrowid
+                function_blocks.extend((function_id, start)
+                                       for start in set(blocks))
+                edges.extend((function_id, source, target)
+                             for source, target in function_edges)
+                accesses.extend((function_id, pc, access, slot)
+                                for pc, access, slot in function_accesses)
+            db.executemany("INSERT INTO function_blocks VALUES (?, ?)",
+                           function_blocks)
+            db.executemany("INSERT INTO edges VALUES (?, ?, ?)", edges)
+            db.executemany("INSERT INTO storage VALUES (?, ?, ?, ?)",
+                           accesses)
+
+            db.executemany(
+                "INSERT INTO indirect_branches VALUES (?, ?, ?)",
+                [(contract_id, source, target)
+                 for source, target in record["indirect_branches"]])
+            db.executemany(
+                "INSERT INTO comments VALUES (?, ?, ?)",
+                [(contract_id, address, comment)
+                 for address, comment in record["comments"]])
+            db.executemany(
+                "INSERT INTO selectors VALUES (?, ?, ?, ?, ?)",
+                [(contract_id,) + row for row in record["selectors"]])
+        return contract_id
+
+
+_corpora = {}
+
+
+def _extract_task(task):
+    """Worker side of export_files: ('file', filename) or
+    ('corpus', corpus_path, code_hash, name) -> (task, record or error)."""
+    try:
+        if task[0] == "corpus":
+            _, path, entry, name = task
+            corpus = _corpora.get(path)
+            if corpus is None:
+                corpus = _corpora[path] = Corpus(path)
+            return task, extract_code(corpus.get(entry), name)
+        with open(task[1], "rb") as f:
+            code = f.read()
+        return task, extract_code(code, os.path.basename(task[1]))
+    except Exception as e:
+        return task, "{}: {}".format(type(e).__name__, e)
+
+
+def export_tasks(filename, tasks, jobs=None):
+    """
+    Extract tasks on a pool of jobs worker processes while this process is
+    the only writer to the database. Returns (written, failed).
+    """
+    written = failed = 0
+    with ExportDatabase(filename) as db:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for task, record in pool.imap_unordered(
+                    _extract_task, tasks, EXPORT_CHUNK_SIZE):
+                if isinstance(record, dict):
+                    db.write(record)
+                    written += 1
+                else:
+                    log_error("export of {} failed: {}".format(
+                        task[2] if task[0] == "corpus" else task[1], record))
+                    failed += 1
+        finally:
+            pool.close()
+            pool.join()
+    return written, failed
+
+
+def corpus_tasks(path, db_filename=None):
+    """Tasks for every corpus entry that is not in the database yet."""
+    exported = set()
+    if db_filename is not None and os.path.exists(db_filename):
+        with ExportDatabase(db_filename) as db:
+            exported = {row[0] for row in
+                        db.db.execute("SELECT hash FROM contracts")}
+    with Corpus(path) as corpus:
+        # one name per entry, looked up once rather than in every task
+        names = {h: n for n, h in corpus.names.items()}
+        return [("corpus", path, entry, names.get(entry)) for entry in corpus
+                if entry not in exported]
+
+
+if 'binaryninja' in sys.modules:
+    class ExportThread(BackgroundTaskThread):
+        def __init__(self, view, filename):
+            BackgroundTaskThread.__init__(self, "Exporting to SQLite...",
+                                          False)
+            self.view = view
+            self.filename = filename
+
+        def run(self):
+            record = extract_view(self.view)
+            with ExportDatabase(self.filename) as db:
+                db.write(record)
+            log_info("exported {} functions to {}".format(
+                len(record["functions"]), self.filename))
+
+    def export_view_bn(view):
+        filename = get_save_filename_input("Export to SQLite database",
+                                           "sqlite")
+        if not filename:
+            return
+        if isinstance(filename, bytes):
+            filename = filename.decode("utf-8")
+        ExportThread(view, filename).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export functions, blocks, edges, selectors and storage "
+                    "accesses of many contracts into SQLite")
+    parser.add_argument("database")
+    parser.add_argument("files", nargs="*", help=".evm files")
+    parser.add_argument("--corpus", action="append", default=[],
+                        help="packed corpus directory, may be repeated")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    tasks = [("file", filename) for filename in args.files]
+    for path in args.corpus:
+        tasks.extend(corpus_tasks(path, args.database))
+    written, failed = export_tasks(args.database, tasks, args.jobs)
+    print("exported {} contracts, {} failed".format(written, failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
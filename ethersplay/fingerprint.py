@@ -0,0 +1,307 @@
+import os
+import sys
+import random
+import sqlite3
+import struct
+import hashlib
+
+from pyevmasm import disassemble_all
+
+from .common import code_hash
+from .core.cfg import function_blocks, view_address
+from .core.log import log_info, log_error
+
+# the commands are only defined inside Binary Ninja, diff and snapshot do
+# not load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import BackgroundTaskThread
+
+FINGERPRINT_PATH = os.path.expanduser("~/.ethersplay")
+FINGERPRINT_DB = os.path.join(FINGERPRINT_PATH, "fingerprints.sqlite")
+
+NGRAM_SIZE = 3
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+MIN_INSTRUCTIONS = 8
+DEFAULT_THRESHOLD = 0.8
+
+# names that carry no information and are never propagated
+DEFAULT_NAME_PREFIXES = ("sub_", "0x", "_dispatcher", "internal_0x")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(0x45564d)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME),
+                  _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(NUM_PERMUTATIONS)]
+_SIGNATURE = struct.Struct(">{}Q".format(NUM_PERMUTATIONS))
+
+
+def normalize(name):
+    # immediates are already gone, the PUSH width only reflects addresses
+    # and constants that differ between otherwise identical functions
+    if name.startswith("PUSH"):
+        return "PUSH"
+    return name
+
+
+def shingles(blocks, n=NGRAM_SIZE):
+    """
+    blocks is a list of opcode name lists, one per basic block, in address
+    order. JUMPDESTs are dropped so that evm_cfg_builder blocks (which start
+    at every JUMPDEST) and Binary Ninja blocks (which only split at branch
+    targets) yield the same n-grams.
+    """
+    tokens = [normalize(name) for block in blocks for name in block
+              if name != "JUMPDEST"]
+    return {" ".join(tokens[i:i + n])
+            for i in range(max(len(tokens) - n + 1, 1))}
+
+
+def minhash(features):
+    hashes = [int.from_bytes(hashlib.blake2b(f.encode("utf-8"),
+                                             digest_size=8).digest(), "big")
+              for f in features]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+                 for a, b in _PERMUTATIONS)
+
+
+def similarity(sig1, sig2):
+    return sum(1 for a, b in zip(sig1, sig2) if a == b) / NUM_PERMUTATIONS
+
+
+def lsh_buckets(signature):
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(struct.pack(">{}Q".format(LSH_ROWS), *rows),
+                                 digest_size=8).digest()
+        # sqlite integers are signed 64 bit
+        yield band, int.from_bytes(digest, "big") >> 1
+
+
+def fingerprint_blocks(blocks):
+    """Return the MinHash signature of a function given as opcode name lists
+    per basic block, or None if it is too small to be meaningful."""
+    if sum(len(block) for block in blocks) < MIN_INSTRUCTIONS:
+        return None
+    return minhash(shingles(blocks))
+
+
+def cfg_function_blocks(cfg_function, cfg=None, stop=None, calls=None,
+                        returns=()):
+    """Opcode names per block of an evm_cfg_builder function. With cfg, its
+    blocks the way the EVMView has them, see core.cfg.function_blocks."""
+    if cfg is None:
+        basic_blocks = sorted(cfg_function.basic_blocks,
+                              key=lambda bb: bb.start.pc)
+    else:
+        basic_blocks = function_blocks(cfg, cfg_function.start_addr, stop,
+                                       calls, returns)
+    return [[i.name for i in bb.instructions] for bb in basic_blocks]
+
+
+def view_function_blocks(view, function):
+    """Opcode names per block of function. If the view has a CFG, the blocks
+    are walked the way lookup_cfg_names walks them, so both fingerprint the
+    same unit whatever Binary Ninja has resolved so far."""
+    cfg = view.session_data.get('cfg')
+    start = function.start - 1 if function.start != 0 else 0
+    if cfg is not None and cfg.get_basic_block_at(start) is not None:
+        internal = view.session_data.get('internal')
+
+        def stop(pc):
+            return view.get_function_at(view_address(pc)) is not None
+        basic_blocks = function_blocks(
+            cfg, start, stop, internal.calls if internal else None,
+            internal.returns if internal else ())
+        return [[i.name for i in bb.instructions] for bb in basic_blocks]
+    blocks = []
+    for bb in sorted(function.basic_blocks, key=lambda bb: bb.start):
+        code = view.read(bb.start, bb.end - bb.start)
+        blocks.append([i.name for i in disassemble_all(code, bb.start)])
+    return blocks
+
+
+def is_default_name(name):
+    return not name or name.startswith(DEFAULT_NAME_PREFIXES)
+
+
+class FingerprintIndex(object):
+    """
+    Persistent MinHash/LSH index of function fingerprints. Candidates are
+    found through LSH_BANDS bucket lookups and then ranked by their estimated
+    Jaccard similarity, so a query does not scan the whole index.
+    """
+
+    def __init__(self, filename=FINGERPRINT_DB):
+        dir_name = os.path.dirname(filename)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        self.db = sqlite3.connect(filename)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS functions (
+                id INTEGER PRIMARY KEY,
+                contract TEXT NOT NULL,
+                address INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                comment TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                UNIQUE (contract, address)
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                function INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS buckets_lookup
+                ON buckets (band, bucket);
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, contract, address, name, comment, signature):
+        with self.db:
+            row = self.db.execute(
+                "SELECT id FROM functions WHERE contract = ? AND address = ?",
+                (contract, address)).fetchone()
+            if row is not None:
+                self.db.execute("DELETE FROM buckets WHERE function = ?", row)
+                self.db.execute("DELETE FROM functions WHERE id = ?", row)
+            function_id = self.db.execute(
+                "INSERT INTO functions (contract, address, name, comment, "
+                "signature) VALUES (?, ?, ?, ?, ?)",
+                (contract, address, name, comment or "",
+                 _SIGNATURE.pack(*signature))).lastrowid
+            self.db.executemany(
+                "INSERT INTO buckets (band, bucket, function) VALUES (?, ?, ?)",
+                [(band, bucket, function_id)
+                 for band, bucket in lsh_buckets(signature)])
+
+    def query(self, signature, threshold=DEFAULT_THRESHOLD, exclude=None):
+        """Return (similarity, name, comment) of the best match above
+        threshold, ignoring functions of contract `exclude`, or None."""
+        candidates = set()
+        for band, bucket in lsh_buckets(signature):
+            candidates.update(row[0] for row in self.db.execute(
+                "SELECT function FROM buckets WHERE band = ? AND bucket = ?",
+                (band, bucket)))
+
+        best = None
+        for function_id in candidates:
+            contract, name, comment, blob = self.db.execute(
+                "SELECT contract, name, comment, signature FROM functions "
+                "WHERE id = ?", (function_id,)).fetchone()
+            if contract == exclude:
+                continue
+            score = similarity(signature, _SIGNATURE.unpack(blob))
+            if score >= threshold and (best is None or score > best[0]):
+                best = (score, name, comment)
+        return best
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM functions").fetchone()[0]
+
+
+def lookup_cfg_names(cfg, filename=FINGERPRINT_DB, internal=None):
+    """
+    Match the functions of an evm_cfg_builder CFG against the index and return
+    {start_addr: (name, comment)} for those that only have a default name.
+    internal is the internal.Recovered of the code: a function is
+    fingerprinted the way index_view fingerprints the view's functions,
+    without the internal functions it calls and the other functions.
+    """
+    if not os.path.exists(filename):
+        return {}
+    functions, calls, returns = (
+        (internal.functions, internal.calls, internal.returns)
+        if internal is not None else ({}, {}, ()))
+    starts = set(f.start_addr for f in cfg.functions) | set(functions)
+    index = FingerprintIndex(filename)
+    rv = {}
+    try:
+        for function in cfg.functions:
+            if not is_default_name(function.name):
+                continue
+            signature = fingerprint_blocks(cfg_function_blocks(
+                function, cfg, starts.__contains__, calls, returns))
+            if signature is None:
+                continue
+            match = index.query(signature)
+            if match is not None:
+                rv[function.start_addr] = match[1:]
+    finally:
+        index.close()
+    return rv
+
+
+def index_view(view, filename=FINGERPRINT_DB):
+    contract = code_hash(view.read(0, len(view)))
+    index = FingerprintIndex(filename)
+    added = 0
+    try:
+        for function in view.functions:
+            if is_default_name(function.name):
+                continue
+            signature = fingerprint_blocks(
+                view_function_blocks(view, function))
+            if signature is None:
+                continue
+            index.add(contract, function.start, function.name,
+                      function.comment, signature)
+            added += 1
+        log_info("fingerprint index: added {} named functions, {} total"
+                 .format(added, len(index)))
+    finally:
+        index.close()
+    return added
+
+
+def apply_view(view, filename=FINGERPRINT_DB, threshold=DEFAULT_THRESHOLD):
+    if not os.path.exists(filename):
+        log_error("no fingerprint index at {}".format(filename))
+        return 0
+    contract = code_hash(view.read(0, len(view)))
+    index = FingerprintIndex(filename)
+    renamed = 0
+    try:
+        for function in view.functions:
+            if not is_default_name(function.name):
+                continue
+            signature = fingerprint_blocks(
+                view_function_blocks(view, function))
+            if signature is None:
+                continue
+            match = index.query(signature, threshold, exclude=contract)
+            if match is None:
+                continue
+            score, name, comment = match
+            log_info("fingerprint match {:.2f}: {} -> {}".format(
+                score, function.name, name))
+            function.name = name
+            if comment:
+                if function.comment:
+                    function.comment += "\n------\n"
+                function.comment += comment
+            renamed += 1
+    finally:
+        index.close()
+    return renamed
+
+
+if 'binaryninja' in sys.modules:
+    class FingerprintThread(BackgroundTaskThread):
+        def __init__(self, view, action):
+            BackgroundTaskThread.__init__(self, "Fingerprinting functions...",
+                                          False)
+            self.view = view
+            self.action = action
+
+        def run(self):
+            self.action(self.view)
+
+    def index_view_bn(view):
+        FingerprintThread(view, index_view).start()
+
+    def apply_view_bn(view):
+        FingerprintThread(view, apply_view).start()
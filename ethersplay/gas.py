@@ -0,0 +1,368 @@
+import sys
+import json
+import argparse
+from bisect import bisect_left
+
+from pyevmasm import instruction_tables
+
+from .constprop import propagate
+from .core.log import log_info
+from .decode import decode
+
+# the command is only defined inside Binary Ninja, the CLI does not load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import HighlightStandardColor, BackgroundTaskThread
+    from binaryninja.interaction import get_choice_input
+
+    HEAT_COLORS = [HighlightStandardColor.GreenHighlightColor,
+                   HighlightStandardColor.YellowHighlightColor,
+                   HighlightStandardColor.OrangeHighlightColor,
+                   HighlightStandardColor.RedHighlightColor]
+
+FORKS = ['frontier', 'homestead', 'tangerine_whistle', 'spurious_dragon',
+         'byzantium', 'constantinople', 'petersburg', 'istanbul', 'berlin',
+         'london', 'shanghai', 'cancun']
+DEFAULT_GAS_FORK = 'cancun'
+
+# assumed upper bound in bytes of sizes and memory offsets that are not
+# constant, so dynamic costs still get a finite maximum
+DYNAMIC_SIZE_BOUND = 1024
+
+_ACCOUNT_ACCESS = ['BALANCE', 'EXTCODESIZE', 'EXTCODECOPY', 'EXTCODEHASH',
+                   'CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL']
+
+# (opcode, name, gas, fork) of opcodes added after istanbul
+_LATER_OPCODES = [(0x48, 'BASEFEE', 2, 'london'),
+                  (0x5f, 'PUSH0', 2, 'shanghai'),
+                  (0x49, 'BLOBHASH', 3, 'cancun'),
+                  (0x4a, 'BLOBBASEFEE', 2, 'cancun'),
+                  (0x5c, 'TLOAD', 100, 'cancun'),
+                  (0x5d, 'TSTORE', 100, 'cancun'),
+                  (0x5e, 'MCOPY', 3, 'cancun')]
+
+# instruction -> bytes of memory at the offset on top of the stack
+_WORD_MEMORY = {'MLOAD': 32, 'MSTORE': 32, 'MSTORE8': 1}
+# instruction -> (offset arg, size arg) of the memory it reads or writes
+_MEMORY_ARGS = {
+    'SHA3': (0, 1), 'CALLDATACOPY': (0, 2), 'CODECOPY': (0, 2),
+    'RETURNDATACOPY': (0, 2), 'EXTCODECOPY': (1, 3), 'MCOPY': (0, 2),
+    'RETURN': (0, 1), 'REVERT': (0, 1), 'CREATE': (1, 2), 'CREATE2': (1, 2),
+    'LOG0': (0, 1), 'LOG1': (0, 1), 'LOG2': (0, 1), 'LOG3': (0, 1),
+    'LOG4': (0, 1),
+}
+# (in offset, in size, out offset, out size) of calls
+_CALL_MEMORY_ARGS = {'CALL': (3, 4, 5, 6), 'CALLCODE': (3, 4, 5, 6),
+                     'DELEGATECALL': (2, 3, 4, 5),
+                     'STATICCALL': (2, 3, 4, 5)}
+# instruction -> (size arg, gas per word)
+_WORD_COSTS = {'SHA3': (1, 6), 'CALLDATACOPY': (2, 3), 'CODECOPY': (2, 3),
+               'RETURNDATACOPY': (2, 3), 'EXTCODECOPY': (3, 3),
+               'MCOPY': (2, 3)}
+_DYNAMIC = (frozenset(_WORD_MEMORY) | frozenset(_MEMORY_ARGS) |
+            frozenset(_CALL_MEMORY_ARGS) | frozenset(['EXP']))
+
+_tables = {}
+
+
+def _since(fork, first):
+    return FORKS.index(fork) >= FORKS.index(first)
+
+
+def _decode_fork(fork):
+    # decode knows the opcodes added after istanbul in every fork
+    return fork if fork in instruction_tables else 'istanbul'
+
+
+def gas_table(fork=DEFAULT_GAS_FORK):
+    """
+    (min, max) static gas of all 256 opcodes in fork. Costs that depend on
+    warm/cold access or on the storage value before and after an SSTORE are
+    given as their cheapest and most expensive case.
+    """
+    table = _tables.get(fork)
+    if table is not None:
+        return table
+
+    instructions = instruction_tables[_decode_fork(fork)]
+    names = {}
+    fees = []
+    for opcode in range(256):
+        if opcode in instructions:
+            i = instructions[opcode]
+            names[i.name] = opcode
+            fees.append([i.fee, i.fee])
+        else:
+            fees.append([0, 0])
+
+    def fee(name, low, high=None):
+        if name in names:
+            fees[names[name]] = [low, low if high is None else high]
+
+    for opcode, name, gas, first in _LATER_OPCODES:
+        if _since(fork, first):
+            names[name] = opcode
+            fee(name, gas)
+
+    if _since(fork, 'berlin'):
+        # EIP-2929 warm / cold access
+        fee('SLOAD', 100, 2100)
+        for name in _ACCOUNT_ACCESS:
+            fee(name, 100, 2600)
+        fee('SSTORE', 100, 22100)
+        fee('SELFDESTRUCT', 5000, 7600)
+    elif _since(fork, 'istanbul'):
+        fee('SSTORE', 800, 20000)
+    else:
+        fee('SSTORE', 5000, 20000)
+
+    # value transfer and account creation
+    for name in ('CALL', 'CALLCODE'):
+        fees[names[name]][1] += 9000
+    fees[names['CALL']][1] += 25000
+    if 'SELFDESTRUCT' in names:
+        fees[names['SELFDESTRUCT']][1] += 25000
+
+    table = [tuple(f) for f in fees]
+    _tables[fork] = table
+    return table
+
+
+def _words(size):
+    return (size + 31) // 32
+
+
+def memory_cost(size):
+    """Gas of growing memory from nothing to size bytes."""
+    words = _words(size)
+    return 3 * words + words * words // 512
+
+
+def _memory_end(offset, size):
+    if size == 0:
+        return 0
+    if not isinstance(offset, int) or not isinstance(size, int):
+        return DYNAMIC_SIZE_BOUND
+    return offset + size
+
+
+def _dynamic_cost(name, args, fork):
+    """(min, max, memory_end): gas on top of the static cost and the highest
+    memory address touched, with non-constant arguments bounded by
+    DYNAMIC_SIZE_BOUND."""
+    low = high = 0
+    if name in _WORD_COSTS:
+        arg, per_word = _WORD_COSTS[name]
+        size = args[arg]
+        if isinstance(size, int):
+            low = high = per_word * _words(size)
+        else:
+            high = per_word * _words(DYNAMIC_SIZE_BOUND)
+    elif name.startswith('LOG'):
+        size = args[1]
+        if isinstance(size, int):
+            low = high = 8 * size
+        else:
+            high = 8 * DYNAMIC_SIZE_BOUND
+    elif name == 'EXP':
+        per_byte = 50 if _since(fork, 'spurious_dragon') else 10
+        exponent = args[1]
+        if isinstance(exponent, int):
+            low = high = per_byte * ((exponent.bit_length() + 7) // 8)
+        else:
+            high = per_byte * 32
+    elif name in ('CALL', 'CALLCODE') and args[2] == 0:
+        # no value transferred, so no value or new account surcharge
+        high -= 9000 + (25000 if name == 'CALL' else 0)
+
+    memory = 0
+    if name in _WORD_MEMORY:
+        memory = _memory_end(args[0], _WORD_MEMORY[name])
+    elif name in _MEMORY_ARGS:
+        offset, size = _MEMORY_ARGS[name]
+        memory = _memory_end(args[offset], args[size])
+        if name == 'MCOPY':
+            memory = max(memory, _memory_end(args[1], args[2]))
+    elif name in _CALL_MEMORY_ARGS:
+        in_offset, in_size, out_offset, out_size = _CALL_MEMORY_ARGS[name]
+        memory = max(_memory_end(args[in_offset], args[in_size]),
+                     _memory_end(args[out_offset], args[out_size]))
+    return low, high, memory
+
+
+def instruction_costs(instructions, fork=DEFAULT_GAS_FORK):
+    """
+    Return [(pc, min, max, memory_end)] for decoded instructions, in one pass
+    over the static gas table and the per-block constant propagation.
+    """
+    table = gas_table(fork)
+    rv = []
+    append = rv.append
+    for ins, args in propagate(instructions):
+        low, high = table[ins.opcode]
+        if ins.name in _DYNAMIC:
+            extra_low, extra_high, memory = _dynamic_cost(ins.name, args,
+                                                          fork)
+            append((ins.pc, low + extra_low, high + extra_high, memory))
+        else:
+            append((ins.pc, low, high, 0))
+    return rv
+
+
+def block_costs(costs, blocks):
+    """
+    {start: (min, max)} gas of the [start, end) ranges in blocks, from the
+    output of instruction_costs. Memory expansion is charged once per block,
+    at most as much as growing memory to the highest address touched in it.
+    """
+    pcs = [c[0] for c in costs]
+    rv = {}
+    for start, end in blocks:
+        low = high = memory = 0
+        for i in range(bisect_left(pcs, start), bisect_left(pcs, end)):
+            _, l, h, m = costs[i]
+            low += l
+            high += h
+            if m > memory:
+                memory = m
+        rv[start] = (low, high + memory_cost(memory))
+    return rv
+
+
+def worst_case_path(entry, successors, cost):
+    """
+    Highest sum of cost over the paths from entry, with loop back edges
+    ignored. Returns (cost, has_loops).
+    """
+    best = {}
+    on_stack = set([entry])
+    stack = [(entry, iter(successors(entry)))]
+    has_loops = False
+    while stack:
+        node, children = stack[-1]
+        for child in children:
+            if child in on_stack:
+                has_loops = True
+            elif child not in best:
+                on_stack.add(child)
+                stack.append((child, iter(successors(child))))
+                break
+        else:
+            stack.pop()
+            on_stack.discard(node)
+            best[node] = cost(node) + max(
+                [best[c] for c in successors(node) if c in best] or [0])
+    return best[entry], has_loops
+
+
+def heat_color(cost, max_cost):
+    if not max_cost:
+        return HEAT_COLORS[0]
+    return HEAT_COLORS[min(len(HEAT_COLORS) - 1,
+                           len(HEAT_COLORS) * cost // (max_cost + 1))]
+
+
+def analyze_view(view, fork=DEFAULT_GAS_FORK):
+    """
+    Compute block costs and worst-case path costs of every function in view.
+    Functions are returned ranked by their worst-case cost.
+    """
+    instructions = decode(view.read(0, len(view)), fork=_decode_fork(fork))
+    costs = instruction_costs(instructions, fork)
+    blocks = block_costs(costs, set((bb.start, bb.end)
+                                    for function in view.functions
+                                    for bb in function.basic_blocks))
+
+    functions = []
+    for function in view.functions:
+        entry = function.get_basic_block_at(function.start)
+        if entry is None:
+            continue
+        cost, has_loops = worst_case_path(
+            entry, lambda bb: [e.target for e in bb.outgoing_edges],
+            lambda bb: blocks[bb.start][1])
+        functions.append({'name': function.name, 'address': function.start,
+                          'worst_case': cost, 'loops': has_loops})
+    functions.sort(key=lambda f: -f['worst_case'])
+
+    result = {'fork': fork, 'blocks': blocks, 'functions': functions}
+    view.session_data['gas'] = result
+    return result
+
+
+def highlight_gas(view, result):
+    blocks = result['blocks']
+    max_cost = max([high for _, high in blocks.values()] or [0])
+    for function in view.functions:
+        for bb in function.basic_blocks:
+            bb.set_user_highlight(heat_color(blocks[bb.start][1], max_cost))
+    for entry in result['functions']:
+        function = view.get_function_at(entry['address'])
+        function.set_comment_at(function.start, 'worst-case gas: {}{}'.format(
+            entry['worst_case'], ' (loops not counted)' if entry['loops']
+            else ''))
+
+
+if 'binaryninja' in sys.modules:
+    class GasThread(BackgroundTaskThread):
+        def __init__(self, view, fork):
+            BackgroundTaskThread.__init__(self, 'Computing gas costs...',
+                                          False)
+            self.view = view
+            self.fork = fork
+
+        def run(self):
+            result = analyze_view(self.view, self.fork)
+            highlight_gas(self.view, result)
+            for entry in result['functions'][:10]:
+                log_info('gas: {:>8} {}{}'.format(
+                    entry['worst_case'], entry['name'],
+                    ' (loops)' if entry['loops'] else ''))
+
+    def gas_heat_map_bn(view):
+        choice = get_choice_input('Hard fork', 'Gas costs', FORKS)
+        if choice is None:
+            return
+        GasThread(view, FORKS[choice]).start()
+
+
+def analyze_cfg(cfg, fork=DEFAULT_GAS_FORK):
+    """analyze_view for an evm_cfg_builder CFG, without Binary Ninja."""
+    instructions = decode(cfg.bytecode, fork=_decode_fork(fork))
+    costs = instruction_costs(instructions, fork)
+    blocks = block_costs(costs, set(
+        (bb.start.pc, bb.end.pc + bb.end.size) for bb in cfg.basic_blocks))
+
+    functions = []
+    for function in cfg.functions:
+        cost, has_loops = worst_case_path(
+            function.entry,
+            lambda bb: bb.outgoing_basic_blocks(function.key),
+            lambda bb: blocks[bb.start.pc][1])
+        functions.append({'name': function.name,
+                          'address': function.start_addr,
+                          'worst_case': cost, 'loops': has_loops})
+    functions.sort(key=lambda f: -f['worst_case'])
+    return {'fork': fork, 'blocks': blocks, 'functions': functions}
+
+
+def main(argv=None):
+    from evm_cfg_builder.cfg import CFG
+
+    parser = argparse.ArgumentParser(
+        description="Rank the functions of a contract by worst-case gas")
+    parser.add_argument("file")
+    parser.add_argument("--fork", choices=FORKS, default=DEFAULT_GAS_FORK)
+    args = parser.parse_args(argv)
+
+    with open(args.file, "rb") as f:
+        cfg = CFG(f.read())
+    result = analyze_cfg(cfg, args.fork)
+    json.dump({'fork': result['fork'], 'functions': result['functions'],
+               'blocks': {hex(start): cost for start, cost
+                          in sorted(result['blocks'].items())}},
+              sys.stdout, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
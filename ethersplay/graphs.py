@@ -0,0 +1,66 @@
+"""
+Export of a view's control flow graphs as DOT, GraphML or JSON, the
+headless counterpart of Render Flowgraphs: the functions and edges are the
+view's, the instruction text is decoded from its bytes. For contracts
+without a view see ethersplay.core.graphs.
+"""
+import os
+
+from binaryninja import log_info, BackgroundTaskThread, BranchType
+from binaryninja.interaction import get_save_filename_input
+
+from .core.graphs import FORMATS, TRUE, FunctionGraph, write_graphs
+from .decode import decode
+
+
+def view_graphs(view):
+    """Yield the FunctionGraph of every function of view. A JUMPI's resolved
+    indirect branch is its true branch, as in Render Flowgraphs."""
+    for function in view.functions:
+        blocks = []
+        edges = []
+        for bb in sorted(function.basic_blocks, key=lambda bb: bb.start):
+            blocks.append((bb.start, bb.end))
+            is_jumpi = None
+            for edge in bb.outgoing_edges:
+                kind = edge.type.name
+                if edge.type == BranchType.IndirectBranch:
+                    if is_jumpi is None:
+                        last = decode(view.read(bb.start, bb.end - bb.start),
+                                      bb.start)[-1]
+                        is_jumpi = last.name == 'JUMPI'
+                    if is_jumpi:
+                        kind = TRUE
+                edges.append((bb.start, edge.target.start, kind))
+        yield FunctionGraph(function.start, function.name, blocks, edges)
+
+
+class GraphExportThread(BackgroundTaskThread):
+    def __init__(self, view, filename, fmt):
+        BackgroundTaskThread.__init__(self, 'Exporting CFGs...', False)
+        self.view = view
+        self.filename = filename
+        self.fmt = fmt
+
+    def run(self):
+        with open(self.filename, 'w') as f:
+            count = write_graphs(
+                f, view_graphs(self.view),
+                decode(self.view.read(0, len(self.view))), self.fmt,
+                os.path.basename(self.view.file.filename))
+        log_info('exported the CFGs of {} functions to {}'.format(
+            count, self.filename))
+
+
+def export_graphs_bn(view):
+    filename = get_save_filename_input('Export CFGs (.dot, .graphml or '
+                                       '.json)', 'dot')
+    if not filename:
+        return
+    if isinstance(filename, bytes):
+        filename = filename.decode('utf-8')
+    fmt = os.path.splitext(filename)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        fmt = 'dot'
+        filename += '.dot'
+    GraphExportThread(view, filename, fmt).start()
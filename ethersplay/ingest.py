@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import queue
+import argparse
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from .common import code_hash
+from .corpus import CorpusWriter
+from .core.log import log_error, log_warn, log_info
+
+# the command is only defined inside Binary Ninja, the CLI does not load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import BackgroundTaskThread
+    from binaryninja.interaction import (get_text_line_input,
+                                         get_directory_name_input)
+
+DEFAULT_RPC_URL = "http://127.0.0.1:8545"
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 30
+
+MANIFEST_NAME = "manifest.json"
+
+
+class RpcError(Exception):
+    pass
+
+
+class RpcConnectionPool(object):
+    """
+    A bounded pool of keep-alive HTTP connections to one JSON-RPC endpoint.
+    At most `size` requests are in flight at a time; a connection is only
+    re-opened when the server drops it.
+    """
+
+    def __init__(self, url, size=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise RpcError("unsupported JSON-RPC url '{}'".format(url))
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += "?" + parts.query
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(None)
+
+    def _connect(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port,
+                                               timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+
+    def post(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json",
+                   "Connection": "keep-alive"}
+        conn = self._idle.get()
+        try:
+            for attempt in range(2):
+                if conn is None:
+                    conn = self._connect()
+                try:
+                    conn.request("POST", self.path, body, headers)
+                    res = conn.getresponse()
+                    data = res.read()
+                except (http.client.HTTPException, OSError):
+                    # stale keep-alive connection, retry once on a fresh one
+                    conn.close()
+                    conn = None
+                    if attempt:
+                        raise
+                    continue
+                if res.status != 200:
+                    raise RpcError("JSON-RPC endpoint returned HTTP {}"
+                                   .format(res.status))
+                if res.will_close:
+                    conn.close()
+                    conn = None
+                return json.loads(data.decode("utf-8"))
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        while not self._idle.empty():
+            conn = self._idle.get_nowait()
+            if conn is not None:
+                conn.close()
+
+
+def normalize_address(address):
+    address = address.strip().lower()
+    if not address.startswith("0x"):
+        address = "0x" + address
+    if len(address) != 42:
+        raise ValueError("invalid address '{}'".format(address))
+    int(address, 16)
+    return address
+
+
+def get_code_batch(pool, addresses, block="latest"):
+    """
+    Perform one JSON-RPC batch request of eth_getCode for all addresses and
+    return a dict address -> bytes. Addresses without code are skipped.
+    """
+    payload = [{"jsonrpc": "2.0", "id": i, "method": "eth_getCode",
+                "params": [address, block]}
+               for i, address in enumerate(addresses)]
+    replies = pool.post(payload)
+    if isinstance(replies, dict):
+        # some nodes answer a failed batch with a single error object
+        raise RpcError("batch request failed: {}".format(
+            replies.get("error", replies)))
+
+    rv = {}
+    for reply in replies:
+        address = addresses[reply["id"]]
+        if "error" in reply:
+            log_warn("eth_getCode failed for {}: {}".format(
+                address, reply["error"]))
+            continue
+        code = reply.get("result") or "0x"
+        if code.startswith("0x"):
+            code = code[2:]
+        if code:
+            rv[address] = bytes.fromhex(code)
+    return rv
+
+
+def fetch_code(addresses, url=DEFAULT_RPC_URL, block="latest",
+               batch_size=DEFAULT_BATCH_SIZE,
+               concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+    """
+    Fetch the runtime bytecode of all addresses from a JSON-RPC endpoint,
+    `batch_size` addresses per request and at most `concurrency` requests in
+    flight. Returns a dict address -> bytes.
+    """
+    addresses = sorted({normalize_address(a) for a in addresses})
+    batches = [addresses[i:i + batch_size]
+               for i in range(0, len(addresses), batch_size)]
+
+    pool = RpcConnectionPool(url, concurrency, timeout)
+    rv = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for codes in executor.map(
+                    lambda batch: get_code_batch(pool, batch, block),
+                    batches):
+                rv.update(codes)
+    finally:
+        pool.close()
+
+    log_info("fetched code for {} of {} addresses".format(
+        len(rv), len(addresses)))
+    return rv
+
+
+def write_evm_files(codes, output_dir):
+    """
+    Write every distinct bytecode once as <sha256>.evm into output_dir and
+    record the address -> file mapping in manifest.json. Returns the manifest.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    manifest_file = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+
+    written = 0
+    for address, code in codes.items():
+        filename = code_hash(code) + ".evm"
+        full_path = os.path.join(output_dir, filename)
+        if not os.path.exists(full_path):
+            with open(full_path, "wb") as f:
+                f.write(code)
+            written += 1
+        manifest[address] = filename
+
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    log_info("wrote {} new .evm files for {} addresses to {}".format(
+        written, len(codes), output_dir))
+    return manifest
+
+
+def write_corpus(codes, path):
+    """
+    Append every distinct bytecode to the packed corpus at path, named by
+    address. Returns the address -> sha256 mapping.
+    """
+    with CorpusWriter(path) as writer:
+        return {address: writer.add(code, address)
+                for address, code in codes.items()}
+
+
+def ingest(addresses, output_dir, url=DEFAULT_RPC_URL, corpus=False,
+           **kwargs):
+    codes = fetch_code(addresses, url, **kwargs)
+    if corpus:
+        return write_corpus(codes, output_dir)
+    return write_evm_files(codes, output_dir)
+
+
+def read_address_list(filename):
+    with open(filename, "r") as f:
+        return [line.split("#")[0].strip() for line in f
+                if line.split("#")[0].strip()]
+
+
+if 'binaryninja' in sys.modules:
+    class IngestThread(BackgroundTaskThread):
+        def __init__(self, addresses, output_dir, url):
+            BackgroundTaskThread.__init__(self, "Fetching bytecode...", False)
+            self.addresses = addresses
+            self.output_dir = output_dir
+            self.url = url
+
+        def run(self):
+            try:
+                ingest(self.addresses, self.output_dir, self.url)
+            except Exception as e:
+                log_error("bytecode ingestion failed, reason ({}): {}".format(
+                    type(e), e))
+
+    def ingest_bn(bv):
+        url = get_text_line_input("JSON-RPC url", "Fetch bytecode")
+        if not url:
+            return
+        url = url.decode("utf-8") if isinstance(url, bytes) else url
+        addresses = get_text_line_input("Addresses (comma separated)",
+                                        "Fetch bytecode")
+        if not addresses:
+            return
+        addresses = addresses.decode("utf-8") if isinstance(
+            addresses, bytes) else addresses
+        output_dir = get_directory_name_input("Output directory")
+        if not output_dir:
+            return
+        output_dir = output_dir.decode("utf-8") if isinstance(
+            output_dir, bytes) else output_dir
+
+        t = IngestThread(
+            [a for a in addresses.replace(" ", ",").split(",") if a],
+            output_dir, url)
+        t.start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fetch contract bytecode over JSON-RPC into .evm files")
+    parser.add_argument("addresses",
+                        help="file with one address per line")
+    parser.add_argument("output_dir")
+    parser.add_argument("--rpc", default=DEFAULT_RPC_URL)
+    parser.add_argument("--block", default="latest")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int,
+                        default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--corpus", action="store_true",
+                        help="append to a packed corpus in output_dir "
+                        "instead of writing .evm files")
+    args = parser.parse_args(argv)
+
+    ingest(read_address_list(args.addresses), args.output_dir, args.rpc,
+           corpus=args.corpus, block=args.block, batch_size=args.batch_size,
+           concurrency=args.concurrency)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Internal functions as functions of their own.
+
+core.internal finds the functions solc calls by jumping with a return
+address on the stack. The EVM architecture lifts their call sites as calls
+and the jumps back as returns, so Binary Ninja analyzes each one once instead
+of inlining it into every caller. What was found is kept per open view, and
+dropped with it. The lifter looks it up through the function it lifts;
+get_instruction_info is only given the bytes at an address, so it checks
+the open views whose bytes match, and treats a jump the views disagree on
+as a plain jump.
+"""
+import weakref
+import threading
+from collections import namedtuple
+
+from binaryninja import Symbol, SymbolType
+
+from .core.cfg import view_address
+from .core.internal import find_internal_functions
+
+_lock = threading.Lock()
+# view -> Recovered of the open views
+_recovered = weakref.WeakKeyDictionary()
+
+# functions: {entry: InternalFunction}, calls: {jump pc: CallSite},
+# returns: pcs of the jumps returning from them
+Recovered = namedtuple('Recovered', ['code', 'functions', 'calls',
+                                     'returns'])
+
+
+def recover(code):
+    """The internal functions of code Binary Ninja can treat as functions:
+    it goes on after a call at the next instruction, so calls that return
+    elsewhere stay jumps."""
+    code = bytes(code)
+    functions, calls = find_internal_functions(code)
+    calls = dict((pc, site) for pc, site in calls.items()
+                 if site.ret == pc + 1)
+    called = set(site.entry for site in calls.values())
+    functions = dict((entry, function)
+                     for entry, function in functions.items()
+                     if entry in called)
+    returns = frozenset(pc for function in functions.values()
+                        for pc in function.returns)
+    return Recovered(code, functions, calls, returns)
+
+
+def register(view, code):
+    """Recover the internal functions of code, the data of view, for the
+    architecture and view.session_data['internal']."""
+    recovered = recover(code)
+    with _lock:
+        _recovered[view] = recovered
+    view.session_data['internal'] = recovered
+    return recovered
+
+
+def _candidates(data, addr, view):
+    """The Recovered the jump at addr, whose bytes start data, is looked up
+    in: view's, or without one, those of the open views with these bytes
+    at addr."""
+    with _lock:
+        if view is not None:
+            recovered = _recovered.get(view)
+            return [recovered] if recovered is not None else []
+        candidates = list(_recovered.values())
+    data = bytes(data)
+    return [recovered for recovered in candidates
+            if recovered.code[addr:addr + len(data)] == data]
+
+
+def call_at(data, addr, view=None):
+    """The CallSite of the JUMP at addr whose bytes start data, if it is a
+    call in view, or in every open view with these bytes."""
+    sites = set(recovered.calls.get(addr)
+                for recovered in _candidates(data, addr, view))
+    return sites.pop() if len(sites) == 1 else None
+
+
+def is_return(data, addr, view=None):
+    found = set(addr in recovered.returns
+                for recovered in _candidates(data, addr, view))
+    return found == {True}
+
+
+def define_functions(view, recovered):
+    """Add the internal functions view does not have yet. Returns the number
+    added."""
+    added = 0
+    for entry in sorted(recovered.functions):
+        address = view_address(entry)
+        if view.get_function_at(address) is not None:
+            continue
+        view.define_auto_symbol(Symbol(SymbolType.FunctionSymbol, address,
+                                       'internal_{:#x}'.format(entry)))
+        view.add_function(address)
+        added += 1
+    return added
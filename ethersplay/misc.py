@@ -1,6 +1,7 @@
 import os
 
-from binaryninja import log_error, get_save_filename_input, log_info
+from binaryninja import (log_error, get_save_filename_input, log_info,
+                         BinaryView, BinaryViewType)
 
 from .common import ADDR_SIZE as ADDR_SZ
 
@@ -70,3 +71,15 @@ def dump_codecopy_data(bv, address):
 
     log_error("Couldn't find function to resolve stack slots!")
     return None
+
+
+def open_bytes_view(code):
+    """
+    Open code as an EVMView without going through a file. Binary Ninja keeps
+    its own copy of the data, so this is where a memoryview gets copied.
+    """
+    raw = BinaryView.new(bytes(code))
+    view = BinaryViewType['EVM'].create(raw)
+    if view is not None:
+        view.update_analysis_and_wait()
+    return view
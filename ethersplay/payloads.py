@@ -0,0 +1,40 @@
+from binaryninja import log_info, log_error, BackgroundTaskThread
+
+from .core.payloads import find_payloads, write_payloads
+
+
+def annotate_payloads(view, payloads):
+    for payload in payloads:
+        comment = 'CODECOPY payload {}\n{}'.format(
+            payload.hash[:16],
+            '\n'.join('[{:#x}, {:#x})'.format(o, o + s)
+                      for o, s in payload.ranges))
+        for pc in payload.sites:
+            for function in view.get_functions_containing(pc):
+                function.set_comment_at(pc, comment)
+        for offset, _ in payload.ranges:
+            view.set_comment_at(offset, 'payload {} ({} bytes)'.format(
+                payload.hash[:16], len(payload.data)))
+
+
+class PayloadThread(BackgroundTaskThread):
+    def __init__(self, view):
+        BackgroundTaskThread.__init__(self, 'Extracting CODECOPY payloads...',
+                                      False)
+        self.view = view
+
+    def run(self):
+        payloads = self.view.session_data.get('payloads')
+        if payloads is None:
+            payloads = find_payloads(self.view.read(0, len(self.view)))
+        if not payloads:
+            log_error('no CODECOPY with constant arguments found')
+            return
+        annotate_payloads(self.view, payloads)
+        output_dir = self.view.file.filename + '_payloads'
+        written = write_payloads(payloads, output_dir)
+        log_info('wrote {} payloads to {}'.format(len(written), output_dir))
+
+
+def extract_payloads_bn(view):
+    PayloadThread(view).start()
@@ -0,0 +1,224 @@
+from binaryninja import PluginCommand, Architecture
+
+from .coverage import function_coverage_start
+from .evm import EVM, EVMView
+from .flowgraph import render_flowgraphs
+from .annotator import annotate_all
+from .lookup4byte import (rename_all_functions, lookup_one_inst,
+                          update_cache_bn, lookup_all_push4,
+                          lookup_all_push_view)
+from .misc import dump_codecopy_data
+from .ingest import ingest_bn
+from .fingerprint import index_view_bn, apply_view_bn
+from .diff import mark_old_view, diff_against_marked
+from .payloads import extract_payloads_bn
+from .storage import storage_index_bn
+from .gas import gas_heat_map_bn
+from .sourcemap import import_source_map_bn
+from .export import export_view_bn
+from .calls import call_graph_bn
+from .trace import import_trace_bn
+from .snapshot import save_snapshot_bn
+from .budget import show_summary_bn
+from .graphs import export_graphs_bn
+from .search import search_bn, index_view_bn as search_index_view_bn
+from .profiling import (profiled, start_profiling_bn, profile_report_bn,
+                        stop_profiling_bn)
+
+def is_valid_evm(view, function=None):
+    return view.arch == Architecture['EVM']
+
+
+PluginCommand.register(
+    r"Ethersplay\Manticore Highlight",
+    "EVM Manticore Highlight",
+    profiled(function_coverage_start),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    r'Ethersplay\Render Flowgraphs',
+    'Render flowgraphs of every function, removing stack variable annotations',
+    profiled(render_flowgraphs),
+    is_valid=is_valid_evm)
+
+# non-upstream things
+PluginCommand.register(
+    "Ethersplay-contrib\\Annotate Instructions",
+    "[EVM] Annotate Instructions",
+    profiled(annotate_all),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay-4byte\\Rename functions",
+    "Perform lookup of all hash signatures on 4byte.directory to rename unknown functions",
+    profiled(rename_all_functions),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay-4byte\\update cashed function hashes",
+    "Re-do lookup of all hash signatures on 4byte.directory, which are stored in the local cache.",
+    profiled(update_cache_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register_for_address(
+    "Ethersplay-4byte\\Lookup 4byte hash",
+    "Perform lookup of one hash signature on 4byte.directory",
+    profiled(lookup_one_inst),
+    is_valid=is_valid_evm)
+
+PluginCommand.register_for_function(
+    "Ethersplay-4byte\\Lookup 4byte hash for all PUSH4",
+    "Perform lookup of one hash signature on 4byte.directory",
+    profiled(lookup_all_push4),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay-4byte\\Lookup all selectors and event topics",
+    "Resolve every PUSH4/PUSH32 selector, error selector and event topic in "
+    "one batch",
+    profiled(lookup_all_push_view),
+    is_valid=is_valid_evm)
+
+PluginCommand.register_for_address(
+    "Ethersplay\\Lookup 4byte hash (4byte.directory)",
+    "Perform lookup of one hash signature on 4byte.directory",
+    profiled(lookup_one_inst),
+    is_valid=is_valid_evm)
+
+PluginCommand.register_for_address(
+    "Ethersplay-contrib\\Dump CODECOPY to file",
+    "Dump the result of a codecopy to a file",
+    profiled(dump_codecopy_data),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Fetch bytecode over JSON-RPC",
+    "Fetch the code of a list of addresses with eth_getCode into .evm files",
+    profiled(ingest_bn))
+
+PluginCommand.register(
+    "Ethersplay-fingerprint\\Add named functions to index",
+    "Store fingerprints of all named functions for propagating their names",
+    profiled(index_view_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay-fingerprint\\Apply names from index",
+    "Rename unnamed functions that are similar to indexed functions",
+    profiled(apply_view_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay-diff\\Mark as old version",
+    "Use this view as the old version for the next diff",
+    profiled(mark_old_view),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay-diff\\Diff against old version",
+    "Match functions with the marked view and highlight what changed",
+    profiled(diff_against_marked),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Extract CODECOPY payloads",
+    "Comment every constant CODECOPY and write the copied code as .evm files",
+    profiled(extract_payloads_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Index storage accesses",
+    "Map constant and mapping storage slots to the functions reading and "
+    "writing them",
+    profiled(storage_index_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Gas heat map",
+    "Highlight basic blocks by static gas cost and rank functions by their "
+    "worst-case path",
+    profiled(gas_heat_map_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Import solc source map",
+    "Comment instructions with their source lines from solc --combined-json "
+    "or --asm-json output",
+    profiled(import_source_map_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Export to SQLite",
+    "Store functions, blocks, edges, comments, selectors and storage "
+    "accesses in a SQLite database",
+    profiled(export_view_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay-search\\Add to search index",
+    "Add this view's instructions and functions to the opcode sequence "
+    "search index",
+    profiled(search_index_view_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay-search\\Search opcode sequence",
+    "Find an opcode sequence such as 'CALLER SLOAD' or 'PUSH* ? EQ' in all "
+    "indexed contracts",
+    profiled(search_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Index external calls",
+    "Comment calls to constant addresses with their selector and add them to "
+    "the cross-contract call graph",
+    profiled(call_graph_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Import struct-log trace",
+    "Highlight instructions executed in a debug_traceTransaction trace by "
+    "hit count and comment the stack values they saw",
+    profiled(import_trace_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Export CFGs",
+    "Write the control flow graphs of all functions as DOT, GraphML or JSON "
+    "without laying them out",
+    profiled(export_graphs_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Save analysis snapshot",
+    "Store names, comments, indirect branches, highlights and selector "
+    "names so reopening this bytecode skips the CFG, VSA and lookups",
+    profiled(save_snapshot_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay\\Show degraded functions",
+    "List the functions whose branch resolution or annotation ran out of "
+    "time and was cut short",
+    profiled(show_summary_bn),
+    is_valid=is_valid_evm)
+
+PluginCommand.register(
+    "Ethersplay-profile\\Start profiling",
+    "Count calls, time and cache hits of the plugin's hot paths, optionally "
+    "with cProfile captures of every command",
+    start_profiling_bn)
+
+PluginCommand.register(
+    "Ethersplay-profile\\Show report",
+    "Log the calls, time and cache hit rates counted since profiling started",
+    profile_report_bn)
+
+PluginCommand.register(
+    "Ethersplay-profile\\Stop profiling",
+    "Show the report and remove the instrumentation",
+    stop_profiling_bn)
+
+
+EVM.register()
+EVMView.register()
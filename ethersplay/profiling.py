@@ -0,0 +1,334 @@
+"""
+Opt-in instrumentation of the plugin's hot paths.
+
+Nothing is wrapped until enable() is called: it replaces the probed
+functions and methods (see _probes) with timing wrappers and puts the
+originals back on disable(), so there is no overhead while profiling is
+off. Plugin commands are registered through profiled(), which only checks a
+flag when profiling is off; it and the run() of the commands' background
+threads are captured with cProfile if enable() got a profile_dir. The core
+counts cache hits here too, so binaryninja is only imported where needed.
+
+Counters are kept in the session_data of the view a call is made for, found
+in its arguments or inherited from the probed call it is nested in; calls
+made for no view, e.g. architecture callbacks on the core's analysis
+threads, are counted for all views.
+
+    from ethersplay import profiling
+    profiling.enable(profile_dir='/tmp/prof')
+    ...
+    print(profiling.format_report(profiling.report(view)))
+"""
+import os
+import json
+import time
+import cProfile
+import threading
+
+from .core.log import log_info
+
+_lock = threading.Lock()
+# view of the probed call the current thread is in
+_local = threading.local()
+_enabled = False
+_started = None
+_profile_dir = None
+_profiles = []
+# counters of views are only valid for the generation they were started in
+_generation = 0
+# name -> [calls, seconds], of calls made for no view
+_calls = {}
+# name -> [hits, misses]
+_caches = {}
+# (owner, attribute, original) of the wrapped probes
+_patched = []
+
+
+def _probes():
+    """(owner, attribute, name) of everything timed while enabled."""
+    from binaryninja import Function
+
+    from . import analysis, annotator, coverage, evm
+    from .core import emulate, selectors
+
+    return [
+        (evm, 'disassemble_one', 'disassemble_one'),
+        (evm, 'CFG', 'CFG construction'),
+        (evm.EVM, 'get_instruction_info', 'EVM.get_instruction_info'),
+        (evm.EVM, 'get_instruction_text', 'EVM.get_instruction_text'),
+        (evm.EVM, 'get_instruction_low_level_il',
+         'EVM.get_instruction_low_level_il'),
+        (evm.EVMView, 'init', 'EVMView.init'),
+        (analysis, 'run_vsa', 'run_vsa'),
+        (emulate.Emulator, 'explore', 'Emulator.explore'),
+        (analysis, 'update_cfg', 'update_cfg'),
+        (analysis, 'reanalyze_patches', 'reanalyze_patches'),
+        (Function, 'set_user_indirect_branches',
+         'Function.set_user_indirect_branches'),
+        (Function, 'get_reg_value_at', 'Function.get_reg_value_at'),
+        (Function, 'get_stack_contents_at', 'Function.get_stack_contents_at'),
+        (annotator, 'annotate', 'annotate'),
+        (selectors, '_get', '4byte.directory request'),
+        (selectors, 'lookup_hash', 'lookup_hash'),
+        (selectors, 'resolve_hashes', 'resolve_hashes'),
+        (coverage.GraphColorer, 'color', 'GraphColorer.color'),
+        (coverage.GraphColorer, 'color_at', 'GraphColorer.color_at'),
+    ]
+
+
+def _command_threads():
+    """Background threads of plugin commands, their run() is profiled()."""
+    from . import (analysis, calls, diff, export, fingerprint, gas, graphs,
+                   ingest, lookup4byte, payloads, search, snapshot,
+                   sourcemap, storage, trace)
+
+    return [analysis.PatchTaskThread, calls.CallGraphThread,
+            diff.DiffThread, export.ExportThread,
+            fingerprint.FingerprintThread, gas.GasThread,
+            graphs.GraphExportThread, ingest.IngestThread,
+            lookup4byte.PushLookupThread, lookup4byte.CacheUpdateThread,
+            payloads.PayloadThread, search.SearchThread, snapshot.SnapshotThread,
+            sourcemap.SourceMapThread, storage.StorageIndexThread,
+            trace.TraceImportThread]
+
+
+def _counters(view):
+    """(calls, caches) of view, those of calls made for no view if None."""
+    if view is None:
+        return _calls, _caches
+    entry = view.session_data.get('profiling')
+    if entry is None or entry[0] != _generation:
+        entry = view.session_data['profiling'] = (_generation, {}, {})
+    return entry[1], entry[2]
+
+
+def _view_of(args):
+    """The view a probed call is made for: a view argument, the view of a
+    function, thread or colorer argument, else the view of the probed call
+    it is nested in."""
+    for arg in args[:2]:
+        if hasattr(arg, 'session_data'):
+            return arg
+        view = getattr(arg, 'view', None)
+        if hasattr(view, 'session_data'):
+            return view
+    return getattr(_local, 'view', None)
+
+
+def _record(name, elapsed, view):
+    with _lock:
+        calls, _ = _counters(view)
+        entry = calls.get(name)
+        if entry is None:
+            entry = calls[name] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+def _timed(function, name):
+    def wrapper(*args, **kwargs):
+        outer = getattr(_local, 'view', None)
+        _local.view = view = _view_of(args)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _record(name, time.perf_counter() - start, view)
+            _local.view = outer
+    wrapper.__name__ = getattr(function, '__name__', name)
+    wrapper.__doc__ = getattr(function, '__doc__', None)
+    return wrapper
+
+
+def cache(name, hit):
+    """Count a hit or miss of the cache called name."""
+    if not _enabled:
+        return
+    with _lock:
+        _, caches = _counters(getattr(_local, 'view', None))
+        entry = caches.get(name)
+        if entry is None:
+            entry = caches[name] = [0, 0]
+        entry[0 if hit else 1] += 1
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    global _generation
+    with _lock:
+        _generation += 1
+        _calls.clear()
+        _caches.clear()
+        del _profiles[:]
+
+
+def enable(profile_dir=None):
+    """
+    Start counting from zero. With profile_dir, every plugin command also
+    writes a cProfile capture there.
+    """
+    global _enabled, _started, _profile_dir
+    if _enabled:
+        disable()
+    reset()
+    for owner, attribute, name in _probes():
+        # class attributes are looked up in the class' own namespace so
+        # that restoring them does not turn inherited methods into overrides
+        original = (vars(owner)[attribute] if isinstance(owner, type)
+                    else getattr(owner, attribute))
+        _patched.append((owner, attribute, original))
+        setattr(owner, attribute, _timed(original, name))
+    for thread in _command_threads():
+        original = vars(thread)['run']
+        _patched.append((thread, 'run', original))
+        thread.run = profiled(original, thread.__name__ + '.run')
+    _profile_dir = profile_dir
+    _started = time.time()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    while _patched:
+        owner, attribute, original = _patched.pop()
+        setattr(owner, attribute, original)
+
+
+def _capture(name, function, args, kwargs):
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # another profiler is active, e.g. a command running concurrently
+        return function(*args, **kwargs)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profile.disable()
+        with _lock:
+            filename = os.path.join(_profile_dir, '{}-{}.prof'.format(
+                name, len(_profiles)))
+            _profiles.append(filename)
+        profile.dump_stats(filename)
+
+
+def profiled(function, name=None):
+    """Wrap a plugin command or thread run() to be timed, and captured with
+    cProfile, while profiling is enabled."""
+    name = name or function.__name__
+
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        outer = getattr(_local, 'view', None)
+        _local.view = view = _view_of(args)
+        start = time.perf_counter()
+        try:
+            if _profile_dir:
+                return _capture(name, function, args, kwargs)
+            return function(*args, **kwargs)
+        finally:
+            _record(name, time.perf_counter() - start, view)
+            _local.view = outer
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+
+def _summary(calls, caches):
+    return {
+        'calls': dict((name, {'calls': count, 'seconds': seconds,
+                              'mean': seconds / count if count else 0.0})
+                      for name, (count, seconds) in calls.items()),
+        'caches': dict((name, {'hits': hits, 'misses': misses,
+                               'hit_rate': (float(hits) / (hits + misses)
+                                            if hits + misses else 0.0)})
+                       for name, (hits, misses) in caches.items()),
+    }
+
+
+def report(view=None):
+    """
+    Counters collected since enable() for view, and under 'shared' those of
+    calls made for no view. Without a view, only the latter.
+    """
+    with _lock:
+        rv = _summary(_calls, _caches)
+        if view is not None:
+            shared = rv
+            rv = _summary(*_counters(view))
+            rv['shared'] = shared
+        profiles = list(_profiles)
+    rv.update({
+        'enabled': _enabled,
+        'elapsed': time.time() - _started if _started else 0.0,
+        'profiles': profiles,
+    })
+    if view is not None:
+        rv['view'] = {'filename': view.file.filename, 'size': len(view),
+                      'functions': len(view.functions)}
+    return rv
+
+
+def _format_counters(lines, rv):
+    lines.append('{:48} {:>10} {:>12} {:>12}'.format(
+        'call', 'count', 'seconds', 'mean (us)'))
+    for name, entry in sorted(rv['calls'].items(),
+                              key=lambda item: -item[1]['seconds']):
+        lines.append('{:48} {:>10} {:>12.4f} {:>12.1f}'.format(
+            name, entry['calls'], entry['seconds'], entry['mean'] * 1e6))
+    for name, entry in sorted(rv['caches'].items()):
+        lines.append('cache {:42} {:>10} hits {:>8} misses ({:.0%})'.format(
+            name, entry['hits'], entry['misses'], entry['hit_rate']))
+
+
+def format_report(rv):
+    lines = []
+    if 'view' in rv:
+        lines.append('{filename}: {size} bytes, {functions} functions'.format(
+            **rv['view']))
+    _format_counters(lines, rv)
+    if 'shared' in rv:
+        lines.append('calls for no view, shared by all views:')
+        _format_counters(lines, rv['shared'])
+    for filename in rv['profiles']:
+        lines.append('cProfile: ' + filename)
+    return '\n'.join(lines)
+
+
+def dump_report(view, filename):
+    with open(filename, 'w') as f:
+        json.dump(report(view), f, indent=1, sort_keys=True)
+
+
+def start_profiling_bn(view):
+    from binaryninja import get_directory_name_input
+
+    profile_dir = get_directory_name_input(
+        'Directory for cProfile captures of commands (cancel for counters '
+        'only)')
+    if isinstance(profile_dir, bytes):
+        profile_dir = profile_dir.decode('utf-8')
+    enable(profile_dir or None)
+    log_info('profiling enabled{}'.format(
+        ', cProfile captures in ' + profile_dir if profile_dir else ''))
+
+
+def profile_report_bn(view):
+    from binaryninja import get_save_filename_input
+
+    log_info(format_report(report(view)))
+    filename = get_save_filename_input('Save profile report as JSON?', 'json')
+    if isinstance(filename, bytes):
+        filename = filename.decode('utf-8')
+    if filename:
+        dump_report(view, filename)
+
+
+def stop_profiling_bn(view):
+    profile_report_bn(view)
+    disable()
@@ -0,0 +1,116 @@
+import re
+import sys
+import json
+import argparse
+from collections import namedtuple
+
+ProxyInfo = namedtuple(
+    'ProxyInfo', ['kind', 'implementation', 'slot', 'skip_analysis'])
+
+
+def _stub(prefix, suffix, tail=b''):
+    return re.compile(
+        b'^' + re.escape(bytes.fromhex(prefix)) + b'([\x60-\x73])(.+?)' +
+        re.escape(bytes.fromhex(suffix)) + tail, re.DOTALL)
+
+
+# stubs whose whole runtime is known, the implementation address is inlined
+# as PUSH1-PUSH20 (shorter pushes are used for vanity addresses)
+_STUB_PATTERNS = [
+    ('EIP-1167 minimal proxy',
+     _stub('363d3d373d3d3d363d', '5af43d82803e903d9160',
+           b'.' + re.escape(bytes.fromhex('57fd5bf3')) + b'$')),
+    # followed by arbitrary metadata
+    ('EIP-3448 meta proxy',
+     _stub('363d3d373d3d3d3d60368038038091363936013d',
+           '5af43d3d93803e603457fd5bf3')),
+]
+
+# proxies that load their implementation from a well-known storage slot
+_SLOTS = [
+    ('EIP-1967 proxy',
+     '360894a13ba1a3210667c828492db98dca3e2076cc3735a920a3ca505d382bbc'),
+    ('EIP-1967 beacon proxy',
+     'a3f0ad74e5423aebfd80d3ef4346578335a9a72aeaee59ff6cb3582b35133d50'),
+    ('EIP-1822 UUPS proxy',
+     'c5f16f0fcc639fa48a6947836d9850f504798523bf8c9a3a87d5876cf622bcf7'),
+    ('OpenZeppelin legacy proxy',
+     '7050c9e0f4ca769c69bd3a8ef740bc37934f8e2c036e5a723fd8ee048ed3f8c3'),
+]
+
+EIP1967_ADMIN_SLOT = (
+    'b53127684a568b3173ae13b9f8a6016e243e63b6e8ee1178d6a717850b5d6103')
+
+# masterCopy() selector, pushed left aligned by the Gnosis Safe proxy
+_GNOSIS_MASTER_COPY = b'\x7f\xa6\x19\x48\x6e' + b'\x00' * 28
+
+DELEGATECALL = 0xf4
+
+# slot based proxies up to this size are only a fallback and an upgrade
+# function or two, analyzing them is not worth it
+SMALL_PROXY_SIZE = 512
+
+
+def _delegatecall_count(code):
+    # cheap and not push-data aware, only used together with a slot match
+    return code.count(bytes([DELEGATECALL]))
+
+
+def classify(code):
+    """
+    Recognize minimal proxies and well-known proxy patterns from their bytes
+    alone. Returns a ProxyInfo or None.
+    """
+    code = bytes(code)
+
+    for kind, pattern in _STUB_PATTERNS:
+        m = pattern.match(code)
+        if m is not None:
+            size = m.group(1)[0] - 0x5f
+            address = m.group(2)
+            if len(address) == size:
+                return ProxyInfo(kind, '0x' + address.rjust(20, b'\x00').hex(),
+                                 None, True)
+
+    if not _delegatecall_count(code):
+        return None
+
+    small = len(code) <= SMALL_PROXY_SIZE
+    for kind, slot in _SLOTS:
+        if b'\x7f' + bytes.fromhex(slot) in code:
+            if (kind == 'EIP-1967 proxy' and
+                    b'\x7f' + bytes.fromhex(EIP1967_ADMIN_SLOT) in code):
+                kind = 'EIP-1967 transparent proxy'
+            return ProxyInfo(kind, None, '0x' + slot, small)
+
+    if _GNOSIS_MASTER_COPY in code:
+        return ProxyInfo('Gnosis Safe proxy', None, '0x' + '00' * 32, small)
+
+    return None
+
+
+def describe(info):
+    text = info.kind
+    if info.implementation:
+        text += "\nimplementation: " + info.implementation
+    if info.slot:
+        text += "\nimplementation slot: " + info.slot
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Classify .evm files as proxies without building a CFG")
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args(argv)
+
+    for filename in args.files:
+        with open(filename, "rb") as f:
+            info = classify(f.read())
+        print(json.dumps({"file": filename,
+                          "proxy": info._asdict() if info else None}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,525 @@
+"""
+Opcode sequence search over many contracts.
+
+Contracts are decoded with push data skipped and every run of one up to
+NGRAM_SIZE opcodes is recorded in an inverted index (SQLite), so a query
+only looks at the positions of its rarest n-gram instead of scanning every
+contract. Queries are opcode names separated by spaces:
+
+    CALLER SLOAD            exact sequence
+    PUSH* SLOAD             any PUSH width (also DUP*, SWAP*, LOG*)
+    CALLER ? EQ             ? is any single instruction
+    SLOAD|TLOAD ISZERO      alternatives
+
+The index of a corpus lives next to it as search.sqlite and only the entries
+added since the last run are indexed.
+"""
+import os
+import re
+import sys
+import sqlite3
+import argparse
+import itertools
+import multiprocessing
+from array import array
+from collections import namedtuple
+
+from evm_cfg_builder.cfg import CFG
+
+from .common import code_hash
+from .corpus import Corpus
+from .core.cfg import view_address
+from .core.log import log_info, log_error
+from .decode import decode
+from .proxy import classify
+
+# the commands are only defined inside Binary Ninja, the CLI does not load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import BackgroundTaskThread
+    from binaryninja.interaction import get_text_line_input
+
+SEARCH_PATH = os.path.expanduser("~/.ethersplay")
+SEARCH_DB = os.path.join(SEARCH_PATH, "search.sqlite")
+CORPUS_INDEX_NAME = "search.sqlite"
+
+NGRAM_SIZE = 3
+# PRAGMA user_version of the index, older ones only have NGRAM_SIZE-grams
+SCHEMA_VERSION = 1
+# queries whose windows all expand to more n-grams than this are answered
+# by scanning the stored opcodes
+MAX_EXPANSION = 256
+INDEX_CHUNK_SIZE = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contracts (
+    id INTEGER PRIMARY KEY,
+    hash TEXT UNIQUE NOT NULL,
+    name TEXT,
+    ops BLOB NOT NULL,
+    pcs BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS grams (
+    gram INTEGER NOT NULL,
+    contract_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    positions BLOB NOT NULL,
+    PRIMARY KEY (gram, contract_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS function_blocks (
+    contract_id INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    address INTEGER NOT NULL,
+    name TEXT
+);
+CREATE INDEX IF NOT EXISTS function_blocks_lookup
+    ON function_blocks (contract_id, start);
+"""
+
+Hit = namedtuple('Hit', ['contract', 'name', 'address', 'functions'])
+
+
+def _opcode_names():
+    names = {}
+    for opcode in range(256):
+        name = decode(bytes([opcode]))[0].name
+        names.setdefault(name, set()).add(opcode)
+    return names
+
+
+_OPCODES = _opcode_names()
+
+
+def parse_query(query):
+    """Return the set of matching opcodes for every instruction of query."""
+    tokens = []
+    for word in query.upper().split():
+        if word == '?':
+            tokens.append(frozenset(range(256)))
+            continue
+        opcodes = set()
+        for alternative in word.split('|'):
+            if alternative.endswith('*'):
+                matches = [ops for name, ops in _OPCODES.items()
+                           if name.startswith(alternative[:-1])]
+            else:
+                matches = [_OPCODES.get(alternative, ())]
+            if not any(matches):
+                raise ValueError("unknown instruction '{}'".format(
+                    alternative))
+            for ops in matches:
+                opcodes.update(ops)
+        tokens.append(frozenset(opcodes))
+    if not tokens:
+        raise ValueError("empty query")
+    return tokens
+
+
+def _pattern(tokens):
+    # a lookahead, so finditer also reports overlapping matches
+    body = b''.join(
+        b'.' if len(ops) == 256 else
+        b'[' + b''.join(re.escape(bytes([o])) for o in sorted(ops)) + b']'
+        for ops in tokens)
+    return re.compile(b'(?=' + body + b')', re.DOTALL)
+
+
+def _gram(ops):
+    gram = int.from_bytes(bytes(ops), 'big')
+    # shorter n-grams are tagged with their size, so they don't collide with
+    # the NGRAM_SIZE-grams that start with STOPs
+    if len(ops) < NGRAM_SIZE:
+        gram |= len(ops) << (8 * NGRAM_SIZE)
+    return gram
+
+
+def _grams(ops, sizes=range(1, NGRAM_SIZE + 1)):
+    """{n-gram: positions} of the n-grams of ops of the given sizes."""
+    grams = {}
+    for n in sizes:
+        for i in range(len(ops) - n + 1):
+            grams.setdefault(_gram(ops[i:i + n]), []).append(i)
+    return grams
+
+
+def _windows(tokens):
+    """(offset, n-grams) of every query window, NGRAM_SIZE instructions or
+    all of a shorter query, that expands to at most MAX_EXPANSION n-grams."""
+    n = min(NGRAM_SIZE, len(tokens))
+    for i in range(len(tokens) - n + 1):
+        window = tokens[i:i + n]
+        size = 1
+        for ops in window:
+            size *= len(ops)
+        if size <= MAX_EXPANSION:
+            yield i, [_gram(g) for g in itertools.product(*window)]
+
+
+def _pack(values):
+    a = array('I', values)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tobytes()
+
+
+def _unpack(blob):
+    a = array('I')
+    a.frombytes(blob)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+def extract_search(code, functions=()):
+    """
+    Everything SearchIndex.write stores for one contract: the opcodes and
+    pcs of its instructions, the positions of its n-grams and the (start,
+    end, address, name) of the blocks of functions, given as (address,
+    name, [(start, end)]).
+    """
+    instructions = decode(code)
+    ops = bytes(ins.opcode for ins in instructions)
+    grams = _grams(ops)
+    return {
+        'hash': code_hash(bytes(code)),
+        'ops': ops,
+        'pcs': _pack(ins.pc for ins in instructions),
+        'grams': [(gram, len(positions), _pack(positions))
+                  for gram, positions in grams.items()],
+        'blocks': [(start, end, address, name)
+                   for address, name, blocks in functions
+                   for start, end in blocks],
+    }
+
+
+def cfg_functions(cfg):
+    for function in cfg.functions:
+        yield (view_address(function.start_addr), function.name,
+               [(bb.start.pc, bb.end.pc + bb.end.size)
+                for bb in function.basic_blocks])
+
+
+def view_functions(view):
+    for function in view.functions:
+        yield (function.start, function.name,
+               [(bb.start, bb.end) for bb in function.basic_blocks])
+
+
+def extract_code(code, with_functions=True):
+    """extract_search for bytecode without a view, with the functions of its
+    CFG unless it is a proxy whose analysis would be skipped."""
+    functions = ()
+    if with_functions:
+        proxy = classify(code)
+        if proxy is None or not proxy.skip_analysis:
+            functions = list(cfg_functions(CFG(bytes(code))))
+    return extract_search(code, functions)
+
+
+class SearchIndex(object):
+    def __init__(self, filename=SEARCH_DB):
+        dir_name = os.path.dirname(filename)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+        self._ops = {}
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < \
+                SCHEMA_VERSION:
+            self._upgrade()
+
+    def _upgrade(self):
+        """Add the n-grams shorter than NGRAM_SIZE of the contracts indexed
+        before they were."""
+        with self.db:
+            for contract_id, ops in self.db.execute(
+                    "SELECT id, ops FROM contracts").fetchall():
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO grams VALUES (?, ?, ?, ?)",
+                    [(gram, contract_id, len(positions), _pack(positions))
+                     for gram, positions in _grams(
+                         ops, range(1, NGRAM_SIZE)).items()])
+            self.db.execute("PRAGMA user_version = {}".format(
+                SCHEMA_VERSION))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM contracts").fetchone()[0]
+
+    def __contains__(self, contract):
+        return self.db.execute("SELECT 1 FROM contracts WHERE hash = ?",
+                               (contract,)).fetchone() is not None
+
+    def hashes(self):
+        return {row[0] for row in
+                self.db.execute("SELECT hash FROM contracts")}
+
+    def write(self, record, name=None):
+        """Store a record of extract_search, replacing the contract's rows
+        if it was indexed before."""
+        with self.db:
+            row = self.db.execute("SELECT id FROM contracts WHERE hash = ?",
+                                  (record['hash'],)).fetchone()
+            if row is not None:
+                for table in ('grams', 'function_blocks'):
+                    self.db.execute(
+                        "DELETE FROM {} WHERE contract_id = ?".format(table),
+                        row)
+                self.db.execute("DELETE FROM contracts WHERE id = ?", row)
+                self._ops.pop(row[0], None)
+            contract_id = self.db.execute(
+                "INSERT INTO contracts (hash, name, ops, pcs) "
+                "VALUES (?, ?, ?, ?)",
+                (record['hash'], name, record['ops'],
+                 record['pcs'])).lastrowid
+            self.db.executemany(
+                "INSERT INTO grams VALUES (?, ?, ?, ?)",
+                [(gram, contract_id, count, positions)
+                 for gram, count, positions in record['grams']])
+            self.db.executemany(
+                "INSERT INTO function_blocks VALUES (?, ?, ?, ?, ?)",
+                [(contract_id,) + block for block in record['blocks']])
+        return contract_id
+
+    def _contract_ops(self, contract_id):
+        ops = self._ops.get(contract_id)
+        if ops is None:
+            ops = self._ops[contract_id] = self.db.execute(
+                "SELECT ops FROM contracts WHERE id = ?",
+                (contract_id,)).fetchone()[0]
+        return ops
+
+    def _candidates(self, tokens):
+        """
+        {contract_id: candidate positions} from the cheapest query window,
+        or None if no window can be looked up in the n-gram index.
+        """
+        best = None
+        for offset, grams in _windows(tokens):
+            marks = ",".join("?" * len(grams))
+            cost = self.db.execute(
+                "SELECT COALESCE(SUM(count), 0) FROM grams "
+                "WHERE gram IN ({})".format(marks), grams).fetchone()[0]
+            if best is None or cost < best[0]:
+                best = (cost, offset, grams, marks)
+        if best is None:
+            return None
+        _, offset, grams, marks = best
+        rv = {}
+        for contract_id, positions in self.db.execute(
+                "SELECT contract_id, positions FROM grams "
+                "WHERE gram IN ({})".format(marks), grams):
+            rv.setdefault(contract_id, []).extend(
+                p - offset for p in _unpack(positions) if p >= offset)
+        return rv
+
+    def _functions_at(self, contract_id, address):
+        return sorted(set(self.db.execute(
+            "SELECT address, name FROM function_blocks WHERE contract_id = ? "
+            "AND start <= ? AND end > ?", (contract_id, address, address))))
+
+    def search(self, query, limit=None):
+        """Return a Hit for every match of query, at most limit."""
+        tokens = parse_query(query)
+        pattern = _pattern(tokens)
+        candidates = self._candidates(tokens)
+        if candidates is None:
+            # too vague for the n-gram index
+            candidates = dict((row[0], None) for row in
+                              self.db.execute("SELECT id FROM contracts"))
+
+        hits = []
+        for contract_id in sorted(candidates):
+            ops = self._contract_ops(contract_id)
+            positions = candidates[contract_id]
+            if positions is None:
+                matches = [m.start() for m in pattern.finditer(ops)]
+            else:
+                matches = [p for p in sorted(set(positions))
+                           if pattern.match(ops, p)]
+            if not matches:
+                continue
+            contract, name, pcs = self.db.execute(
+                "SELECT hash, name, pcs FROM contracts WHERE id = ?",
+                (contract_id,)).fetchone()
+            pcs = _unpack(pcs)
+            for position in matches:
+                address = pcs[position]
+                hits.append(Hit(contract, name, address,
+                                self._functions_at(contract_id, address)))
+                if limit is not None and len(hits) >= limit:
+                    return hits
+        return hits
+
+
+def corpus_index_path(path):
+    return os.path.join(path, CORPUS_INDEX_NAME)
+
+
+_corpora = {}
+
+
+def _index_task(task):
+    """Worker side of index_corpus: (corpus path, code hash, functions) ->
+    (code hash, record or error)."""
+    path, entry, with_functions = task
+    try:
+        corpus = _corpora.get(path)
+        if corpus is None:
+            corpus = _corpora[path] = Corpus(path)
+        return entry, extract_code(corpus.get(entry), with_functions)
+    except Exception as e:
+        return entry, "{}: {}".format(type(e).__name__, e)
+
+
+def index_corpus(path, filename=None, with_functions=True, jobs=None):
+    """
+    Index the corpus entries that are not in its search index yet, on a
+    pool of jobs worker processes. Returns (added, failed).
+    """
+    filename = filename or corpus_index_path(path)
+    added = failed = 0
+    with SearchIndex(filename) as index:
+        with Corpus(path) as corpus:
+            names = {}
+            for name, entry in sorted(corpus.names.items()):
+                names.setdefault(entry, name)
+            known = index.hashes()
+            tasks = [(path, entry, with_functions) for entry in corpus
+                     if entry not in known]
+        if not tasks:
+            return 0, 0
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for entry, record in pool.imap_unordered(
+                    _index_task, tasks, INDEX_CHUNK_SIZE):
+                if isinstance(record, dict):
+                    index.write(record, names.get(entry))
+                    added += 1
+                else:
+                    log_error("indexing {} failed: {}".format(entry, record))
+                    failed += 1
+        finally:
+            pool.close()
+            pool.join()
+    log_info("search index {}: {} contracts added, {} failed".format(
+        filename, added, failed))
+    return added, failed
+
+
+def index_view(view, index):
+    """Add view to index unless its bytecode is indexed already."""
+    code = view.read(0, len(view))
+    if code_hash(code) not in index:
+        index.write(extract_search(code, view_functions(view)),
+                    os.path.basename(view.file.filename))
+
+
+def format_hit(hit):
+    return '{} {:#x} {}'.format(
+        hit.name or hit.contract[:16], hit.address,
+        ', '.join(name for _, name in hit.functions))
+
+
+if 'binaryninja' in sys.modules:
+    class SearchThread(BackgroundTaskThread):
+        """Add the view to the default index, then run query over it if
+        given."""
+
+        def __init__(self, view, query):
+            BackgroundTaskThread.__init__(self, "Searching opcode sequence...",
+                                          False)
+            self.view = view
+            self.query = query
+
+        def run(self):
+            with SearchIndex() as index:
+                index_view(self.view, index)
+                if self.query is None:
+                    log_info("search index: {} contracts".format(len(index)))
+                    return
+                try:
+                    hits = index.search(self.query)
+                except ValueError as e:
+                    log_error("search: {}".format(e))
+                    return
+            log_info("search '{}': {} hits".format(self.query, len(hits)))
+            for hit in hits:
+                log_info("search: " + format_hit(hit))
+
+    def search_bn(view):
+        query = get_text_line_input("Opcode sequence (e.g. CALLER SLOAD)",
+                                    "Search opcode sequence")
+        if not query:
+            return
+        if isinstance(query, bytes):
+            query = query.decode("utf-8")
+        SearchThread(view, query).start()
+
+    def index_view_bn(view):
+        SearchThread(view, None).start()
+
+
+def _index_filename(target):
+    if os.path.isdir(target):
+        return corpus_index_path(target)
+    return target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Index and search opcode sequences across contracts")
+    commands = parser.add_subparsers(dest="command")
+    add = commands.add_parser(
+        "index", help="index a corpus directory (next to it) or add .evm "
+                      "files to a search database")
+    add.add_argument("target", help="corpus directory or .sqlite file")
+    add.add_argument("files", nargs="*", help=".evm files")
+    add.add_argument("--no-functions", action="store_true",
+                     help="don't build CFGs to attribute hits to functions")
+    add.add_argument("--jobs", type=int, default=None,
+                     help="worker processes (default: CPU count)")
+    query = commands.add_parser("query", help="search an index")
+    query.add_argument("target", help="corpus directory or .sqlite file")
+    query.add_argument("query", help="e.g. 'CALLER SLOAD' or 'PUSH* ? EQ'")
+    query.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "index":
+        with_functions = not args.no_functions
+        failed = 0
+        if os.path.isdir(args.target):
+            _, failed = index_corpus(args.target, None, with_functions,
+                                     args.jobs)
+        with SearchIndex(_index_filename(args.target)) as index:
+            for filename in args.files:
+                with open(filename, "rb") as f:
+                    index.write(extract_code(f.read(), with_functions),
+                                os.path.basename(filename))
+            print("{} contracts indexed".format(len(index)))
+        return 1 if failed else 0
+
+    if args.command == "query":
+        with SearchIndex(_index_filename(args.target)) as index:
+            try:
+                hits = index.search(args.query, args.limit)
+            except ValueError as e:
+                parser.error(str(e))
+        for hit in hits:
+            print(format_hit(hit))
+        return 0
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
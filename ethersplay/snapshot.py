@@ -0,0 +1,349 @@
+"""
+Sidecar snapshots of a view's analysis, keyed by the hash of its bytecode:
+function names and comments, the other comments, the indirect branches of
+every function, the highlights, the selector and event names of the code
+and its unreachable ranges.
+
+EVMView.init loads the snapshot of the code it opens and applies it in one
+pass before analysis starts, instead of building the CFG and looking up
+fingerprints: run_vsa takes the branches of the functions the snapshot
+covers from it rather than from VSA and the emulator. After the initial
+analysis the view is saved again only if VSA ran for some function.
+
+A snapshot is rejected, and later overwritten, if it was written by another
+snapshot format, plugin, evm_cfg_builder or Binary Ninja version, since any
+of them may change the analysis it records. The CLI, which runs without
+Binary Ninja, checks all but the Binary Ninja version.
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import threading
+
+from .budget import degraded_functions
+from .common import code_hash
+from .core import selectors as core_selectors
+from .core.log import log_info, log_warn
+from .core.reachable import Unreachable
+from .core.selectors import push_candidates
+from .decode import basic_blocks, decode
+from .fingerprint import FINGERPRINT_PATH
+
+# snapshots are only saved and applied inside Binary Ninja, the CLI does not
+# load it
+if 'binaryninja' in sys.modules:
+    import binaryninja
+    from binaryninja import (BackgroundTaskThread, HighlightStandardColor,
+                             Symbol, SymbolType)
+
+SNAPSHOT_VERSION = 4
+# None disables loading and saving snapshots
+SNAPSHOT_PATH = os.path.join(FINGERPRINT_PATH, "snapshots")
+
+_lock = threading.Lock()
+
+
+def _plugin_version():
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "plugin.json")
+    with open(filename) as f:
+        return json.load(f)["plugin"]["version"]
+
+
+def _package_version(name):
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return None
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def versions():
+    """Everything a snapshot's analysis depends on, but the Binary Ninja
+    version outside Binary Ninja."""
+    rv = {
+        "format": SNAPSHOT_VERSION,
+        "ethersplay": _plugin_version(),
+        "evm_cfg_builder": _package_version("evm-cfg-builder"),
+    }
+    if 'binaryninja' in sys.modules:
+        rv["binaryninja"] = binaryninja.core_version()
+    return rv
+
+
+def snapshot_file(code, path=None):
+    return os.path.join(path or SNAPSHOT_PATH, code_hash(code) + ".json.gz")
+
+
+def _standard_color(highlight):
+    """The HighlightStandardColor value of an instruction or block
+    highlight, None if there is none or it is not a standard color."""
+    if highlight is None:
+        return None
+    color = getattr(highlight, "color", highlight)
+    if not isinstance(color, HighlightStandardColor):
+        # mixed and custom colors, ethersplay never sets these
+        return None
+    if color == HighlightStandardColor.NoHighlightColor:
+        return None
+    return int(color)
+
+
+def code_selectors(code):
+    """{hash: [signatures]} of the selectors and topics pushed in code that
+    are in the local caches."""
+    selectors = []
+    topics = []
+    push_candidates(basic_blocks(decode(code)), selectors, topics)
+    return core_selectors.resolve_hashes(
+        [sig for _, sig in selectors], [sig for _, sig in topics],
+        online=False)
+
+
+def capture(view):
+    """The snapshot of view, as a JSON-serializable dict."""
+    code = view.read(0, len(view))
+    degraded = degraded_functions(view)
+    functions = []
+    for function in view.functions:
+        highlights = []
+        block_highlights = []
+        for bb in function.basic_blocks:
+            color = _standard_color(bb.highlight)
+            if color is not None:
+                block_highlights.append([bb.start, color])
+            for ins in decode(view.read(bb.start, bb.end - bb.start),
+                              bb.start):
+                color = _standard_color(
+                    function.get_instr_highlight(ins.pc))
+                if color is not None:
+                    highlights.append([ins.pc, color])
+        branches = {}
+        for branch in function.indirect_branches:
+            branches.setdefault(branch.source_addr, []).append(
+                branch.dest_addr)
+        functions.append({
+            "address": function.start,
+            "name": function.name,
+            "comment": function.comment,
+            "comments": sorted(function.comments.items()),
+            "branches": sorted(branches.items()),
+            "highlights": highlights,
+            "block_highlights": block_highlights,
+            "degraded": degraded.get(function.start, []),
+        })
+    return {
+        "versions": versions(),
+        "hash": code_hash(code),
+        "comments": sorted(view.address_comments.items()),
+        "functions": functions,
+        "selectors": code_selectors(code),
+        "unreachable": dict(view.session_data.get(
+            "unreachable", Unreachable([], 0, 0))._asdict()),
+    }
+
+
+def save(view, path=None):
+    """Write the snapshot of view and return its filename, None if
+    snapshots are disabled."""
+    path = path or SNAPSHOT_PATH
+    if path is None:
+        log_info("snapshot: not saved, snapshots are disabled")
+        return None
+    snapshot = capture(view)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    filename = os.path.join(path, snapshot["hash"] + ".json.gz")
+    # written aside and renamed, so a concurrent open never sees half of it
+    tmp = "{}.{}.tmp".format(filename, os.getpid())
+    with gzip.open(tmp, "wt") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmp, filename)
+    return filename
+
+
+def load(code, path=None):
+    """The snapshot of code, None if there is none or it is stale."""
+    if path is None and SNAPSHOT_PATH is None:
+        return None
+    filename = snapshot_file(code, path)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with gzip.open(filename, "rt") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        log_warn("snapshot: ignoring unreadable {}: {}".format(filename, e))
+        return None
+    expected = versions()
+    found = dict(snapshot.get("versions") or {})
+    if "binaryninja" not in expected:
+        # checked by the CLI, which Binary Ninja opens it is not known
+        found.pop("binaryninja", None)
+    if found != expected:
+        log_info("snapshot: ignoring {}, written by {} instead of {}".format(
+            filename, snapshot.get("versions"), expected))
+        return None
+    if snapshot.get("hash") != code_hash(code):
+        log_warn("snapshot: ignoring {}, it is for other code".format(
+            filename))
+        return None
+    return snapshot
+
+
+def snapshot_functions(snapshot):
+    """view address -> entry of the functions snapshot covers, kept in the
+    view's session_data while it is analyzed."""
+    return {entry["address"]: entry for entry in snapshot["functions"]}
+
+
+def unreachable(snapshot):
+    """The Unreachable code of the snapshot's code."""
+    entry = snapshot["unreachable"]
+    return Unreachable([tuple(r) for r in entry["ranges"]], entry["size"],
+                       entry["instructions"])
+
+
+def apply(view, snapshot):
+    """
+    Add the functions of snapshot to view with their names and restore the
+    comments, highlights and selector names. Branches are restored by
+    run_vsa and block highlights once analysis found the blocks.
+    """
+    for address, comment in snapshot["comments"]:
+        view.set_comment_at(address, comment)
+    for entry in snapshot["functions"]:
+        view.define_auto_symbol(Symbol(SymbolType.FunctionSymbol,
+                                       entry["address"], entry["name"]))
+        view.add_function(entry["address"])
+        function = view.get_function_at(entry["address"])
+        if function is None:
+            continue
+        if entry["comment"]:
+            function.comment = entry["comment"]
+        for address, comment in entry["comments"]:
+            function.set_comment_at(address, comment)
+        for address, color in entry["highlights"]:
+            function.set_user_instr_highlight(
+                address, HighlightStandardColor(color))
+    core_selectors.remember(snapshot["selectors"])
+
+
+def _apply_block_highlights(view):
+    for address, entry in view.session_data["snapshot"].items():
+        function = view.get_function_at(address)
+        if function is None:
+            continue
+        for start, color in entry["block_highlights"]:
+            bb = function.get_basic_block_at(start)
+            if bb is not None:
+                bb.set_user_highlight(HighlightStandardColor(color))
+
+
+def snapshot_branches(view, function):
+    """{source: set(targets)} the snapshot has for function, None if it does
+    not cover it or the function was degraded when it was saved."""
+    covered = view.session_data.get("snapshot")
+    entry = covered.get(function.start) if covered else None
+    # branches cut short by the budget are resolved again
+    if entry is None or entry["degraded"]:
+        with _lock:
+            view.session_data["snapshot_stale"] = True
+        return None
+    return {source: set(targets) for source, targets in entry["branches"]}
+
+
+def vsa_started(view):
+    with _lock:
+        view.session_data["vsa_pending"] = view.session_data.get(
+            "vsa_pending", 0) + 1
+
+
+def vsa_finished(view):
+    with _lock:
+        view.session_data["vsa_pending"] -= 1
+
+
+def _vsa_pending(view):
+    with _lock:
+        return view.session_data.get("vsa_pending", 0)
+
+
+def analysis_completed(view):
+    """
+    Completion event of the initial analysis: restore block highlights and
+    save the view again if VSA ran for a function the snapshot did not
+    cover.
+    """
+    if view.session_data.get("snapshot"):
+        _apply_block_highlights(view)
+    if SNAPSHOT_PATH is not None and view.session_data.get("snapshot_stale"):
+        SnapshotThread(view, wait=True).start()
+
+
+if 'binaryninja' in sys.modules:
+    class SnapshotThread(BackgroundTaskThread):
+        def __init__(self, view, path=None, wait=False):
+            BackgroundTaskThread.__init__(self, 'Saving analysis snapshot...',
+                                          False)
+            self.view = view
+            self.path = path
+            self.wait = wait
+
+        def run(self):
+            if self.wait:
+                # VSA threads started by function_added may still be updating
+                # branches after the core finished
+                while _vsa_pending(self.view):
+                    time.sleep(0.1)
+                self.view.update_analysis_and_wait()
+            filename = save(self.view, self.path)
+            if filename is None:
+                return
+            with _lock:
+                self.view.session_data["snapshot_stale"] = False
+            log_info("snapshot: saved {} functions to {}".format(
+                len(self.view.functions), filename))
+
+    def save_snapshot_bn(view):
+        SnapshotThread(view).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check the analysis snapshots of .evm files")
+    parser.add_argument("files", nargs="+", help=".evm files")
+    parser.add_argument("--path", default=SNAPSHOT_PATH,
+                        help="snapshot directory (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    status = 0
+    for filename in args.files:
+        with open(filename, "rb") as f:
+            code = f.read()
+        snapshot = load(code, args.path)
+        if snapshot is None:
+            print("{}: no current snapshot".format(filename))
+            status = 1
+            continue
+        print("{}: {} functions, {} branches, {} comments, {} highlights, "
+              "{} selector names".format(
+                  filename, len(snapshot["functions"]),
+                  sum(len(t) for f in snapshot["functions"]
+                      for _, t in f["branches"]),
+                  len(snapshot["comments"]) +
+                  sum(len(f["comments"]) for f in snapshot["functions"]),
+                  sum(len(f["highlights"]) + len(f["block_highlights"])
+                      for f in snapshot["functions"]),
+                  len(snapshot["selectors"])))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
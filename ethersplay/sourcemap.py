@@ -0,0 +1,365 @@
+import os
+import re
+import sys
+import json
+import argparse
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from .core.log import log_info, log_error
+from .decode import decode
+
+# the command is only defined inside Binary Ninja, the CLI does not load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import BackgroundTaskThread
+    from binaryninja.interaction import get_open_filename_input
+
+# jump: 'i' into a function, 'o' out of one, '-' a regular jump
+SourceLocation = namedtuple('SourceLocation',
+                            ['offset', 'length', 'file', 'jump'])
+
+# maps: [(bytecode hex or instruction names, locations)], runtime first
+Contract = namedtuple('Contract', ['name', 'sources', 'maps'])
+
+# asm-json items that are not instructions
+_PSEUDO_ITEMS = frozenset(['tag'])
+
+_HEADER = re.compile(r'^======= (.+?):(.+?) =======$', re.MULTILINE)
+
+# the 20 byte address of an unlinked library in solc's bytecode hex,
+# "__$<hash>$__" or, before solc 0.5, "__<file>:<library>" padded with "_"
+_PLACEHOLDER = re.compile(r'__.{36}__')
+
+
+def decode_srcmap(srcmap):
+    """
+    Decompress a solc source map ("s:l:f:j;..." with empty fields repeating
+    the previous entry) into one SourceLocation per instruction.
+    """
+    rv = []
+    append = rv.append
+    offset = length = file_index = 0
+    jump = '-'
+    location = SourceLocation(offset, length, file_index, jump)
+    for entry in srcmap.split(';'):
+        if entry:
+            fields = entry.split(':')
+            n = len(fields)
+            if fields[0]:
+                offset = int(fields[0])
+            if n > 1 and fields[1]:
+                length = int(fields[1])
+            if n > 2 and fields[2]:
+                file_index = int(fields[2])
+            if n > 3 and fields[3]:
+                jump = fields[3]
+            location = SourceLocation(offset, length, file_index, jump)
+        append(location)
+    return rv
+
+
+def _asm_locations(items):
+    """(instruction names, locations) of the items of an asm-json .code."""
+    names = []
+    locations = []
+    for item in items:
+        name = item['name']
+        if name in _PSEUDO_ITEMS:
+            continue
+        names.append(name)
+        jump = '-'
+        if name == 'JUMP':
+            jump = {'[in]': 'i', '[out]': 'o'}.get(item.get('value'), '-')
+        begin = item.get('begin', -1)
+        locations.append(SourceLocation(
+            begin, item.get('end', begin) - begin, item.get('source', 0),
+            jump))
+    return names, locations
+
+
+def _asm_candidates(assembly, found):
+    if '.code' in assembly:
+        found.append(_asm_locations(assembly['.code']))
+    for sub in assembly.get('.data', {}).values():
+        if isinstance(sub, dict):
+            _asm_candidates(sub, found)
+    return found
+
+
+def parse_asm_json(text, source_dir=''):
+    """
+    Parse the text output of `solc --asm-json`: one or more
+    "======= file:Contract =======" sections with (possibly concatenated)
+    assembly JSON objects. Returns a list of Contracts with the (names,
+    locations) of every assembly found, to be matched against the bytecode
+    with select_locations.
+    """
+    decoder = json.JSONDecoder()
+    headers = list(_HEADER.finditer(text)) or [None]
+    contracts = []
+    for i, header in enumerate(headers):
+        start = header.end() if header else 0
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        candidates = []
+        sources = None
+        pos = text.find('{', start, end)
+        while 0 <= pos < end:
+            assembly, pos = decoder.raw_decode(text, pos)
+            _asm_candidates(assembly, candidates)
+            sources = assembly.get('sourceList', sources)
+            pos = text.find('{', pos, end)
+        if sources is None:
+            sources = [header.group(1)] if header else []
+        name = header.group(2) if header else ''
+        contracts.append(Contract(
+            name, [os.path.join(source_dir, s) for s in sources],
+            candidates))
+    return contracts
+
+
+def parse_combined_json(data, source_dir=''):
+    """Contracts of `solc --combined-json srcmap,srcmap-runtime,...`."""
+    sources = [os.path.join(source_dir, s)
+               for s in data.get('sourceList', [])]
+    contracts = []
+    for name, contract in sorted(data.get('contracts', {}).items()):
+        maps = []
+        for code_key, map_key in (('bin-runtime', 'srcmap-runtime'),
+                                  ('bin', 'srcmap')):
+            if contract.get(map_key):
+                maps.append((contract.get(code_key),
+                             decode_srcmap(contract[map_key])))
+        contracts.append(Contract(name, sources, maps))
+    return contracts
+
+
+def load_contracts(filename):
+    with open(filename) as f:
+        text = f.read()
+    source_dir = os.path.dirname(filename)
+    stripped = text.lstrip()
+    if stripped.startswith('{') and '"contracts"' in text:
+        return parse_combined_json(json.loads(text), source_dir)
+    return parse_asm_json(text, source_dir)
+
+
+def _normalize(name):
+    return 'PUSH' if name.startswith('PUSH') else name
+
+
+def _code_matches(key, code):
+    """Whether the bytecode hex key and code agree up to the shorter of
+    the two, with library placeholders matching any address."""
+    offset = 0
+    for i, part in enumerate(_PLACEHOLDER.split(key)):
+        if i:
+            offset += 20
+        data = bytes.fromhex(part[:2 * max(len(code) - offset, 0)])
+        if data != bytes(code[offset:offset + len(data)]):
+            return False
+        offset += len(part) // 2
+    return True
+
+
+def _matches(candidate, code, instructions, named=False):
+    """Whether a candidate (names or bytecode hex, locations) describes
+    code. A source map without its bytecode describes any code that is
+    long enough, so it is only used for a contract selected by name."""
+    key, locations = candidate
+    if not key:
+        return named and len(locations) <= len(instructions)
+    if isinstance(key, str):
+        return _code_matches(key, code)
+    if len(key) > len(instructions):
+        return False
+    return all(_normalize(a) == _normalize(b.name)
+               for a, b in zip(key, instructions))
+
+
+def _named(contract, name):
+    # "file.sol:Token" in combined-json, "Token" in asm-json
+    return name in (contract.name, contract.name.rsplit(':', 1)[-1])
+
+
+def select_locations(contracts, code, instructions=None, name=None):
+    """
+    Return (contract, locations) of the first runtime or creation source map
+    describing code, or (None, None). With name, only the contract of that
+    name is considered.
+    """
+    if instructions is None:
+        instructions = decode(code)
+    for contract in contracts:
+        if name is not None and not _named(contract, name):
+            continue
+        for candidate in contract.maps:
+            if _matches(candidate, code, instructions, name is not None):
+                return contract, candidate[1]
+    return None, None
+
+
+class SourceFile(object):
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, 'rb') as f:
+                self.data = f.read()
+        except (IOError, OSError):
+            self.data = None
+        self._lines = None
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            text = self.data or b''
+            starts = [0]
+            pos = text.find(b'\n')
+            while pos >= 0:
+                starts.append(pos + 1)
+                pos = text.find(b'\n', pos + 1)
+            self._lines = starts
+        return self._lines
+
+    def line(self, offset):
+        """1-based line number of a byte offset."""
+        return bisect_right(self.lines, offset)
+
+    def text(self, offset, length):
+        if self.data is None:
+            return ''
+        return self.data[offset:offset + length].decode('utf-8', 'replace')
+
+
+class SourceMap(object):
+    """
+    Address -> source location of the instructions of a contract. The
+    instruction start addresses are kept sorted, so lookups are a bisection
+    and ranges of addresses (a basic block) are a slice.
+    """
+
+    def __init__(self, instructions, locations, sources):
+        count = min(len(instructions), len(locations))
+        self.starts = [ins.pc for ins in instructions[:count]]
+        self.ends = [ins.pc + ins.size for ins in instructions[:count]]
+        self.locations = locations[:count]
+        self.sources = [SourceFile(s) for s in sources]
+
+    def lookup(self, address):
+        i = bisect_right(self.starts, address) - 1
+        if i < 0 or address >= self.ends[i]:
+            return None
+        location = self.locations[i]
+        if location.file < 0 or location.offset < 0:
+            return None
+        return location
+
+    def items(self, start=0, end=None):
+        """(address, location) of the instructions in [start, end)."""
+        lo = bisect_left(self.starts, start)
+        hi = len(self.starts) if end is None else bisect_left(self.starts, end)
+        return zip(self.starts[lo:hi], self.locations[lo:hi])
+
+    def describe(self, location):
+        if location.file >= len(self.sources):
+            return '#{}:{}'.format(location.file, location.offset)
+        source = self.sources[location.file]
+        text = source.text(location.offset, location.length)
+        line = text.split('\n', 1)[0].strip()
+        return '{}:{} {}'.format(os.path.basename(source.filename),
+                                 source.line(location.offset), line)
+
+    def comments(self, start=0, end=None):
+        """
+        Yield (address, comment) where the source location changes, so
+        a run of instructions from the same expression gets one comment.
+        """
+        previous = None
+        for address, location in self.items(start, end):
+            if location.file < 0 or location.offset < 0:
+                previous = None
+                continue
+            key = location[:3]
+            if key != previous:
+                previous = key
+                yield address, self.describe(location)
+
+
+def load_source_map(filename, code, name=None):
+    instructions = decode(code)
+    contract, locations = select_locations(load_contracts(filename), code,
+                                           instructions, name)
+    if contract is None:
+        return None
+    return SourceMap(instructions, locations, contract.sources)
+
+
+def annotate_view(view, source_map):
+    count = 0
+    for function in view.functions:
+        for bb in function.basic_blocks:
+            for address, comment in source_map.comments(bb.start, bb.end):
+                function.set_comment_at(address, comment)
+                count += 1
+    return count
+
+
+if 'binaryninja' in sys.modules:
+    class SourceMapThread(BackgroundTaskThread):
+        def __init__(self, view, filename):
+            BackgroundTaskThread.__init__(self, 'Importing source map...',
+                                          False)
+            self.view = view
+            self.filename = filename
+
+        def run(self):
+            source_map = load_source_map(self.filename,
+                                         self.view.read(0, len(self.view)))
+            if source_map is None:
+                log_error('no contract in {} matches this bytecode'.format(
+                    self.filename))
+                return
+            self.view.session_data['sourcemap'] = source_map
+            count = annotate_view(self.view, source_map)
+            log_info('source map: {} comments added'.format(count))
+
+    def import_source_map_bn(view):
+        filename = get_open_filename_input(
+            'solc --combined-json or --asm-json output')
+        if not filename:
+            return
+        if isinstance(filename, bytes):
+            filename = filename.decode('utf-8')
+        SourceMapThread(view, filename).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Map the instructions of a contract to source lines")
+    parser.add_argument("solc_output")
+    parser.add_argument("code")
+    parser.add_argument("addresses", nargs="*",
+                        help="addresses to look up, all if omitted")
+    parser.add_argument("--contract",
+                        help="name of the contract, needed when the solc "
+                             "output has no bytecode to match")
+    args = parser.parse_args(argv)
+
+    with open(args.code, "rb") as f:
+        source_map = load_source_map(args.solc_output, f.read(),
+                                     args.contract)
+    if source_map is None:
+        print("no contract matches {}".format(args.code), file=sys.stderr)
+        return 1
+    if args.addresses:
+        for address in args.addresses:
+            location = source_map.lookup(int(address, 0))
+            print('{} {}'.format(address, source_map.describe(location)
+                                 if location else '-'))
+    else:
+        for address, comment in source_map.comments():
+            print('{:#x} {}'.format(address, comment))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
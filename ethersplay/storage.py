@@ -0,0 +1,164 @@
+import sys
+import json
+from collections import defaultdict
+
+from .common import code_hash
+from .constprop import propagate, KeccakSlot
+from .core.log import log_info
+from .decode import decode
+
+# the index is only kept up to date inside Binary Ninja, export does not
+# load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import BackgroundTaskThread, BinaryDataNotification
+    from binaryninja.interaction import get_save_filename_input
+
+
+def slot_key(value):
+    """Index key of a storage location: '0x5' for a constant slot,
+    'mapping:0x5' / 'array:0x5' for locations derived from slot 5."""
+    if isinstance(value, int):
+        return hex(value)
+    if isinstance(value, KeccakSlot):
+        return '{}:{:#x}'.format(value.kind, value.base)
+    return None
+
+
+def block_accesses(instructions):
+    """Return [(address, 'read' | 'write', key)] for the SLOADs and SSTOREs
+    in decoded instructions whose location is known."""
+    rv = []
+    for ins, args in propagate(instructions):
+        if ins.name in ('SLOAD', 'SSTORE'):
+            key = slot_key(args[0])
+            if key is not None:
+                rv.append((ins.pc,
+                           'read' if ins.name == 'SLOAD' else 'write', key))
+    return rv
+
+
+def function_accesses(view, function):
+    rv = []
+    for bb in function.basic_blocks:
+        rv.extend(block_accesses(
+            decode(view.read(bb.start, bb.end - bb.start), bb.start)))
+    return rv
+
+
+class StorageIndex(object):
+    """
+    Storage location -> functions and addresses that read or write it.
+    Entries are kept per function, so re-indexing a function only touches
+    its own entries.
+    """
+
+    def __init__(self):
+        # key -> {'read': {function_start: [addresses]}, 'write': {...}}
+        self.slots = defaultdict(lambda: {'read': {}, 'write': {}})
+        self.functions = {}
+        self._function_keys = defaultdict(set)
+
+    def update_function(self, start, name, accesses):
+        self.remove_function(start)
+        self.functions[start] = name
+        for address, kind, key in accesses:
+            self.slots[key][kind].setdefault(start, []).append(address)
+            self._function_keys[start].add(key)
+
+    def remove_function(self, start):
+        for key in self._function_keys.pop(start, ()):
+            entry = self.slots[key]
+            entry['read'].pop(start, None)
+            entry['write'].pop(start, None)
+            if not entry['read'] and not entry['write']:
+                del self.slots[key]
+        self.functions.pop(start, None)
+
+    def _lookup(self, slot, kind):
+        key = slot if isinstance(slot, str) else slot_key(slot)
+        entry = self.slots.get(key)
+        if entry is None:
+            return {}
+        return entry[kind]
+
+    def readers(self, slot):
+        """{function_start: [addresses]} of the functions reading slot."""
+        return self._lookup(slot, 'read')
+
+    def writers(self, slot):
+        return self._lookup(slot, 'write')
+
+    def to_dict(self, contract=None):
+        return {
+            'contract': contract,
+            'functions': {hex(start): name
+                          for start, name in self.functions.items()},
+            'slots': {
+                key: {kind: {hex(start): addresses
+                             for start, addresses in entry[kind].items()}
+                      for kind in ('read', 'write')}
+                for key, entry in self.slots.items()
+            },
+        }
+
+
+def index_function(view, index, function):
+    index.update_function(function.start, function.name,
+                          function_accesses(view, function))
+
+
+def build_storage_index(view):
+    index = StorageIndex()
+    for function in view.functions:
+        index_function(view, index, function)
+    view.session_data['storage'] = index
+    return index
+
+
+def get_storage_index(view):
+    index = view.session_data.get('storage')
+    if index is None:
+        index = build_storage_index(view)
+        view.register_notification(StorageNotification())
+    return index
+
+
+def export_storage_index(view, filename):
+    index = get_storage_index(view)
+    with open(filename, 'w') as f:
+        json.dump(index.to_dict(code_hash(view.read(0, len(view)))), f,
+                  indent=1, sort_keys=True)
+
+
+if 'binaryninja' in sys.modules:
+    class StorageNotification(BinaryDataNotification):
+        def function_updated(self, view, function):
+            index = view.session_data.get('storage')
+            if index is not None:
+                index_function(view, index, function)
+
+        def function_removed(self, view, function):
+            index = view.session_data.get('storage')
+            if index is not None:
+                index.remove_function(function.start)
+
+    class StorageIndexThread(BackgroundTaskThread):
+        def __init__(self, view, filename):
+            BackgroundTaskThread.__init__(self, 'Indexing storage accesses...',
+                                          False)
+            self.view = view
+            self.filename = filename
+
+        def run(self):
+            index = get_storage_index(self.view)
+            log_info('storage index: {} locations in {} functions'.format(
+                len(index.slots), len(index.functions)))
+            if self.filename:
+                export_storage_index(self.view, self.filename)
+
+    def storage_index_bn(view):
+        filename = get_save_filename_input('Export storage index as JSON?',
+                                           'json')
+        if isinstance(filename, bytes):
+            filename = filename.decode('utf-8')
+        StorageIndexThread(view, filename).start()
@@ -0,0 +1,339 @@
+"""
+Import of geth struct-log traces: the output of debug_traceTransaction with
+the default tracer (a JSON document with a structLogs array, optionally
+wrapped in a JSON-RPC response) or of `evm --json` (one struct log per
+line).
+
+The file is never loaded as a whole. Struct logs are decoded one at a time
+from a sliding buffer, and files larger than PARALLEL_MIN_SIZE are split
+into byte ranges that worker processes parse concurrently. Each worker
+aggregates its range into segments of constant call depth; the segments are
+then stitched into call frames in order. Frames whose every step agrees
+with the decoded instructions of the code belong to it, and only their
+per-pc hit counts and distinct stack arguments are kept.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import multiprocessing
+
+from .core.annotations import ANNOTATIONS
+from .core.log import log_info, log_error
+from .decode import decode
+from .gas import heat_color
+
+# the command is only defined inside Binary Ninja, the CLI does not load it
+if 'binaryninja' in sys.modules:
+    from binaryninja import BackgroundTaskThread
+    from binaryninja.interaction import get_open_filename_input
+
+READ_SIZE = 1 << 20
+PARALLEL_MIN_SIZE = 64 << 20
+CHUNK_SIZE = 64 << 20
+# distinct argument tuples kept per instruction
+MAX_VALUES = 4
+
+# struct log op names that differ from pyevmasm's
+_ALIASES = {'KECCAK256': 'SHA3', 'PREVRANDAO': 'DIFFICULTY',
+            'SUICIDE': 'SELFDESTRUCT'}
+
+_LOG_START = re.compile(r'\{\s*"pc"\s*:')
+
+
+class TraceResult(object):
+    """Aggregated execution of one contract's code in a trace."""
+
+    def __init__(self):
+        self.frames = 0
+        self.steps = 0
+        # pc -> number of executions
+        self.hits = {}
+        # pc -> [tuple of stack arguments as ints, top of stack first]
+        self.values = {}
+        # pcs that saw more than MAX_VALUES distinct arguments
+        self.more_values = set()
+
+    def to_dict(self):
+        return {
+            'frames': self.frames,
+            'steps': self.steps,
+            'hits': {hex(pc): n for pc, n in sorted(self.hits.items())},
+            'values': {hex(pc): [[hex(v) for v in args] for args in values]
+                       for pc, values in sorted(self.values.items())},
+        }
+
+
+class _Segment(object):
+    """Consecutive steps at one call depth."""
+
+    __slots__ = ('depth', 'consistent', 'steps', 'hits', 'values', 'more')
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.consistent = True
+        self.steps = 0
+        self.hits = {}
+        self.values = {}
+        self.more = set()
+
+    def mismatch(self):
+        # a frame running other code, nothing of it is needed any more
+        self.consistent = False
+        self.hits = {}
+        self.values = {}
+        self.more = set()
+
+    def merge(self, other):
+        if not other.consistent:
+            self.mismatch()
+        if not self.consistent:
+            return
+        self.steps += other.steps
+        for pc, n in other.hits.items():
+            self.hits[pc] = self.hits.get(pc, 0) + n
+        for pc, values in other.values.items():
+            _add_values(self, pc, values)
+        self.more |= other.more
+
+
+def _add_values(segment, pc, values):
+    known = segment.values.setdefault(pc, [])
+    for args in values:
+        if args not in known:
+            if len(known) < MAX_VALUES:
+                known.append(args)
+            else:
+                segment.more.add(pc)
+
+
+def _instruction_table(code):
+    """pc -> (opcode, name, pops) of every instruction of code."""
+    return {ins.pc: (ins.opcode, _ALIASES.get(ins.name, ins.name), ins.pops)
+            for ins in decode(code)}
+
+
+def iter_struct_logs(filename, start=0, end=None):
+    """
+    Yield the struct logs starting in [start, end) of filename, decoding one
+    object at a time. Struct logs are found by their leading "pc" key, which
+    is how geth writes them.
+    """
+    decoder = json.JSONDecoder()
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        # latin-1 keeps string offsets equal to file offsets
+        buf = ''
+        buf_start = start
+        eof = False
+        i = 0
+        while True:
+            m = _LOG_START.search(buf, i)
+            if m is not None:
+                if end is not None and buf_start + m.start() >= end:
+                    return
+                try:
+                    obj, i = decoder.raw_decode(buf, m.start())
+                except ValueError:
+                    if eof:
+                        log_error('trace: invalid struct log at offset '
+                                  '{}'.format(buf_start + m.start()))
+                        return
+                    # the struct log continues past the buffer
+                    keep = m.start()
+                else:
+                    yield obj
+                    if i < READ_SIZE:
+                        continue
+                    keep = i
+            elif eof:
+                return
+            else:
+                # the tail may hold the start of a struct log
+                keep = max(i, len(buf) - 32)
+            buf_start += keep
+            more = f.read(READ_SIZE).decode('latin-1')
+            eof = len(more) < READ_SIZE
+            buf = buf[keep:] + more
+            i = 0
+
+
+def aggregate_range(filename, table, start=0, end=None):
+    """Aggregate the struct logs in [start, end) into _Segments."""
+    segments = []
+    segment = None
+    for log in iter_struct_logs(filename, start, end):
+        depth = log.get('depth', 1)
+        if segment is None or depth != segment.depth:
+            segment = _Segment(depth)
+            segments.append(segment)
+        if not segment.consistent:
+            continue
+        pc = log.get('pc')
+        ins = table.get(pc)
+        op = log.get('op')
+        if ins is None or (op != ins[0] if isinstance(op, int) else
+                           _ALIASES.get(op, op) != ins[1]):
+            segment.mismatch()
+            continue
+        segment.steps += 1
+        segment.hits[pc] = segment.hits.get(pc, 0) + 1
+        stack = log.get('stack') or ()
+        pops = min(ins[2], len(stack))
+        if pops:
+            args = tuple(int(stack[-1 - k], 16) for k in range(pops))
+            _add_values(segment, pc, [args])
+    return segments
+
+
+def _aggregate_task(task):
+    filename, code, start, end = task
+    return aggregate_range(filename, _instruction_table(code), start, end)
+
+
+def stitch(segments, result=None):
+    """Merge the segments of a whole trace, in order, into call frames and
+    add the frames that ran the code to result."""
+    result = result or TraceResult()
+    frames = []
+
+    def finish(frame):
+        if frame.consistent and frame.steps:
+            result.frames += 1
+            result.steps += frame.steps
+            for pc, n in frame.hits.items():
+                result.hits[pc] = result.hits.get(pc, 0) + n
+            for pc, values in frame.values.items():
+                known = result.values.setdefault(pc, [])
+                for args in values:
+                    if args not in known:
+                        if len(known) < MAX_VALUES:
+                            known.append(args)
+                        else:
+                            result.more_values.add(pc)
+            result.more_values |= frame.more
+
+    for segment in segments:
+        while frames and frames[-1].depth > segment.depth:
+            finish(frames.pop())
+        if frames and frames[-1].depth == segment.depth:
+            frames[-1].merge(segment)
+        else:
+            frames.append(segment)
+    while frames:
+        finish(frames.pop())
+    return result
+
+
+def import_trace(filename, code, jobs=None):
+    """
+    Aggregate the execution of code in the struct-log trace filename. Files
+    of at least PARALLEL_MIN_SIZE are parsed in CHUNK_SIZE ranges on a pool
+    of jobs processes.
+    """
+    code = bytes(code)
+    size = os.path.getsize(filename)
+    if jobs == 1 or size < PARALLEL_MIN_SIZE:
+        return stitch(aggregate_range(filename, _instruction_table(code)))
+
+    tasks = [(filename, code, start, min(start + CHUNK_SIZE, size))
+             for start in range(0, size, CHUNK_SIZE)]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        segments = []
+        for chunk in pool.imap(_aggregate_task, tasks):
+            segments.extend(chunk)
+    finally:
+        pool.close()
+        pool.join()
+    return stitch(segments)
+
+
+def value_comment(name, values, more):
+    """'trace: address = 0x3 | 0x4' for the arguments seen at an
+    instruction, named like the annotator's comments."""
+    names = ANNOTATIONS.get(name, ())
+    parts = []
+    for i, arg_name in enumerate(names):
+        seen = []
+        for args in values:
+            if i < len(args) and hex(args[i]) not in seen:
+                seen.append(hex(args[i]))
+        if seen:
+            # an argument that varied may have had more values than kept
+            parts.append('{} = {}{}'.format(
+                arg_name, ' | '.join(seen),
+                ' | ...' if more and len(seen) > 1 else ''))
+    return 'trace: ' + ', '.join(parts) if parts else None
+
+
+def apply_trace(view, result):
+    """Highlight executed instructions by hit count and comment the
+    arguments seen at annotated instructions."""
+    max_hits = max(result.hits.values() or [0])
+    names = {ins.pc: ins.name for ins in decode(view.read(0, len(view)))}
+    for pc, n in result.hits.items():
+        color = heat_color(n, max_hits)
+        comment = None
+        if pc in result.values:
+            comment = value_comment(names.get(pc), result.values[pc],
+                                    pc in result.more_values)
+        for bb in view.get_basic_blocks_at(pc):
+            bb.function.set_user_instr_highlight(pc, color)
+            if comment:
+                bb.function.set_comment_at(
+                    pc, '{} ({} hits)'.format(comment, n))
+    view.session_data['trace'] = result
+
+
+if 'binaryninja' in sys.modules:
+    class TraceImportThread(BackgroundTaskThread):
+        def __init__(self, view, filename):
+            BackgroundTaskThread.__init__(
+                self, 'Importing struct-log trace...', False)
+            self.view = view
+            self.filename = filename
+
+        def run(self):
+            result = import_trace(self.filename,
+                                  self.view.read(0, len(self.view)))
+            if not result.frames:
+                log_error('trace: no call frame in {} runs this code'.format(
+                    self.filename))
+                return
+            apply_trace(self.view, result)
+            log_info('trace: {} frames, {} steps, {} instructions covered'
+                     .format(result.frames, result.steps, len(result.hits)))
+
+    def import_trace_bn(view):
+        filename = get_open_filename_input(
+            'debug_traceTransaction struct logs', '*.json *.jsonl')
+        if not filename:
+            return
+        if isinstance(filename, bytes):
+            filename = filename.decode('utf-8')
+        TraceImportThread(view, filename).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Aggregate the execution of a contract in a geth "
+                    "struct-log trace")
+    parser.add_argument("trace", help="debug_traceTransaction output or "
+                                      "evm --json struct logs")
+    parser.add_argument("file", help=".evm file of the contract")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="worker processes for large traces "
+                             "(default: CPU count)")
+    args = parser.parse_args(argv)
+
+    with open(args.file, "rb") as f:
+        code = f.read()
+    result = import_trace(args.trace, code, args.jobs)
+    json.dump(result.to_dict(), sys.stdout, indent=1)
+    return 0 if result.frames else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
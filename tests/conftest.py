@@ -0,0 +1,39 @@
+"""
+The tests run without Binary Ninja: the plugin modules are tested against
+the stand-in binaryninja module of the benchmarks, which wins over an
+installed one, on the generated contracts of the benchmark corpus.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'benchmarks'), ROOT]
+# caches, indexes and snapshots stay out of the user's ~/.ethersplay
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ethersplay-tests-')
+
+import binaryninja  # noqa: E402,F401
+from binaryninja import BinaryView  # noqa: E402
+
+import ethersplay  # noqa: E402,F401
+from ethersplay import snapshot  # noqa: E402
+from ethersplay.evm import EVMView  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_snapshots(monkeypatch):
+    """Views are analyzed from scratch, not reopened from a snapshot."""
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_PATH', None)
+
+
+@pytest.fixture
+def load_view():
+    """Open code as an EVMView and run the initial analysis."""
+    def load(code):
+        view = EVMView(BinaryView.new(code))
+        view.init()
+        view.update_analysis_and_wait()
+        return view
+    return load
@@ -0,0 +1,35 @@
+from contracts import synthetic
+
+from ethersplay import budget
+from ethersplay.budget import DEGRADED_COMMENT, degrade, degraded_functions
+
+CODE = synthetic(4, seed=4)
+
+
+def test_degrade_keeps_the_comment(load_view):
+    view = load_view(CODE)
+    function = view.get_function_at(0)
+    view.set_comment_at(0, 'EIP-1967 proxy')
+    degrade(view, function, 'emulation cancelled')
+    degrade(view, function, 'emulation cancelled')
+    assert function.comments[0] == (
+        'EIP-1967 proxy\n' + DEGRADED_COMMENT.format('emulation cancelled'))
+    assert degraded_functions(view) == {
+        0: ['emulation cancelled', 'emulation cancelled']}
+
+    other = [f for f in view.functions if f.start != 0][0]
+    other.set_comment_at(other.start, 'worst-case gas: 100')
+    degrade(view, other, 'annotation cancelled')
+    assert other.comments[other.start] == (
+        'worst-case gas: 100\n' +
+        DEGRADED_COMMENT.format('annotation cancelled'))
+    assert 'annotation cancelled' in budget.summary(view)
+
+
+def test_step_budget(load_view, monkeypatch):
+    monkeypatch.setattr(budget, 'FUNCTION_STEPS', 1)
+    view = load_view(CODE)
+    reasons = [reason for reasons in degraded_functions(view).values()
+               for reason in reasons]
+    assert reasons
+    assert set(reasons) == {'emulation stopped after 1 blocks'}
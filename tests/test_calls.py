@@ -0,0 +1,94 @@
+from contracts import assemble
+from ethersplay.calls import (CallGraph, call_sites, corpus_calls_path,
+                              extract_calls, index_corpus)
+from ethersplay.constprop import propagate
+from ethersplay.corpus import CorpusWriter
+from ethersplay.decode import decode
+
+TARGET = 0x1234567890abcdef1234567890abcdef12345678
+TRANSFER = 0xa9059cbb
+
+
+def _call(guard, tail=()):
+    """token.transfer() the way solc compiles it: selector stored, target
+    pushed, extcodesize checked, then the CALL."""
+    items = [('PUSH', TRANSFER << 224), ('PUSH', 0x80), 'MSTORE',
+             ('PUSH', TARGET)]
+    items += guard
+    items += ['POP',
+              ('PUSH', 0x20), ('PUSH', 0), ('PUSH', 4), ('PUSH', 0x80),
+              ('PUSH', 0), 'DUP6', 'GAS', 'CALL', 'STOP']
+    return assemble(items + list(tail))
+
+
+def test_target_survives_extcodesize_guard():
+    # jumps over the revert to the call
+    code = _call(['DUP1', 'EXTCODESIZE', 'ISZERO', 'DUP1', 'ISZERO',
+                  ('PUSHL', 'ok'), 'JUMPI', ('PUSH', 0), 'DUP1', 'REVERT',
+                  ('LABEL', 'ok')])
+    sites = call_sites(decode(code))
+    assert [(s.kind, s.target, s.selector) for s in sites] == [
+        ('CALL', '0x{:040x}'.format(TARGET), '0x{:08x}'.format(TRANSFER))]
+
+
+def test_target_survives_fall_through_into_jumpdest():
+    # reverts elsewhere, falls through into the call
+    code = _call(['DUP1', 'EXTCODESIZE', 'ISZERO', 'DUP1',
+                  ('PUSHL', 'fail'), 'JUMPI', ('LABEL', 'ok')],
+                 [('LABEL', 'fail'), ('PUSH', 0), 'DUP1', 'REVERT'])
+    sites = call_sites(decode(code))
+    assert sites[0].target == '0x{:040x}'.format(TARGET)
+
+
+def test_values_are_not_carried_into_return_addresses():
+    # ret is pushed as a return address, any jump may enter it
+    code = assemble([('PUSH', 7), ('PUSHL', 'ret'), ('PUSHL', 'f'), 'JUMP',
+                     ('LABEL', 'f'), 'JUMP',
+                     ('LABEL', 'ret'), ('PUSH', 0), 'SSTORE', 'STOP'])
+    args = [args for ins, args in propagate(decode(code), edges=True)
+            if ins.name == 'SSTORE']
+    assert args == [[0, None]]
+
+
+def test_disagreeing_entries_are_unknown():
+    code = assemble([('PUSH', 1), 'CALLVALUE', ('PUSHL', 'join'), 'JUMPI',
+                     'POP', ('PUSH', 2),
+                     ('LABEL', 'join'), ('PUSH', 0), 'SSTORE', 'STOP'])
+    args = [args for ins, args in propagate(decode(code), edges=True)
+            if ins.name == 'SSTORE']
+    assert args == [[0, None]]
+    # per block, nothing crosses the JUMPDEST
+    args = [args for ins, args in propagate(decode(code))
+            if ins.name == 'SSTORE']
+    assert args == [[0, None]]
+
+
+def test_call_graph(tmp_path):
+    code = _call(['DUP1', 'EXTCODESIZE', 'ISZERO', 'DUP1', 'ISZERO',
+                  ('PUSHL', 'ok'), 'JUMPI', ('PUSH', 0), 'DUP1', 'REVERT',
+                  ('LABEL', 'ok')])
+    target = '0x{:040x}'.format(TARGET)
+    with CallGraph(str(tmp_path / 'calls.sqlite')) as graph:
+        graph.write(extract_calls(code), ['0xCAFE'])
+        graph.write(extract_calls(b'\x00'), [target])
+        assert [c.name for c in graph.callers(target)] == ['0xcafe']
+        assert [c.name for c in graph.callers(target, '0x12345678')] == []
+        callees = graph.callees('0xcafe')
+        assert [(c.target, c.names) for c in callees] == [
+            (target, [target])]
+
+
+def test_corpus_call_graph(tmp_path):
+    path = str(tmp_path / 'corpus')
+    code = _call(['DUP1', 'EXTCODESIZE', 'ISZERO', 'DUP1', 'ISZERO',
+                  ('PUSHL', 'ok'), 'JUMPI', ('PUSH', 0), 'DUP1', 'REVERT',
+                  ('LABEL', 'ok')])
+    with CorpusWriter(path) as writer:
+        writer.add(code, '0xcafe')
+        writer.add(b'\x00', '0xbeef')
+    assert index_corpus(path, jobs=1) == (2, 0)
+    # only new entries are indexed
+    assert index_corpus(path, jobs=1) == (0, 0)
+    target = '0x{:040x}'.format(TARGET)
+    with CallGraph(corpus_calls_path(path)) as graph:
+        assert [c.name for c in graph.callers(target)] == ['0xcafe']
@@ -0,0 +1,43 @@
+from contracts import assemble
+
+from ethersplay.constprop import KeccakSlot, propagate
+from ethersplay.decode import decode
+
+
+def _args(items, name, edges=False):
+    """The args of every name instruction of the assembled items."""
+    return [args for ins, args in propagate(decode(assemble(items)), edges)
+            if ins.name == name]
+
+
+def test_constants_are_folded():
+    assert _args([('PUSH', 2), ('PUSH', 3), 'ADD', ('PUSH', 1), 'SHL',
+                  'CALLER', 'SSTORE'], 'SSTORE') == [[None, 10]]
+
+
+def test_mapping_slot():
+    # keccak(key . 5) + 1
+    items = ['CALLER', ('PUSH', 0), 'MSTORE', ('PUSH', 5), ('PUSH', 0x20),
+             'MSTORE', ('PUSH', 0x40), ('PUSH', 0), 'SHA3', ('PUSH', 1),
+             'ADD', 'SLOAD']
+    assert _args(items, 'SLOAD') == [[KeccakSlot('mapping', 5, 1)]]
+
+
+def test_array_slot():
+    items = [('PUSH', 3), ('PUSH', 0), 'MSTORE', ('PUSH', 0x20), ('PUSH', 0),
+             'SHA3', 'SLOAD']
+    assert _args(items, 'SLOAD') == [[KeccakSlot('array', 3, 0)]]
+    # memory written by a copy is unknown
+    clobbered = items[:3] + [('PUSH', 0x20), ('PUSH', 0), ('PUSH', 0),
+                             'CALLDATACOPY'] + items[3:]
+    assert _args(clobbered, 'SLOAD') == [[None]]
+
+
+def test_values_flow_along_edges():
+    items = [('PUSH', 7), ('PUSHL', 'a'), 'JUMP', ('LABEL', 'a'), 'SLOAD']
+    assert _args(items, 'SLOAD') == [[None]]
+    assert _args(items, 'SLOAD', edges=True) == [[7]]
+    # entries that disagree
+    items = [('PUSH', 7), 'CALLVALUE', ('PUSHL', 'a'), 'JUMPI', 'POP',
+             ('PUSH', 8), ('LABEL', 'a'), 'SLOAD']
+    assert _args(items, 'SLOAD', edges=True) == [[None]]
@@ -0,0 +1,41 @@
+from ethersplay.common import code_hash
+from ethersplay.corpus import Corpus, CorpusWriter
+
+TOKEN = bytes.fromhex('6080604052')
+OTHER = bytes.fromhex('60016000f3')
+
+
+def test_writer_dedupes(tmp_path):
+    path = str(tmp_path)
+    with CorpusWriter(path) as writer:
+        token = writer.add(TOKEN, 'token')
+        assert writer.add(TOKEN, 'clone') == token
+        other = writer.add(OTHER)
+    assert token == code_hash(TOKEN)
+    with Corpus(path) as corpus:
+        assert len(corpus) == 2
+        assert sorted(corpus) == sorted([token, other])
+        assert corpus.names == {'token': token, 'clone': token}
+        assert bytes(corpus.get(other)) == OTHER
+        assert bytes(corpus.get_by_name('clone')) == TOKEN
+        assert dict((h, bytes(code)) for h, code in corpus.items()) == {
+            token: TOKEN, other: OTHER}
+
+
+def test_refresh_picks_up_new_entries(tmp_path):
+    path = str(tmp_path)
+    corpus = Corpus(path)
+    assert len(corpus) == 0
+    assert corpus.get(code_hash(TOKEN)) is None
+    with CorpusWriter(path) as writer:
+        token = writer.add(TOKEN)
+    assert token not in corpus
+    corpus.refresh()
+    assert token in corpus
+    # added to what is already stored
+    with CorpusWriter(path) as writer:
+        assert writer.add(TOKEN) == token
+        writer.add(OTHER)
+    corpus.refresh()
+    assert len(corpus) == 2
+    corpus.close()
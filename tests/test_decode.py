@@ -0,0 +1,38 @@
+from contracts import assemble
+
+from ethersplay.decode import basic_blocks, decode
+
+
+def test_instructions():
+    code = assemble([('PUSH', 0x1234), 'DUP1', 'SSTORE', 'STOP'])
+    instructions = decode(code, pc=0x10)
+    assert [(ins.pc, ins.name, ins.operand, ins.size) for ins in
+            instructions] == [(0x10, 'PUSH2', 0x1234, 3),
+                              (0x13, 'DUP1', None, 1),
+                              (0x14, 'SSTORE', None, 1),
+                              (0x15, 'STOP', None, 1)]
+    sstore = instructions[2]
+    assert (sstore.pops, sstore.pushes) == (2, 0)
+
+
+def test_truncated_push_is_zero_padded():
+    [ins] = decode(b'\x61\x12')
+    assert (ins.name, ins.operand, ins.size) == ('PUSH2', 0x1200, 3)
+
+
+def test_later_and_unknown_opcodes():
+    instructions = decode(bytes([0x5f, 0x5c, 0x5d, 0x5e, 0x48, 0x0c]))
+    assert [ins.name for ins in instructions] == [
+        'PUSH0', 'TLOAD', 'TSTORE', 'MCOPY', 'BASEFEE', 'INVALID']
+    push0 = instructions[0]
+    assert (push0.operand, push0.size, push0.pushes) == (None, 1, 1)
+
+
+def test_basic_blocks():
+    code = assemble([('PUSH', 1), ('PUSHL', 'a'), 'JUMPI', 'CALLER',
+                     ('LABEL', 'a'), 'POP', 'STOP', 'ADD'])
+    blocks = basic_blocks(decode(code))
+    # the JUMPI ends a block, the JUMPDEST starts one, so does the STOP
+    assert [[ins.name for ins in block] for block in blocks] == [
+        ['PUSH1', 'PUSH2', 'JUMPI'], ['CALLER'], ['JUMPDEST', 'POP', 'STOP'],
+        ['ADD']]
@@ -0,0 +1,50 @@
+import os
+
+from conftest import ROOT
+
+from ethersplay.diff import diff_bytecode, summarize
+
+with open(os.path.join(ROOT, 'examples', 'test.evm'), 'rb') as f:
+    CODE = f.read()
+SET_VALUE = 0x41
+# the block of set_value storing the value, `DUP1 PUSH1 0 DUP2 SWAP1 SSTORE`
+STORE_BLOCK = 0x61
+
+
+def _patch(code, offset, data):
+    return code[:offset] + data + code[offset + len(data):]
+
+
+def _functions(result, kind):
+    return dict((entry['old']['address'], entry)
+                for entry in result[kind])
+
+
+def test_changed_constant():
+    # value is stored to slot 1
+    result = diff_bytecode(CODE, _patch(CODE, 0x64, b'\x01'))
+    changed = _functions(result, 'changed')
+    assert list(changed) == [SET_VALUE]
+    assert changed[SET_VALUE]['match'] == 'selector'
+    assert changed[SET_VALUE]['blocks'] == {
+        'added': [], 'removed': [], 'changed': [[STORE_BLOCK, STORE_BLOCK]]}
+    assert summarize(result) == ('0 added, 0 removed, 1 changed, '
+                                 '2 unchanged functions')
+
+
+def test_renamed_function_matched_by_structure():
+    renamed = _patch(CODE, 0x37, bytes.fromhex('12345678'))
+    unchanged = _functions(diff_bytecode(CODE, renamed), 'unchanged')
+    assert unchanged[SET_VALUE]['match'] == 'structure'
+    assert unchanged[SET_VALUE]['new']['name'] == '0x12345678'
+
+
+def test_renamed_and_changed_function_matched_by_similarity():
+    renamed = _patch(CODE, 0x37, bytes.fromhex('12345678'))
+    # DUP2 -> DUP3 changes the structure of the store block
+    result = diff_bytecode(CODE, _patch(renamed, 0x65, b'\x82'))
+    changed = _functions(result, 'changed')
+    assert changed[SET_VALUE]['match'] == 'similarity'
+    assert changed[SET_VALUE]['blocks'] == {
+        'added': [STORE_BLOCK], 'removed': [STORE_BLOCK], 'changed': []}
+    assert result['added'] == result['removed'] == []
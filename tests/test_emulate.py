@@ -0,0 +1,60 @@
+import threading
+
+from contracts import assemble, synthetic
+
+from ethersplay.core import emulate
+from ethersplay.core.emulate import Emulator
+
+# the target is computed, 2 + (a - 2)
+COMPUTED = assemble([('PUSH', 2), ('PUSHL', 'a'), 'SUB', ('PUSH', 2), 'ADD',
+                     'JUMP', 'STOP', ('LABEL', 'a'), 'CALLER', ('PUSH', 1),
+                     'SSTORE', 'STOP'])
+CODE = synthetic(12, seed=2)
+
+
+def _explore_all(emulator):
+    resolved = {}
+    for start in sorted(emulator.jumpdests | {0}):
+        for source, targets in emulator.explore(start).items():
+            resolved.setdefault(source, set()).update(targets)
+    return resolved
+
+
+def test_computed_jump():
+    emulator = Emulator(COMPUTED)
+    target = COMPUTED.index(b'\x5b')
+    assert emulator.explore(0) == {9: {target}}
+    assert emulator.constant_args(target + 4) == [{1}, None]
+    assert not emulator.truncated
+
+
+def test_memo_is_bounded(monkeypatch):
+    expected = _explore_all(Emulator(CODE))
+    monkeypatch.setattr(emulate, 'MEMO_SIZE', 16)
+    emulator = Emulator(CODE)
+    assert _explore_all(emulator) == expected
+    assert len(emulator._memo) == 16
+    emulator.clear_memo()
+    assert not emulator._memo
+    assert emulator.targets
+
+
+def test_concurrent_explore():
+    expected = Emulator(CODE)
+    _explore_all(expected)
+    emulator = Emulator(CODE)
+    threads = [threading.Thread(target=_explore_all, args=(emulator,))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert emulator.targets == expected.targets
+    assert emulator.values.keys() == expected.values.keys()
+
+
+def test_memo_dropped_after_initial_analysis(load_view):
+    view = load_view(CODE)
+    emulator = view.session_data['emulator']
+    assert emulator.targets
+    assert not emulator._memo
@@ -0,0 +1,50 @@
+from binaryninja import MediumLevelILOperation
+
+from ethersplay.evmvisitor import BNILVisitor, TailCall
+
+
+class _Expr(object):
+    def __init__(self, operation, src=None, constant=None):
+        self.operation = operation
+        self.src = src
+        self.constant = constant
+
+
+class _Visitor(BNILVisitor):
+    """Follows MLIL_VAR_SSA to its src, memoized per expression."""
+
+    def memo_key(self, expression):
+        return id(expression)
+
+    def visit_MLIL_VAR_SSA(self, expression):
+        return TailCall(expression.src)
+
+    def visit_MLIL_CONST(self, expression):
+        return expression.constant
+
+
+def _chain(length, end):
+    expression = end
+    chain = []
+    for _ in range(length):
+        expression = _Expr(MediumLevelILOperation.MLIL_VAR_SSA, expression)
+        chain.append(expression)
+    return chain
+
+
+def test_long_chains_are_memoized():
+    const = _Expr(MediumLevelILOperation.MLIL_CONST, constant=7)
+    chain = _chain(50000, const)
+    visitor = _Visitor()
+    assert visitor.visit(chain[-1]) == 7
+    # every expression of the chain is answered from the memo
+    assert len(visitor._results) == len(chain) + 1
+    assert visitor.visit(chain[0]) == 7
+
+
+def test_cycles_give_up():
+    chain = _chain(3, None)
+    chain[0].src = chain[-1]
+    visitor = _Visitor()
+    assert visitor.visit(chain[-1]) is None
+    assert visitor._results[id(chain[1])] is None
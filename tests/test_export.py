@@ -0,0 +1,23 @@
+import sqlite3
+
+from contracts import synthetic
+from ethersplay.corpus import CorpusWriter
+from ethersplay.export import corpus_tasks, export_tasks
+
+
+def test_corpus_entries_are_exported_with_their_names(tmp_path):
+    path = str(tmp_path / 'corpus')
+    database = str(tmp_path / 'export.sqlite')
+    with CorpusWriter(path) as writer:
+        first = writer.add(synthetic(3), 'first')
+        second = writer.add(synthetic(4, seed=1))
+
+    tasks = corpus_tasks(path, database)
+    assert sorted(task[2:] for task in tasks) == sorted(
+        [(first, 'first'), (second, None)])
+    assert export_tasks(database, tasks, jobs=1) == (2, 0)
+    with sqlite3.connect(database) as db:
+        assert dict(db.execute('SELECT hash, name FROM contracts')) == {
+            first: 'first', second: None}
+    # exported entries are not exported again
+    assert corpus_tasks(path, database) == []
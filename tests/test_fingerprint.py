@@ -0,0 +1,67 @@
+import random
+
+from evm_cfg_builder.cfg import CFG
+
+from contracts import synthetic
+
+from ethersplay.fingerprint import (LSH_BANDS, FingerprintIndex,
+                                    fingerprint_blocks, lookup_cfg_names,
+                                    lsh_buckets, minhash, shingles)
+
+BLOCKS = [['PUSH1', 'DUP1'], ['JUMPDEST', 'ADD', 'PUSH2', 'SSTORE']]
+
+
+def _function(seed, size=60):
+    rng = random.Random(seed)
+    names = ['PUSH1', 'DUP1', 'DUP2', 'SWAP1', 'ADD', 'MSTORE', 'SLOAD',
+             'SSTORE', 'CALLER', 'EQ', 'ISZERO', 'POP', 'AND', 'SHA3']
+    return [[rng.choice(names) for _ in range(size)]]
+
+
+def test_shingles():
+    # JUMPDESTs and block boundaries are dropped, PUSH widths ignored
+    assert shingles(BLOCKS) == {'PUSH DUP1 ADD', 'DUP1 ADD PUSH',
+                                'ADD PUSH SSTORE'}
+    assert shingles([['PUSH2', 'DUP1', 'ADD', 'PUSH1', 'JUMPDEST',
+                      'SSTORE']]) == shingles(BLOCKS)
+
+
+def test_minhash_is_stable():
+    # signatures are stored in the index, they must not change between
+    # sessions or versions
+    signature = minhash(shingles(BLOCKS))
+    assert signature[:2] == (545600878969059261, 84274696510964153)
+    assert minhash(set(reversed(sorted(shingles(BLOCKS))))) == signature
+    assert len(list(lsh_buckets(signature))) == LSH_BANDS
+    # too small to tell functions apart
+    assert fingerprint_blocks(BLOCKS) is None
+
+
+def test_near_duplicates_are_found(tmp_path):
+    index = FingerprintIndex(str(tmp_path / 'fingerprints.sqlite'))
+    original = _function(1)
+    index.add('a', 1, 'transfer', 'moves tokens', fingerprint_blocks(original))
+    index.add('a', 2, 'other', '', fingerprint_blocks(_function(2)))
+    assert len(index) == 2
+
+    changed = [list(original[0])]
+    changed[0][30] = 'SLOAD' if changed[0][30] != 'SLOAD' else 'CALLER'
+    score, name, comment = index.query(fingerprint_blocks(changed))
+    assert (name, comment) == ('transfer', 'moves tokens')
+    assert 0.8 <= score < 1
+    # not the contract itself
+    assert index.query(fingerprint_blocks(original), exclude='a') is None
+    assert index.query(fingerprint_blocks(_function(3))) is None
+    # indexing a function again replaces it
+    index.add('a', 1, 'transfer2', '', fingerprint_blocks(original))
+    assert len(index) == 2
+    assert index.query(fingerprint_blocks(original))[1] == 'transfer2'
+    index.close()
+
+
+def test_lookup_in_empty_index(tmp_path):
+    cfg = CFG(synthetic(4, seed=6))
+    filename = str(tmp_path / 'fingerprints.sqlite')
+    assert lookup_cfg_names(cfg, filename) == {}
+    FingerprintIndex(filename).close()
+    assert lookup_cfg_names(cfg, filename) == {}
@@ -0,0 +1,49 @@
+import os
+
+from contracts import assemble
+from conftest import ROOT
+from evm_cfg_builder.cfg import CFG
+
+from ethersplay.decode import decode
+from ethersplay.gas import (analyze_cfg, block_costs, gas_table,
+                            instruction_costs, worst_case_path)
+
+SLOAD = 0x54
+
+
+def test_sload_cost():
+    assert gas_table('istanbul')[SLOAD] == (800, 800)
+    # EIP-2929 warm / cold access
+    assert gas_table('berlin')[SLOAD] == (100, 2100)
+    assert gas_table('cancun')[SLOAD] == (100, 2100)
+
+
+def test_block_costs():
+    code = assemble([('PUSH', 0x20), ('PUSH', 0), 'MSTORE', 'STOP',
+                     ('PUSH', 1), 'SLOAD', 'STOP'])
+    costs = instruction_costs(decode(code))
+    assert costs[2] == (4, 3, 3, 32)
+    # one word of memory expansion on top of the three instructions
+    assert block_costs(costs, [(0, 6), (6, len(code))]) == {
+        0: (9, 12), 6: (103, 2103)}
+
+
+def test_worst_case_path():
+    graph = {'a': ['b', 'c'], 'b': ['d'], 'c': ['d', 'a'], 'd': []}
+    cost = {'a': 1, 'b': 10, 'c': 5, 'd': 2}
+    assert worst_case_path('a', graph.get, cost.get) == (13, True)
+    del graph['c'][1]
+    assert worst_case_path('a', graph.get, cost.get) == (13, False)
+
+
+def test_example():
+    with open(os.path.join(ROOT, 'examples', 'test.evm'), 'rb') as f:
+        cfg = CFG(f.read())
+    functions = dict((f['name'], f) for f in analyze_cfg(cfg)['functions'])
+    assert functions['set_value(uint256)'] == {
+        'name': 'set_value(uint256)', 'address': 0x41, 'worst_case': 22193,
+        'loops': False}
+    assert functions['_dispatcher']['worst_case'] == 109
+    # 2100 less for a cold SSTORE before berlin
+    functions = analyze_cfg(cfg, 'istanbul')['functions']
+    assert functions[0]['worst_case'] == 20093
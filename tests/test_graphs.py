@@ -0,0 +1,73 @@
+import os
+import re
+import json
+from xml.etree import ElementTree
+
+import pytest
+from conftest import ROOT
+
+from ethersplay.core.graphs import FORMATS, code_graphs, export_code
+
+EXAMPLE = os.path.join(ROOT, 'examples', 'test.evm')
+with open(EXAMPLE, 'rb') as f:
+    CODE = f.read()
+GRAPHS = list(code_graphs(CODE))
+GRAPHML = '{http://graphml.graphdrawing.org/xmlns}'
+
+
+def _nodes(graphs):
+    return sorted((g.address, start) for g in graphs for start, _ in
+                  g.blocks)
+
+
+def _edges(graphs):
+    return sorted((g.address, source, target, kind) for g in graphs
+                  for source, target, kind in g.edges)
+
+
+def test_example_graphs():
+    assert sorted((g.address, g.name) for g in GRAPHS) == [
+        (0, '_dispatcher'), (64, '_fallback'), (66, 'set_value(uint256)')]
+    # the dispatcher's JUMPI to set_value
+    assert (0, 12, 65, 'TrueBranch') in _edges(GRAPHS)
+
+
+@pytest.mark.parametrize('fmt', sorted(FORMATS))
+def test_export(tmp_path, fmt):
+    filename = str(tmp_path / ('test.' + fmt))
+    assert export_code(CODE, filename, fmt) == len(GRAPHS)
+    assert os.listdir(str(tmp_path)) == ['test.' + fmt]
+    with open(filename) as f:
+        text = f.read()
+
+    if fmt == 'json':
+        exported = json.loads(text)
+        assert exported['name'] == 'test.json'
+        functions = exported['functions']
+        nodes = sorted((f['address'], b['start']) for f in functions
+                       for b in f['blocks'])
+        edges = sorted(tuple([f['address']] + e) for f in functions
+                       for e in f['edges'])
+        dispatcher = [f for f in functions if f['address'] == 0][0]
+        assert dispatcher['blocks'][0]['instructions'][0] == [
+            0, 'PUSH1 #60']
+    elif fmt == 'graphml':
+        graph = ElementTree.fromstring(text).find(GRAPHML + 'graph')
+        nodes = sorted(tuple(int(n, 16) for n in node.get('id').split('_'))
+                       for node in graph.iter(GRAPHML + 'node'))
+        edges = sorted(
+            tuple(int(n, 16) for n in edge.get('source').split('_')) +
+            (int(edge.get('target').split('_')[1], 16),
+             edge.find(GRAPHML + 'data').text)
+            for edge in graph.iter(GRAPHML + 'edge'))
+    else:
+        colors = {'green': 'TrueBranch', 'red': 'FalseBranch',
+                  'blue': 'UnconditionalBranch'}
+        nodes = sorted((int(f, 16), int(b, 16)) for f, b in re.findall(
+            r'^    "(\w+)_(\w+)" \[label=', text, re.M))
+        edges = sorted((int(f, 16), int(s, 16), int(t, 16), colors[c])
+                       for f, s, _, t, c in re.findall(
+            r'"(\w+)_(\w+)" -> "(\w+)_(\w+)" \[color=(\w+)\]', text))
+        assert text.startswith('digraph "test.dot" {')
+    assert nodes == _nodes(GRAPHS)
+    assert edges == _edges(GRAPHS)
@@ -0,0 +1,35 @@
+"""
+The core and the command line tools run without Binary Ninja: these run in
+a fresh interpreter without the stand-in binaryninja module.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+CLIS = ['ingest', 'export', 'search', 'calls', 'diff', 'trace', 'sourcemap',
+        'gas', 'snapshot', 'proxy', 'core.contract', 'core.graphs']
+
+
+def _run(*args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable] + list(args), cwd=ROOT, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def test_core_does_not_import_binaryninja():
+    result = _run('-c', 'import sys\n'
+                  'from ethersplay import core, corpus, fingerprint, storage\n'
+                  'core.analyze(open("examples/test.evm", "rb").read())\n'
+                  'assert "binaryninja" not in sys.modules')
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.mark.parametrize('cli', CLIS)
+def test_cli_runs_without_binaryninja(cli):
+    result = _run('-m', 'ethersplay.' + cli, '--help')
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,126 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ethersplay.corpus import Corpus
+from ethersplay.ingest import (MANIFEST_NAME, RpcError, fetch_code, ingest,
+                               normalize_address)
+
+TOKEN = '0x' + '11' * 20
+CLONE = '0x' + '22' * 20
+EOA = '0x' + '33' * 20
+BROKEN = '0x' + '44' * 20
+CODE = {TOKEN: '0x6080604052', CLONE: '0x6080604052', EOA: '0x'}
+
+
+class _Node(BaseHTTPRequestHandler):
+    """eth_getCode of CODE over keep-alive connections."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.batches += 1
+            server.clients.add(self.client_address)
+        request = json.loads(self.rfile.read(
+            int(self.headers['Content-Length'])))
+        if server.status != 200:
+            self._reply(server.status, b'')
+            return
+        if server.reject:
+            # what some nodes answer a batch they refuse with
+            reply = {'jsonrpc': '2.0', 'id': None,
+                     'error': {'code': -32005, 'message': 'batch too large'}}
+        else:
+            reply = []
+            for call in request:
+                address, block = call['params']
+                assert call['method'] == 'eth_getCode' and block == 'latest'
+                if address == BROKEN:
+                    reply.append({'jsonrpc': '2.0', 'id': call['id'],
+                                  'error': {'code': -32000,
+                                            'message': 'missing trie node'}})
+                else:
+                    reply.append({'jsonrpc': '2.0', 'id': call['id'],
+                                  'result': CODE.get(address, '0x')})
+        self._reply(200, json.dumps(reply).encode('utf-8'))
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def node():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Node)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.batches = 0
+    server.clients = set()
+    server.status = 200
+    server.reject = False
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,),
+                              daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}/rpc'.format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_code_in_batches(node):
+    codes = fetch_code([TOKEN.upper().replace('0X', '0x'), CLONE[2:], EOA,
+                        BROKEN], node.url, batch_size=2, concurrency=1)
+    # no code and failed calls are skipped
+    assert codes == {TOKEN: bytes.fromhex('6080604052'),
+                     CLONE: bytes.fromhex('6080604052')}
+    assert node.batches == 2
+    # one keep-alive connection
+    assert len(node.clients) == 1
+
+
+def test_failed_batches_raise(node):
+    node.status = 502
+    with pytest.raises(RpcError):
+        fetch_code([TOKEN], node.url)
+    node.status = 200
+    node.reject = True
+    with pytest.raises(RpcError):
+        fetch_code([TOKEN], node.url)
+
+
+def test_ingest_dedupes_evm_files(node, tmp_path):
+    output_dir = str(tmp_path / 'out')
+    manifest = ingest([TOKEN, CLONE, EOA], output_dir, node.url)
+    assert manifest[TOKEN] == manifest[CLONE]
+    assert EOA not in manifest
+    files = sorted(p.name for p in (tmp_path / 'out').iterdir())
+    assert files == sorted([manifest[TOKEN], MANIFEST_NAME])
+    # a second run adds to the manifest
+    ingest([TOKEN], output_dir, node.url)
+    with open(str(tmp_path / 'out' / MANIFEST_NAME)) as f:
+        assert json.load(f) == manifest
+
+
+def test_ingest_into_corpus(node, tmp_path):
+    path = str(tmp_path / 'corpus')
+    hashes = ingest([TOKEN, CLONE], path, node.url, corpus=True)
+    with Corpus(path) as corpus:
+        assert len(corpus) == 1
+        assert corpus.names == hashes
+        assert bytes(corpus.get(hashes[TOKEN])) == bytes.fromhex('6080604052')
+
+
+def test_invalid_addresses():
+    with pytest.raises(ValueError):
+        normalize_address('0x1234')
+    with pytest.raises(ValueError):
+        normalize_address('0x' + 'zz' * 20)
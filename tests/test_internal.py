@@ -0,0 +1,63 @@
+import gc
+
+from binaryninja import Symbol, SymbolType
+from contracts import assemble, deep_calls, synthetic
+
+from ethersplay import fingerprint, internal
+from ethersplay.core.internal import find_internal_functions
+
+# the JUMP at 8 calls c0 in CALLS, in STOPS c0 does not return
+CALLS = assemble([('PUSHL', 'end'), ('PUSH', 1), ('PUSHL', 'c0'), 'JUMP',
+                  ('LABEL', 'end'), 'STOP',
+                  ('LABEL', 'c0'), ('PUSH', 1), 'ADD', 'SWAP1', 'JUMP'])
+STOPS = assemble([('PUSHL', 'end'), ('PUSH', 1), ('PUSHL', 'c0'), 'JUMP',
+                  ('LABEL', 'end'), 'STOP',
+                  ('LABEL', 'c0'), ('PUSH', 1), 'ADD', 'STOP', 'STOP'])
+
+
+def test_nested_internal_functions():
+    functions, calls = find_internal_functions(deep_calls(5))
+    assert len(functions) == 5
+    assert len(calls) == 5
+    assert all(len(function.returns) == 1 for function in functions.values())
+
+
+def test_calls_are_looked_up_in_their_view(load_view):
+    calls = load_view(CALLS)
+    stops = load_view(STOPS)
+    jump = CALLS[8:9]
+    assert STOPS[8:9] == jump
+    assert internal.call_at(jump, 8, calls).entry == 11
+    assert internal.call_at(jump, 8, stops) is None
+    # without a view, the views with these bytes disagree
+    assert internal.call_at(jump, 8) is None
+    assert internal.is_return(CALLS[16:17], 16, calls)
+    assert not internal.is_return(STOPS[16:17], 16, stops)
+
+
+def test_closed_views_are_dropped(load_view):
+    gc.collect()
+    view = load_view(CALLS)
+    assert view in internal._recovered
+    count = len(internal._recovered)
+    del view
+    gc.collect()
+    assert len(internal._recovered) == count - 1
+
+
+def test_indexed_names_are_found_in_the_same_code(load_view, tmp_path):
+    filename = str(tmp_path / 'fingerprints.sqlite')
+    code = synthetic(8, seed=1)
+    named = load_view(code)
+    cfg = named.session_data['cfg']
+    for function in cfg.functions:
+        if function.name.startswith('0x'):
+            named.define_auto_symbol(Symbol(
+                SymbolType.FunctionSymbol, function.start_addr + 1,
+                'f_' + function.name))
+    assert fingerprint.index_view(named, filename) == 8
+
+    view = load_view(code)
+    names = fingerprint.lookup_cfg_names(
+        view.session_data['cfg'], filename, view.session_data['internal'])
+    assert len(names) == 8
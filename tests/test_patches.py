@@ -0,0 +1,53 @@
+from contracts import synthetic
+
+from ethersplay import analysis
+from ethersplay.analysis import PatchTaskThread, merge_ranges
+from ethersplay.core.cfg import view_address
+
+CODE = synthetic(6, seed=5)
+
+
+def test_merge_ranges():
+    assert merge_ranges([(8, 10), (0, 4), (2, 6), (6, 7), (20, 21)]) == [
+        (0, 7), (8, 10), (20, 21)]
+
+
+def test_patches_queued_meanwhile_are_merged(load_view, monkeypatch):
+    view = load_view(CODE)
+    batches = []
+    monkeypatch.setattr(analysis, 'reanalyze_patches',
+                        lambda thread, view, ranges, shifted=False:
+                        batches.append((ranges, shifted)))
+    # as if the view's patch task were still busy
+    view.session_data['patch_task'] = True
+    view.write(0x20, b'\x01\x02')
+    view.write(0x21, b'\x03\x04')
+    view.write(0x40, b'\x05')
+    assert batches == []
+    PatchTaskThread(view).start()
+    assert batches == [([(0x20, 0x23), (0x40, 0x41)], False)]
+    assert view.session_data['patches'] == []
+    assert not view.session_data['patch_task']
+    # the next patch starts the task again
+    view.write(0x40, b'\x06')
+    assert batches[-1] == ([(0x40, 0x41)], False)
+
+
+def test_inserted_bytes_reanalyze_the_whole_view(load_view, monkeypatch):
+    view = load_view(CODE)
+    warnings = []
+    infos = []
+    monkeypatch.setattr(analysis, 'log_warn', warnings.append)
+    monkeypatch.setattr(analysis, 'log_info', infos.append)
+    view.insert(len(CODE), b'\x5b')
+    assert any('re-analyzing the whole view' in w for w in warnings)
+    # every function, not only those around the inserted byte
+    cfg = view.session_data['cfg']
+    assert infos[-1].startswith('[VSA] patch at 0x0-{:#x}: {} functions '
+                                're-analyzed'.format(len(CODE) + 1,
+                                                     len(cfg.functions)))
+    assert cfg.bytecode == CODE + b'\x5b'
+    for function in cfg.functions:
+        assert view.get_function_at(view_address(function.start_addr))
+    view.remove(len(CODE), 1)
+    assert view.session_data['cfg'].bytecode == CODE
@@ -0,0 +1,50 @@
+from contracts import assemble
+
+from ethersplay.common import code_hash
+from ethersplay.core.payloads import find_payloads, payload_ranges
+
+RUNTIME = assemble(['CALLER', ('PUSH', 0), 'SSTORE', 'STOP'])
+
+
+def _copy(offset, size):
+    return [('PUSH', size), ('PUSH', offset), ('PUSH', 0), 'CODECOPY']
+
+
+def _constructor(offsets, size, data):
+    """Copy size bytes out of every offset into data, appended to the code."""
+    def head(offsets):
+        items = []
+        for offset in offsets:
+            items += _copy(offset, size)
+        return assemble(items + ['STOP'])
+    start = len(head([0xff] * len(offsets)))
+    return head([start + offset for offset in offsets]) + data
+
+
+def test_ranges_and_hash():
+    size = len(RUNTIME)
+    code = _constructor([0, 0, size], size, RUNTIME * 2)
+    [payload] = find_payloads(code)
+    start = len(code) - 2 * size
+    assert payload.hash == code_hash(RUNTIME)
+    assert bytes(payload.data) == RUNTIME
+    assert payload.ranges == [(start, size), (start + size, size)]
+    assert len(payload.sites) == 3
+    assert payload_ranges([payload]) == [(start, start + 2 * size)]
+
+
+def test_self_copies_are_skipped():
+    # copies the whole code, including itself
+    code = assemble(_copy(0, 9) + ['STOP'])
+    assert find_payloads(code) == []
+
+
+def test_nested():
+    creation = _constructor([0], len(RUNTIME), RUNTIME)
+    code = _constructor([0], len(creation), creation)
+    # the copy in the embedded constructor is decoded too, relative to the
+    # wrong code, so look the payload up by hash
+    payloads = dict((p.hash, p) for p in find_payloads(code))
+    payload = payloads[code_hash(creation)]
+    assert payload.hash == code_hash(creation)
+    assert code_hash(RUNTIME) in [child.hash for child in payload.children]
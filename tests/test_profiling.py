@@ -0,0 +1,34 @@
+import pytest
+from contracts import synthetic
+
+from ethersplay import profiling
+
+
+@pytest.fixture
+def enabled():
+    profiling.enable()
+    yield
+    profiling.disable()
+
+
+def test_counters_are_per_view(load_view, enabled):
+    small = load_view(synthetic(2))
+    large = load_view(synthetic(6, seed=1))
+    small_calls = profiling.report(small)['calls']
+    large_calls = profiling.report(large)['calls']
+    assert small_calls['EVMView.init']['calls'] == 1
+    assert large_calls['EVMView.init']['calls'] == 1
+    # nested calls count for the view too
+    assert (small_calls['Emulator.explore']['calls'] <
+            large_calls['Emulator.explore']['calls'])
+    assert 'indirect branches' in profiling.report(small)['caches']
+    # calls made for no view are reported with every view
+    profiling.cache('test', True)
+    shared = profiling.report()['caches']
+    assert list(shared) == ['test']
+    assert profiling.report(small)['shared']['caches'] == shared
+    assert 'test' not in profiling.report(small)['caches']
+
+    # enabling again starts every view from zero
+    profiling.enable()
+    assert profiling.report(small)['calls'] == {}
@@ -0,0 +1,38 @@
+from ethersplay.proxy import EIP1967_ADMIN_SLOT, _SLOTS, classify
+
+IMPLEMENTATION = 'be' * 20
+
+
+def _minimal_proxy(address):
+    push = bytes([0x5f + len(address)])
+    return (bytes.fromhex('363d3d373d3d3d363d') + push + address +
+            bytes.fromhex('5af43d82803e903d91602b57fd5bf3'))
+
+
+def test_minimal_proxy():
+    info = classify(_minimal_proxy(bytes.fromhex(IMPLEMENTATION)))
+    assert info.kind == 'EIP-1167 minimal proxy'
+    assert info.implementation == '0x' + IMPLEMENTATION
+    assert info.skip_analysis
+    # vanity addresses are pushed shorter
+    info = classify(_minimal_proxy(bytes.fromhex('00ff')))
+    assert info.implementation == '0x' + '00' * 18 + '00ff'
+    # trailing bytes are not a minimal proxy
+    assert classify(_minimal_proxy(bytes.fromhex(IMPLEMENTATION)) +
+                    b'\x00') is None
+
+
+def test_slot_proxies():
+    slot = bytes.fromhex(_SLOTS[0][1])
+    code = b'\x7f' + slot + b'\x54\x36\x60\x00\xf4'
+    info = classify(code)
+    assert info.kind == 'EIP-1967 proxy'
+    assert info.slot == '0x' + _SLOTS[0][1]
+    assert info.skip_analysis
+    admin = b'\x7f' + bytes.fromhex(EIP1967_ADMIN_SLOT)
+    info = classify(code + admin)
+    assert info.kind == 'EIP-1967 transparent proxy'
+    # large contracts are analyzed
+    assert not classify(code + b'\x00' * 600).skip_analysis
+    # without a DELEGATECALL the slot is only read
+    assert classify(code[:-1]) is None
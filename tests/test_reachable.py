@@ -0,0 +1,88 @@
+from binaryninja import Function, SegmentFlag
+from evm_cfg_builder.cfg import CFG
+
+from contracts import assemble, synthetic
+from ethersplay import analysis
+from ethersplay.core.reachable import find_unreachable
+from ethersplay.core.segments import UNREACHABLE, find_segments
+
+# 20 dispatched functions followed by 20 nothing calls
+DEAD_CODE = synthetic(20, seed=3, dead=20)
+DEAD_START, DEAD_END = 1315, 2395
+
+
+def test_uncalled_functions_are_unreachable(load_view):
+    view = load_view(DEAD_CODE)
+    unreachable = view.session_data['unreachable']
+    assert unreachable.ranges == [(DEAD_START, DEAD_END)]
+    assert unreachable.size == DEAD_END - DEAD_START
+    assert unreachable.instructions == 720
+    for function in view.functions:
+        for bb in function.basic_blocks:
+            assert not DEAD_START <= bb.start < DEAD_END
+    assert not view.is_offset_executable(DEAD_START)
+    assert view.is_offset_executable(DEAD_END)
+
+
+def test_bytes_after_terminator_without_cfg():
+    code = assemble([('PUSHL', 'a'), 'JUMP', 'ADD', 'POP', ('LABEL', 'a'),
+                     'STOP', 'INVALID', 'INVALID'])
+    unreachable = find_unreachable(code)
+    # ADD POP after the JUMP, the INVALIDs after the STOP
+    assert unreachable.ranges == [(4, 6), (8, 10)]
+    assert unreachable.instructions == 4
+    assert find_unreachable(code, CFG(code)) == unreachable
+
+
+def test_unresolved_jump_keeps_every_jumpdest():
+    # the target is computed, so the JUMPDEST nothing pushes may be it
+    code = assemble([('PUSH', 2), ('PUSH', 4), 'ADD', 'JUMP', 'STOP',
+                     ('LABEL', 'x'), 'STOP'])
+    # only the STOP after the JUMP
+    assert find_unreachable(code, CFG(code)).ranges == [(6, 7)]
+
+
+def test_unreachable_segments():
+    segments = find_segments(DEAD_CODE, unreachable=[(10, 20)])
+    assert [s for s in segments if s.kind == UNREACHABLE] == [
+        (10, 20, UNREACHABLE)]
+    assert segments[0].end == 10 and segments[2].start == 20
+
+
+def _cleared_branches(monkeypatch):
+    cleared = []
+    original = Function.set_user_indirect_branches
+
+    def record(self, source, branches):
+        if not branches:
+            cleared.append(source)
+        return original(self, source, branches)
+    monkeypatch.setattr(Function, 'set_user_indirect_branches', record)
+    return cleared
+
+
+def test_patch_clears_only_branches_of_patched_bytes(load_view, monkeypatch):
+    view = load_view(DEAD_CODE)
+    function = view.get_function_at(0xec)
+    before = set(b.source_addr for b in function.indirect_branches)
+    assert before
+
+    cleared = _cleared_branches(monkeypatch)
+    # the operand of the function's first PUSH1 0x04
+    view.write(0xed, b'\x24')
+    assert cleared == []
+    assert set(b.source_addr for b in function.indirect_branches) == before
+    assert view.session_data['unreachable'].ranges == [(DEAD_START, DEAD_END)]
+
+
+def test_patch_into_unreachable_code_warns(load_view, monkeypatch):
+    view = load_view(DEAD_CODE)
+    warnings = []
+    monkeypatch.setattr(analysis, 'log_warn', warnings.append)
+    # the dispatcher's first PUSH2 <function> now pushes a dead function
+    view.write(0x13, DEAD_START.to_bytes(2, 'big'))
+    assert any('{:#x}-{:#x}'.format(DEAD_START, DEAD_END) in w
+               for w in warnings)
+    # still data until the file is opened again
+    assert not view.is_offset_executable(DEAD_START)
+    assert view.segments[1][2] & SegmentFlag.SegmentDenyExecute
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from contracts import assemble, synthetic
+from ethersplay import search
+from ethersplay.corpus import CorpusWriter
+from ethersplay.search import SearchIndex, extract_code, index_corpus
+
+
+@pytest.fixture
+def index(tmp_path):
+    with SearchIndex(str(tmp_path / 'search.sqlite')) as index:
+        index.write(extract_code(synthetic(4)), 'synthetic')
+        yield index
+
+
+def _scanned(index, query):
+    """The hits of query found by scanning every contract."""
+    pattern = search._pattern(search.parse_query(query))
+    ops = index._contract_ops(1)
+    pcs = search._unpack(index.db.execute(
+        "SELECT pcs FROM contracts WHERE id = 1").fetchone()[0])
+    return [pcs[m.start()] for m in pattern.finditer(ops)]
+
+
+@pytest.mark.parametrize('query', ['SHA3 SSTORE', 'CALLER', 'SSTORE',
+                                   'CALLER ? MSTORE', 'DUP1 PUSH*|EQ'])
+def test_index_finds_what_a_scan_finds(index, query):
+    assert index._candidates(search.parse_query(query)) is not None
+    hits = [hit.address for hit in index.search(query)]
+    assert hits == _scanned(index, query)
+    assert hits
+
+
+def test_short_grams_do_not_collide_with_stops(tmp_path):
+    with SearchIndex(str(tmp_path / 'search.sqlite')) as index:
+        index.write(extract_code(assemble(['STOP', 'STOP', 'SLOAD']), False))
+        index.write(extract_code(assemble(['CALLER', 'SLOAD']), False))
+        assert [hit.address for hit in index.search('SLOAD')] == [2, 1]
+        assert [hit.address for hit in index.search('STOP STOP')] == [0]
+
+
+def test_old_indexes_get_short_grams(tmp_path):
+    filename = str(tmp_path / 'search.sqlite')
+    with SearchIndex(filename) as index:
+        index.write(extract_code(assemble(['CALLER', 'SLOAD']), False))
+    with sqlite3.connect(filename) as db:
+        db.execute("DELETE FROM grams WHERE gram >= ?",
+                   (1 << 8 * search.NGRAM_SIZE,))
+        db.execute("PRAGMA user_version = 0")
+    with SearchIndex(filename) as index:
+        assert [hit.address for hit in index.search('CALLER SLOAD')] == [0]
+
+
+def test_corpus_index_names_entries(tmp_path):
+    path = str(tmp_path / 'corpus')
+    with CorpusWriter(path) as writer:
+        writer.add(synthetic(3), 'first')
+        writer.add(synthetic(4, seed=1), 'second')
+    assert index_corpus(path, jobs=1) == (2, 0)
+    # only new entries are indexed
+    assert index_corpus(path, jobs=1) == (0, 0)
+    with SearchIndex(search.corpus_index_path(path)) as index:
+        names = set(hit.name for hit in index.search('CALLER'))
+    assert names == {'first', 'second'}
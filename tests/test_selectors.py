@@ -0,0 +1,59 @@
+from contracts import assemble
+
+from ethersplay.core import contract, selectors
+from ethersplay.core.selectors import _keccak, push_candidates
+from ethersplay.decode import basic_blocks, decode
+
+SET = '0x' + _keccak('set(uint256)')[:8]
+TOPIC = '0x' + _keccak('Set(uint256)')
+CONSTANT = 0xc0ffee << 200
+
+# the layout solc 0.8 emits for `function set(uint256 v) { x = v;
+# emit Set(v); }`: the topic is pushed, the data is encoded by an
+# abi_encode_tuple helper (itself calling abi_encode_t_uint256) and LOG1 is
+# in the block the helper returns to
+EMIT = assemble([
+    # dispatcher, with the selector mask of older solc
+    ('PUSH', 0), 'CALLDATALOAD', ('PUSH', 0xe0), 'SHR',
+    ('PUSH', 0xffffffff), 'AND', 'DUP1', ('PUSH', int(SET, 16)), 'EQ',
+    ('PUSHL', 'set'), 'JUMPI', ('PUSH', 0), 'DUP1', 'REVERT',
+    ('LABEL', 'set'), ('PUSHL', 'stop'), ('PUSH', 4), 'CALLDATALOAD',
+    ('PUSHL', 'body'), 'JUMP',
+    ('LABEL', 'stop'), 'STOP',
+    ('LABEL', 'body'), 'DUP1', ('PUSH', 0), 'SSTORE',
+    ('PUSH', int(TOPIC, 16)), 'DUP2', ('PUSH', 0x40), 'MLOAD',
+    ('PUSHL', 'logs'), 'SWAP2', 'SWAP1', ('PUSHL', 'tuple'), 'JUMP',
+    ('LABEL', 'logs'), ('PUSH', 0x40), 'MLOAD', 'DUP1', 'SWAP2', 'SUB',
+    'SWAP1', 'LOG1', 'POP', 'JUMP',
+    ('LABEL', 'tuple'), ('PUSH', 0), ('PUSH', 0x20), 'DUP3', 'ADD', 'SWAP1',
+    'POP', ('PUSHL', 'tuple_ret'), ('PUSH', 0), 'DUP4', 'ADD', 'DUP5',
+    ('PUSHL', 'uint'), 'JUMP',
+    ('LABEL', 'tuple_ret'), 'SWAP3', 'SWAP2', 'POP', 'POP', 'JUMP',
+    ('LABEL', 'uint'), 'DUP1', 'DUP3', 'MSTORE', 'POP', 'POP', 'JUMP',
+    # a constant that is never logged
+    ('LABEL', 'constant'), ('PUSH', CONSTANT), ('PUSH', 1), 'SSTORE',
+    'STOP'])
+
+
+def _candidates(code):
+    found = ([], [])
+    push_candidates(basic_blocks(decode(code)), *found)
+    return [sig for _, sig in found[0]], [sig for _, sig in found[1]]
+
+
+def test_topics_logged_after_the_abi_encoder():
+    found_selectors, topics = _candidates(EMIT)
+    assert topics == [TOPIC]
+    # the mask is not a selector
+    assert found_selectors == [SET]
+
+
+def test_topics_resolved_from_the_local_signatures(tmp_path, monkeypatch):
+    filename = tmp_path / 'signatures.txt'
+    filename.write_text('set(uint256)\nSet(uint256)\n')
+    monkeypatch.setattr(selectors, 'LOCAL_SIGNATURES_FILE', str(filename))
+    monkeypatch.setattr(selectors, '_local_signatures', None)
+    info = contract.analyze(EMIT, online=False, emulate=False)
+    assert list(info['topics'].values()) == [TOPIC]
+    assert info['signatures'] == {SET: ['set(uint256)'],
+                                  TOPIC: ['Set(uint256)']}
@@ -0,0 +1,57 @@
+import os
+import gzip
+import json
+
+import pytest
+from conftest import ROOT
+
+from ethersplay import snapshot
+
+with open(os.path.join(ROOT, 'examples', 'test.evm'), 'rb') as f:
+    CODE = f.read()
+SET_VALUE = 66
+
+
+def _branches(function):
+    return sorted((b.source_addr, b.dest_addr)
+                  for b in function.indirect_branches)
+
+
+@pytest.fixture
+def snapshot_path(monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_PATH', str(tmp_path))
+    return str(tmp_path)
+
+
+def test_disabled(load_view):
+    assert snapshot.save(load_view(CODE)) is None
+
+
+def test_round_trip(load_view, snapshot_path):
+    view = load_view(CODE)
+    view.set_comment_at(3, 'entry')
+    view.get_function_at(SET_VALUE).set_comment_at(SET_VALUE + 4, 'jump')
+    filename = snapshot.save(view)
+    assert filename == snapshot.snapshot_file(CODE)
+    assert snapshot.load(CODE)['hash'] == os.path.basename(filename)[:64]
+
+    restored = load_view(CODE)
+    assert SET_VALUE in restored.session_data['snapshot']
+    assert ([(f.start, f.name) for f in restored.functions] ==
+            [(f.start, f.name) for f in view.functions])
+    assert restored.address_comments == {3: 'entry'}
+    function = restored.get_function_at(SET_VALUE)
+    assert function.comments == {SET_VALUE + 4: 'jump'}
+    assert _branches(function) == _branches(view.get_function_at(SET_VALUE))
+
+
+def test_version_mismatch(load_view, snapshot_path):
+    filename = snapshot.save(load_view(CODE))
+    with gzip.open(filename, 'rt') as f:
+        saved = json.load(f)
+    saved['versions']['format'] -= 1
+    with gzip.open(filename, 'wt') as f:
+        json.dump(saved, f)
+    assert snapshot.load(CODE) is None
+    # analyzed from scratch
+    assert load_view(CODE).session_data.get('snapshot') is None
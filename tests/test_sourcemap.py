@@ -0,0 +1,67 @@
+import json
+
+from contracts import assemble
+
+from ethersplay import sourcemap
+from ethersplay.sourcemap import (SourceLocation, decode_srcmap,
+                                  load_source_map)
+
+LIBRARY = bytes.fromhex('aa' * 20)
+# calls a library: PUSH20 <address> plus its code around it
+CODE = (assemble(['CALLER']) + b'\x73' + LIBRARY +
+        assemble([('PUSH', 0), 'SSTORE', 'STOP']))
+SRCMAP = '0:10:0:-;12:4;;19:5:0:o;'
+PLACEHOLDER = '__$' + '0b' * 17 + '$__'
+
+
+def _combined(tmp_path, contracts):
+    (tmp_path / 'Token.sol').write_text('contract Token {\n  x = 1;\n}\n')
+    path = tmp_path / 'combined.json'
+    path.write_text(json.dumps({'sourceList': ['Token.sol'],
+                                'contracts': contracts}))
+    return str(path)
+
+
+def test_decode_srcmap():
+    assert decode_srcmap(SRCMAP) == [
+        SourceLocation(0, 10, 0, '-'), SourceLocation(12, 4, 0, '-'),
+        SourceLocation(12, 4, 0, '-'), SourceLocation(19, 5, 0, 'o'),
+        SourceLocation(19, 5, 0, 'o')]
+
+
+def test_unlinked_libraries_match(tmp_path):
+    code_hex = CODE.hex()
+    unlinked = code_hex[:4] + PLACEHOLDER + code_hex[44:]
+    filename = _combined(tmp_path, {
+        'Token.sol:Token': {'bin-runtime': unlinked,
+                            'srcmap-runtime': SRCMAP}})
+    source_map = load_source_map(filename, CODE)
+    assert source_map is not None
+    assert source_map.lookup(22) == SourceLocation(12, 4, 0, '-')
+    assert source_map.describe(source_map.lookup(25)) == 'Token.sol:2 x = 1'
+    # the code around the placeholder still has to match
+    other = CODE[:-1] + b'\xfe'
+    assert load_source_map(filename, other) is None
+    # older solc
+    old = code_hex[:4] + '__Token.sol:Lib'.ljust(40, '_') + code_hex[44:]
+    filename = _combined(tmp_path, {
+        'Token.sol:Token': {'bin-runtime': old, 'srcmap-runtime': SRCMAP}})
+    assert load_source_map(filename, CODE) is not None
+
+
+def test_maps_without_bytecode_need_a_name(tmp_path):
+    filename = _combined(tmp_path, {
+        'Token.sol:Other': {'bin-runtime': '', 'srcmap-runtime': SRCMAP},
+        'Token.sol:Token': {'srcmap-runtime': SRCMAP}})
+    assert load_source_map(filename, CODE) is None
+    source_map = load_source_map(filename, CODE, 'Token')
+    assert source_map.lookup(0) == SourceLocation(0, 10, 0, '-')
+    assert sourcemap.main([filename, _write(tmp_path, CODE), '0x0']) == 1
+    assert sourcemap.main([filename, _write(tmp_path, CODE), '0x0',
+                           '--contract', 'Token.sol:Token']) == 0
+
+
+def _write(tmp_path, code):
+    path = tmp_path / 'contract.evm'
+    path.write_bytes(code)
+    return str(path)
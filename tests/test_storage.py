@@ -0,0 +1,39 @@
+from contracts import assemble
+
+from ethersplay.storage import StorageNotification, get_storage_index
+
+MAPPING = ['CALLER', ('PUSH', 0), 'MSTORE', ('PUSH', 5), ('PUSH', 0x20),
+           'MSTORE', ('PUSH', 0x40), ('PUSH', 0), 'SHA3']
+ARRAY = [('PUSH', 7), ('PUSH', 0), 'MSTORE', ('PUSH', 0x20), ('PUSH', 0),
+         'SHA3', ('PUSH', 1), 'ADD']
+# balances[msg.sender] -> slot 3, items[1] -> slot 4
+CODE = assemble(MAPPING + ['SLOAD', ('PUSH', 3), 'SSTORE'] +
+                ARRAY + ['SLOAD', ('PUSH', 4), 'SSTORE', 'STOP'])
+SLOT3_SSTORE = len(assemble(MAPPING)) + 3
+ARRAY_SLOAD = len(assemble(MAPPING)) + 4 + len(assemble(ARRAY))
+
+
+def test_slots(load_view):
+    view = load_view(CODE)
+    index = get_storage_index(view)
+    assert sorted(index.slots) == ['0x3', '0x4', 'array:0x7', 'mapping:0x5']
+    assert index.readers('mapping:0x5') == {0: [len(assemble(MAPPING))]}
+    assert index.readers('array:0x7') == {0: [ARRAY_SLOAD]}
+    assert index.writers(3) == {0: [SLOT3_SSTORE]}
+    assert index.readers(3) == {}
+    assert index.to_dict()['functions'] == {'0x0': view.functions[0].name}
+
+
+def test_function_update(load_view):
+    view = load_view(CODE)
+    index = get_storage_index(view)
+    notification = StorageNotification()
+    # the slot 3 store now goes to slot 6
+    view.write(SLOT3_SSTORE - 1, b'\x06')
+    notification.function_updated(view, view.functions[0])
+    assert index.writers(3) == {}
+    assert index.writers(6) == {0: [SLOT3_SSTORE]}
+    assert index.readers('mapping:0x5') == {0: [len(assemble(MAPPING))]}
+
+    notification.function_removed(view, view.functions[0])
+    assert not index.slots and not index.functions
@@ -0,0 +1,43 @@
+import json
+
+from contracts import assemble
+
+from ethersplay import trace
+from ethersplay.trace import import_trace, value_comment
+
+# stores 0x2a at CALLER and calls into other code at depth 2 in between
+CODE = assemble([('PUSH', 0x2a), 'CALLER', 'SSTORE', 'STOP'])
+STEPS = [(0, 'PUSH1', 1, []), (2, 'CALLER', 1, ['0x2a']),
+         # a nested frame whose steps don't match the code
+         (0, 'PUSH1', 2, []), (2, 'CALLVALUE', 2, ['0x1']),
+         (3, 'SSTORE', 1, ['0x2a', '0xca11e2']), (4, 'STOP', 1, [])]
+
+
+def _write_trace(path, steps, times=1):
+    logs = [{'pc': pc, 'op': op, 'gas': 100, 'depth': depth,
+             'stack': stack} for pc, op, depth, stack in steps] * times
+    # the way debug_traceTransaction returns them
+    with open(path, 'w') as f:
+        json.dump({'jsonrpc': '2.0', 'id': 1, 'result': {
+            'gas': 21000, 'failed': False, 'structLogs': logs}}, f, indent=1)
+    return path
+
+
+def test_frames_running_the_code(tmp_path):
+    filename = _write_trace(str(tmp_path / 'trace.json'), STEPS)
+    result = import_trace(filename, CODE)
+    assert result.frames == 1
+    assert result.steps == 4
+    assert result.hits == {0: 1, 2: 1, 3: 1, 4: 1}
+    assert result.values[3] == [(0xca11e2, 0x2a)]
+    assert value_comment('SSTORE', result.values[3], False) == (
+        'trace: address = 0xca11e2, value = 0x2a')
+
+
+def test_chunks_are_stitched(tmp_path, monkeypatch):
+    filename = _write_trace(str(tmp_path / 'trace.json'), STEPS, times=50)
+    expected = import_trace(filename, CODE).to_dict()
+    assert expected['frames'] == 1
+    monkeypatch.setattr(trace, 'PARALLEL_MIN_SIZE', 0)
+    monkeypatch.setattr(trace, 'CHUNK_SIZE', 997)
+    assert import_trace(filename, CODE, jobs=2).to_dict() == expected